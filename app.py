@@ -1,569 +1,125 @@
 # app.py — Teapplix HD LTL BOL 產生器 + 推送前人工修改（整合 importorder.py 可用版本 & 修正成功偵測）
+# 抓單 / BOL / WMS 核心邏輯在 pipeline.py（無 Streamlit 依賴，排程可用 hd_batch.py）；這裡只放畫面。
 import os
-import io
-import zipfile
-from datetime import datetime, timedelta
+from datetime import datetime
 
-import requests
 import streamlit as st
 import re
 
-try:
-    from zoneinfo import ZoneInfo
-except ImportError:
-    from backports.zoneinfo import ZoneInfo
-
-from dotenv import load_dotenv
-import fitz  # PyMuPDF
-
-# ★ 使用你可用的 SOAP 封裝與送單邏輯
-from importorder import send_create_order  # endpoint, app_token, app_key, params, service
+import metrics
+import pipeline
+from profiling import profiled
+from importorder import send_create_order, parse_soap_response  # endpoint, app_token, app_key, params, service
+from push_ledger import PushLedger
 
 # ---------- 應用設定 ----------
 APP_TITLE = "HD LTL Orders 推送到 海外倉 和 產生BOL"
-TEMPLATE_PDF = "BOL.pdf"
-OUTPUT_DIR = "output_bols"
-BASE_URL  = "https://api.teapplix.com/api2/OrderNotification"  # ← 保留 GET + 固定路徑
-STORE_KEY = "HD"
-SHIPPED_DEFAULT = "0"   # 一般抓單預設：未出貨
-PAGE_SIZE = 500
-
-CHECKBOX_FIELDS   = {"MasterBOL", "Term_Pre", "Term_Collect", "Term_CustChk", "FromFOB", "ToFOB"}
-FORCE_TEXT_FIELDS = {"PrePaid", "Collect", "3rdParty"}
-
-BILL_NAME         = "THE HOME DEPOT"
-BILL_ADDRESS      = "2455 PACES FERRY RD"
-BILL_CITYSTATEZIP = "ATLANTA, GA 30339"
 
 # ---------- secrets / env ----------
-load_dotenv(override=False)
 def _sec(name, default=""):
     return st.secrets.get(name, os.getenv(name, default))
 
-TEAPPLIX_TOKEN = _sec("TEAPPLIX_TOKEN", "")
-AUTH_BEARER    = _sec("TEAPPLIX_AUTH_BEARER", "")
-X_API_KEY      = _sec("TEAPPLIX_X_API_KEY", "")
-PASSWORD       = _sec("APP_PASSWORD", "")
-
-# 送單服務名（沿用你可用版本的預設 createOrder；若供應商改名，可在 .env 或 secrets 覆寫）
-WMS_SERVICE = _sec("WMS_SERVICE", "createOrder")
-
-# UI 倉庫基本資料（BOL 用）
-WAREHOUSES = {
-    "CA 91789": {
-        "name": _sec("W1_NAME", "Festival Neo CA"),
-        "addr": _sec("W1_ADDR", "5500 Mission Blvd"),
-        "citystatezip": _sec("W1_CITYSTATEZIP", "Montclair, CA 91763"),
-        "sid": _sec("W1_SID", "CA-001"),
-    },
-    "NJ 08816": {
-        "name": _sec("W2_NAME", "Festival Neo NJ"),
-        "addr": _sec("W2_ADDR", "10 Main St"),
-        "citystatezip": _sec("W2_CITYSTATEZIP", "East Brunswick, NJ 08816"),
-        "sid": _sec("W2_SID", "NJ-001"),
-    },
-}
-
-# WMS 送單憑證（依倉別）
-WMS_CONFIGS = {
-    "CA 91789": {
-        "ENDPOINT_URL": _sec("W1_WMS_ENDPOINT", ""),
-        "APP_TOKEN": _sec("W1_WMS_APP_TOKEN", ""),
-        "APP_KEY": _sec("W1_WMS_APP_KEY", ""),
-        "WAREHOUSE_CODE": _sec("W1_WMS_CODE", "CAW"),
-    },
-    "NJ 08816": {
-        "ENDPOINT_URL": _sec("W2_WMS_ENDPOINT", ""),
-        "APP_TOKEN": _sec("W2_WMS_APP_TOKEN", ""),
-        "APP_KEY": _sec("W2_WMS_APP_KEY", ""),
-        "WAREHOUSE_CODE": _sec("W2_WMS_CODE", "NJW"),
-    },
-}
-
-# ---------- 常用工具 ----------
-def phoenix_range_days(days=3):
-    tz = ZoneInfo("America/Phoenix")
-    now = datetime.now(tz)
-    end   = now.replace(hour=23, minute=59, second=59, microsecond=0)
-    start = (end - timedelta(days=days-1)).replace(hour=0, minute=0, second=0, microsecond=0)
-    fmt = "%Y-%m-%dT%H:%M:%S"
-    return start.strftime(fmt), end.strftime(fmt)
-
-def default_pickup_date_str():
-    tz = ZoneInfo("America/Phoenix")
-    return (datetime.now(tz) + timedelta(days=2)).date().isoformat()
-
-def get_headers():
-    hdr = {
-        "APIToken": TEAPPLIX_TOKEN,
-        "Content-Type": "application/json;charset=UTF-8",
-        "Accept": "application/json",
-    }
-    if AUTH_BEARER:
-        hdr["Authorization"] = f"Bearer {AUTH_BEARER}"
-    if X_API_KEY:
-        hdr["x-api-key"] = X_API_KEY  # 依你可用檔案的小寫 key
-    return hdr
-
-def oz_to_lb(oz):
-    try:
-        return round(float(oz)/16.0, 2)
-    except Exception:
-        return None
-
-def summarize_packages(order):
-    details = order.get("ShippingDetails") or []
-    total_pkgs = 0
-    total_lb = 0.0
-    for sd in details:
-        pkg = sd.get("Package") or {}
-        count = int(pkg.get("IdenticalPackageCount") or 1)
-        wt = pkg.get("Weight") or {}
-        lb = oz_to_lb(wt.get("Value")) or 0.0
-        total_pkgs += max(1, count)
-        total_lb   += lb * max(1, count)
-    return total_pkgs, int(round(total_lb))
-
-def override_carrier_name_by_scac(scac: str, current_name: str) -> str:
-    s = (scac or "").strip().upper()
-    mapping = {
-        "EXLA": "Estes Express Lines",
-        "AACT": "AAA Cooper Transportation",
-        "CTII": "Central Transport Inc.",
-        "CETR": "Central Transport Inc.",
-        "ABF":  "ABF",
-        "PITD": "PITT Ohio",
-        "FXFE": "FedEx Freight",
-        "UPGF": "UPS Freight",
-        "RLCA": "R+L Carriers",
-        "SAIA": "SAIA",
-        "ODFL": "Old Dominion",
-        "PYLR": "A Duie Pyle",
-        "ABFS": "ABF Freight System",
-    }
-    return mapping.get(s, current_name)
-
-def group_by_original_txn(orders):
-    grouped = {}
-    for order in orders:
-        oid = (order.get("OriginalTxnId") or "").strip()
-        if not oid:
-            continue
-        grouped.setdefault(oid, []).append(order)
-    return grouped
-
-def _first_item(order):
-    items = order.get("OrderItems") or []
-    if isinstance(items, list) and items:
-        return items[0]
-    if isinstance(items, dict):
-        return items
-    return {}
-
-def _desc_value_from_order(order):
-    sku = (_first_item(order).get("ItemSKU") or _first_item(order).get("ItemCustom"))
-    #dec = (_first_item(order).get("Description") or _first_item(order).get("Amount"))
-    return f"{sku}  (Electric Fireplace)".strip()
-    #return f"{sku}  ({dec})".strip()
-
-def _sku8_from_order(order):
-    sku = (_first_item(order).get("ItemSKU") or _first_item(order).get("ItemCustom"))
-    return sku[:8] if sku else ""
-
-def _qty_from_order(order):
-    it = _first_item(order)
-    try:
-        return int(it.get("Quantity") or 0)
-    except Exception:
-        return 0
-
-def _sum_group_totals(group):
-    total_pkgs = 0
-    total_lb = 0.0
-    for od in group:
-        pkgs, lb = summarize_packages(od)
-        total_pkgs += int(pkgs or 0)
-        total_lb   += float(lb or 0.0)
-    return total_pkgs, int(round(total_lb))
-
-def _parse_order_date_str(first_order):
-    tz_phx = ZoneInfo("America/Phoenix")
-    od = first_order.get("OrderDetails") or {}
-    candidates = [
-        od.get("PaymentDate"),
-        od.get("OrderDate"),
-        first_order.get("PaymentDate"),
-        first_order.get("Created"),
-        first_order.get("CreateDate"),
-    ]
-    raw = next((v for v in candidates if v), None)
-    if not raw: return ""
-    val = str(raw).strip()
-    dt = None
-    try:
-        if "T" in val:
-            dt = datetime.fromisoformat(val.replace("Z", "+00:00"))
-        else:
-            for fmt in ("%Y/%m/%d %H:%M:%S", "%Y-%m-%d %H:%M:%S", "%Y/%m/%d", "%Y-%m-%d"):
-                try:
-                    dt = datetime.strptime(val, fmt); break
-                except Exception: continue
-    except Exception:
-        dt = None
-    if dt is None:
-        try: dt = datetime.fromisoformat(val[:19])
-        except Exception: return ""
-    if dt.tzinfo is None:
-        dt = dt.replace(tzinfo=tz_phx)
-    dt_phx = dt.astimezone(tz_phx)
-    return dt_phx.strftime("%m/%d/%y")
-
-# ---- 解析 SOAP 內 JSON（上移到此，避免未定義） ----
-def _try_extract_json(resp_text: str):
-    if not isinstance(resp_text, str) or not resp_text:
-        return {}
-    start = resp_text.find("{")
-    end = resp_text.rfind("}")
-    if start == -1 or end == -1 or end <= start:
-        return {}
-    import json
-    js = resp_text[start:end+1]
-    try:
-        return json.loads(js)
-    except Exception:
-        j2 = js.replace("&quot;", '"').replace("&lt;", "<").replace("&gt;", ">")
-        try:
-            return json.loads(j2)
-        except Exception:
-            return {}
+@st.cache_resource(show_spinner=False)
+def _init_pipeline():
+    """
+    核心設定改由 st.secrets → 環境變數讀取；核心的訊息回報轉成 st.error / st.warning / st.info。
+    pipeline 的設定是模組全域狀態，每個行程只設定一次：各 session 的 rerun 與背景 BolJob 不會互相換掉設定
+    （修改 secrets 後需重啟 app 或清除 cache_resource 才會生效）。
+    """
+    pipeline.load_config(_sec)
+    pipeline.set_notifier(lambda level, msg: getattr(st, level)(msg))
+    return True
+
+_init_pipeline()
+
+from pipeline import (  # noqa: E402  （須在 load_config 之後匯入設定值）
+    OUTPUT_DIR, TEAPPLIX_TOKEN, WAREHOUSES, WMS_SERVICE, FLATTEN_BOL,
+    default_pickup_date_str, orders_fingerprint, group_by_original_txn,
+    _sku8_from_order, _parse_order_date_str,
+    iter_orders, iter_orders_by_pos,
+    build_row_from_group, build_wms_params_from_group,
+    resolve_wms_target, wms_status, wms_message, get_push_ledger, push_wms_orders_bulk,
+    BolJob, METRICS_PATH, flush_metrics, PROFILE_ACTIONS, PROFILE_DIR,
+)
+
+PASSWORD = _sec("APP_PASSWORD", "")
+# 產生的 BOL 是否另存一份到 OUTPUT_DIR（下載用的 ZIP / PDF 一律直接由記憶體產生）
+SAVE_BOL_TO_DISK = str(_sec("SAVE_BOL_TO_DISK", "1")).strip().lower() in ("1", "true", "yes", "on")
+# 推送前人工修改：PO 數超過此值時預設用表格模式（逐筆展開每筆都是一組輸入框，數百筆會很慢）
+WMS_EXPANDER_MAX = int(_sec("WMS_EXPANDER_MAX", "20") or 20)
 
-# ---------- BOL 產號工具 ----------
-def luhn_check_digit(number_without_check: str) -> str:
+def profile_enabled() -> bool:
+    """PROFILE_ACTIONS 常開，或側邊『效能計時』內勾選了剖析（只影響此 session）。"""
+    return PROFILE_ACTIONS or bool(st.session_state.get("profile_actions"))
+
+def show_profile(prof):
+    if prof.path:
+        st.caption(f"🔬 剖析報告：{prof.path}（{prof.wall:.2f} 秒，記憶體峰值 {prof.peak_bytes / 1048576:.1f} MiB）")
+    elif prof.error:
+        st.caption(f"🔬 剖析失敗：{prof.error}")
+
+# ---------- WMS 表格編輯（大量 PO 用） ----------
+WMS_GRID_FIELDS = ("warehouse_code", "reference_no", "tracking_no", "platform_shop", "shipping_method")
+
+def pickup_date_from_params(params: dict) -> str:
+    """由 order_desc 的 "pick up: YYYY-MM-DD" 取出取件日；沒有時用預設（兩天後）。"""
+    m = re.search(r"pick up:\s*(\d{4}-\d{2}-\d{2})", params.get("order_desc") or "")
+    return m.group(1) if m else default_pickup_date_str()
+
+def wms_grid_rows(oids, edit_map: dict, ledger: PushLedger = None):
     """
-    回傳 Luhn 校驗碼（單一數字字元）。
-    number_without_check 須為數字字串（長度任意）；此函式不做長度檢查。
+    把 edit_map 中指定 PO 攤成兩張表：
+    訂單層級一列一 PO；items 一列一 SKU（以 PO 欄關聯）。
     """
-    s = number_without_check[::-1]
-    total = 0
-    for i, ch in enumerate(s, start=1):
-        d = ord(ch) - 48  # '0' -> 48
-        if (i % 2) == 1:
-            # 反向序列中奇數位（原字串從右數的偶數位）→ 加倍
-            d *= 2
-            if d > 9:
-                d -= 9
-        total += d
-    check = (10 - (total % 10)) % 10
-    return str(check)
-
-def build_bol_number(oid: str) -> str:
+    order_rows, item_rows = [], []
+    for oid in oids:
+        p = edit_map[oid]["params"]
+        row = {"PO": oid, "pickup_date": datetime.fromisoformat(pickup_date_from_params(p)).date()}
+        for k in WMS_GRID_FIELDS:
+            row[k] = p.get(k, "")
+        prev = ledger.get(p.get("warehouse_code", ""), p.get("reference_no", "")) if ledger is not None else None
+        row["Pushed"] = prev["pushed_at"] if prev and prev["ok"] else ""
+        order_rows.append(row)
+        for it in p.get("items", []):
+            item_rows.append({"PO": oid, "product_sku": it.get("product_sku", ""), "quantity": int(it.get("quantity", 1))})
+    return order_rows, item_rows
+
+def apply_wms_grid_edits(edit_map: dict, order_rows, item_rows):
     """
-    規則：
-      1) 固定前 9 碼：081003089
-      2) 接上 oid 的數字（去除非數字）
-      3) 右側補 0，直到長度達 19
-      4) 第 20 碼為 Luhn 校驗碼
+    表格編輯結果一次寫回 edit_map（只動出現在 order_rows 的 PO）。
+    items 依 PO 重組：空 SKU 或數量 < 1 的列略過。回傳 (更新的 PO 數, 略過的 item 列數)。
     """
-    prefix = "081003089"
-    oid_digits = re.sub(r"\D", "", f"{oid or ''}")
-    base = (prefix + oid_digits)[:19]      # 超過則截斷到 19
-    base = base.ljust(19, "0")             # 不足則補 0 到 19
-    check = luhn_check_digit(base)
-    return base + check                    # 共 20 碼
-
-# ---------- API：抓取一般訂單（GET） ----------
-def fetch_orders(days: int):
-    ps, pe = phoenix_range_days(days)
-    page = 1
-    all_orders = []
-    while True:
-        params = {
-            "PaymentDateStart": ps,
-            "PaymentDateEnd": pe,
-            "Shipped": SHIPPED_DEFAULT,
-            "StoreKey": STORE_KEY,
-            "PageSize": str(PAGE_SIZE),
-            "PageNumber": str(page),
-            "Combine": "combine",
-            "DetailLevel": "shipping|inventory|marketplace",
-        }
-        r = requests.get(BASE_URL, headers=get_headers(), params=params, timeout=45)
-        if r.status_code != 200:
-            st.error(f"API 錯誤: {r.status_code}\n{r.text}"); break
+    items_by_po = {}
+    skipped = 0
+    for it in item_rows:
+        oid = it.get("PO")
+        sku = str(it.get("product_sku") or "").strip()
         try:
-            data = r.json()
-        except Exception:
-            st.error(f"JSON 解析錯誤：{r.text[:1000]}"); break
-        orders = data.get("orders") or data.get("Orders") or []
-        if not orders: break
-        for o in orders:
-            od = o.get("OrderDetails") or {}
-            if (od.get("ShipClass") or "").strip().upper() != "UNSP_CG":
-                all_orders.append(o)
-        if len(orders) < PAGE_SIZE: break
-        page += 1
-    return all_orders
-
-# ---------- API：以 PO(OriginalTxnId) 查詢（固定最近 14 天 + 嚴格等於過濾） ----------
-def fetch_orders_by_pos(pos_list, shipped: str):
-    ps, pe = phoenix_range_days(14)  # ★ 固定 14 天
-    results = []
-    for oid in pos_list:
-        oid = (oid or "").strip()
-        if not oid:
+            qty = int(it.get("quantity") or 0)
+        except (TypeError, ValueError):
+            qty = 0
+        if oid not in edit_map or not sku or qty < 1:
+            skipped += 1
             continue
-        params = {
-            "StoreKey": STORE_KEY,
-            "DetailLevel": "shipping|inventory|marketplace",
-            "Combine": "combine",
-            "PageSize": str(PAGE_SIZE),
-            "PageNumber": "1",
-            "OriginalTxnId": oid,
-            "PaymentDateStart": ps,
-            "PaymentDateEnd": pe,
-        }
-        if shipped in ("0", "1"):
-            params["Shipped"] = shipped
-        try:
-            r = requests.get(BASE_URL, headers=get_headers(), params=params, timeout=45)
-        except Exception as e:
-            st.error(f"PO {oid} 連線錯誤：{e}"); continue
-        if r.status_code != 200:
-            st.error(f"PO {oid} API 錯誤: {r.status_code}\n{r.text[:400]}"); continue
-        try:
-            data = r.json()
-        except Exception:
-            st.error(f"PO {oid} 回傳非 JSON：{r.text[:400]}"); continue
-
-        raw_orders = data.get("orders") or data.get("Orders") or []
-
-        # 嚴格等於過濾 + 排除 UNSP_CG
-        for o in raw_orders:
-            if str(o.get("OriginalTxnId") or "").strip() == oid:
-                od = o.get("OrderDetails") or {}
-                if (od.get("ShipClass") or "").strip().upper() != "UNSP_CG":
-                    results.append(o)
-
-        if raw_orders and not any(str(o.get("OriginalTxnId") or "").strip() == oid for o in raw_orders):
-            st.info(f"提示：API 在最近 14 天回 {len(raw_orders)} 筆，但無『OriginalTxnId 等於 {oid}』資料。")
-
-    if shipped in ("0", "1"):
-        results = [o for o in results if str(o.get("Shipped") or o.get("shipped") or "").strip() == shipped]
-    return results
-
-# ---------- PDF 填寫 ----------
-def set_widget_value(widget, name, value):
-    try:
-        is_checkbox_type  = (widget.field_type == fitz.PDF_WIDGET_TYPE_CHECKBOX)
-        is_checkbox_named = (name in CHECKBOX_FIELDS)
-        is_forced_text    = (name in FORCE_TEXT_FIELDS)
-        is_checkbox       = (is_checkbox_type or is_checkbox_named) and not is_forced_text
-        if is_checkbox:
-            v = str(value).strip().lower()
-            widget.field_value = "Yes" if v in {"on","yes","1","true","x","✔"} else "Off"
-        else:
-            widget.field_value = "" if value is None else str(value)
-        widget.update()
-        return True
-    except Exception as e:
-        st.warning(f"填欄位 {name} 失敗：{e}"); return False
-
-def build_row_from_group(oid, group, wh_key: str):
-    first = group[0]
-    to = first.get("To") or {}
-    od = first.get("OrderDetails") or {}
-
-    ship_details = (first.get("ShippingDetails") or [{}])[0] or {}
-    pkg = ship_details.get("Package") or {}
-    tracking = pkg.get("TrackingInfo") or {}
-
-    scac_from_shipclass = (od.get("ShipClass") or "").strip()
-    carrier_name_raw = (tracking.get("CarrierName") or "").strip()
-    carrier_name_final = override_carrier_name_by_scac(scac_from_shipclass, carrier_name_raw)
-
-    street  = (to.get("Street") or "")
-    street2 = (to.get("Street2") or "")
-    to_address = (street + (" " + street2 if street2 else "")).strip()
-    custom_code = (od.get("Custom") or "").strip()
-
-    total_pkgs, total_lb = _sum_group_totals(group)
-
-    # ★ 依規則生成 20 碼 BOL
-    bol_num = build_bol_number(oid)
-
-    WH = WAREHOUSES.get(wh_key, list(WAREHOUSES.values())[0])
-
-    row = {
-        "BillName": BILL_NAME,
-        "BillAddress": BILL_ADDRESS,
-        "BillCityStateZip": BILL_CITYSTATEZIP,
-        "ToName": to.get("Name", ""),
-        "ToAddress": to_address,
-        "ToCityStateZip": f"{to.get('City','')}, {to.get('State','')} {to.get('ZipCode','')}".strip().strip(", "),
-        "ToCID": to.get("PhoneNumber", ""),
-        "FromName": WH["name"],
-        "FromAddr": WH["addr"],
-        "FromCityStateZip": WH["citystatezip"],
-        "FromSIDNum": WH["sid"],
-        "3rdParty": "X", "PrePaid": "", "Collect": "",
-        # 原本空字串 → 改成 20 碼 BOL 號
-        "BOLnum": bol_num,
-        "CarrierName": carrier_name_final,
-        "SCAC": scac_from_shipclass,
-        "PRO": tracking.get("TrackingNumber", ""),
-        "CustomerOrderNumber": custom_code,
-        "BillInstructions": f"PO#{oid or bol_num}",
-        "OrderNum1": custom_code,
-        "SpecialInstructions": "",
-        "TotalPkgs": str(total_pkgs) if total_pkgs else "",
-        "Total_Weight": str(total_lb) if total_lb else "",
-        "Date": datetime.now().strftime("%Y/%m/%d"),
-        "Page_ttl": "1",
-        "NMFC1": "69420",
-        "Class1": "125",
-    }
-
-    total_qty_sum = 0
-    for idx, od_item in enumerate(group, start=1):
-        desc_val = _desc_value_from_order(od_item)
-        qty = _qty_from_order(od_item)
-        if desc_val:
-            row[f"Desc_{idx}"] = desc_val
-            row[f"HU_Type_{idx}"]  = "piece"
-            row[f"Pkg_Type_{idx}"] = "piece"
-            row[f"HU_QTY_{idx}"]   = str(qty) if qty else ""
-            row[f"Pkg_QTY_{idx}"]  = str(qty) if qty else ""
-            total_qty_sum += qty
-            row[f"NMFC{idx}"] = "69420"
-            row[f"Class{idx}"] = "125"
-
-    row["NumPkgs1"] = str(total_qty_sum)
-    row["Weight1"] = "130 lbs" if total_qty_sum <= 1 else f"{130 + (total_qty_sum - 1) * 30} lbs"
-    return row, WH
-
-def fill_pdf(row: dict, out_path: str):
-    if not os.path.exists(TEMPLATE_PDF):
-        raise FileNotFoundError(f"找不到 BOL 模板：{TEMPLATE_PDF}")
-    doc = fitz.open(TEMPLATE_PDF)
-    for page in doc:
-        for w in (page.widgets() or []):
-            name = w.field_name
-            if name and name in row:
-                set_widget_value(w, name, row[name])
-    try: doc.need_appearances = True
-    except Exception: pass
-    os.makedirs(os.path.dirname(out_path), exist_ok=True)
-    doc.save(out_path, deflate=True, incremental=False, encryption=fitz.PDF_ENCRYPT_KEEP)
-    doc.close()
-
-# ---------- WMS 參數組裝 ----------
-def _aggregate_items_by_sku(group):
-    sku_qty = {}
-    for od in group:
-        items = od.get("OrderItems") or []
-        if isinstance(items, dict):
-            items = [items]
-        for it in items:
-            sku = (it.get("ItemSKU") or it.get("ItemCustom")).strip()
-            if not sku:
-                continue
-            try:
-                q = int(it.get("Quantity") or 0)
-            except Exception:
-                q = 0
-            if q <= 0:
-                continue
-            sku_qty[sku] = sku_qty.get(sku, 0) + q
-    items_arr = [{"product_sku": sku, "quantity": qty} for sku, qty in sku_qty.items()]
-    return items_arr
-
-def decide_shipping_method(wh_key: str, items: list[dict]) -> str:
-    """
-    根據倉庫與 SKU/數量規則決定 shipping_method。
-
-    規則：
-      - 如果為 NJ 08816 → "CUSTOMER_SHIP"
-      - 如果為 CA 91789：
-          - 僅 1 個 SKU 且其 quantity == 1 → "SELF_LTL-SINGLE"
-          - 其他情況 → "ALL_SELF_LTL"
-      - 其他倉（若未定義）預設回傳 "CUSTOMER_SHIP"
-    """
-    wh_key = (wh_key or "").strip()
-    if wh_key == "NJ 08816":
-        return "CUSTOMER-LTL"
-
-    if wh_key == "CA 91789":
-        # items 結構來自 _aggregate_items_by_sku：
-        # [{"product_sku": "<SKU>", "quantity": <int>}, ...]
-        if len(items) == 1:
-            only_item_qty = int(items[0].get("quantity") or 0)
-            if only_item_qty == 1:
-                return "SELF_LTL-SINGLE"
-        return "ALL_SELF_LTL"
-
-    # 預設：未指定規則的倉別
-    return "CUSTOMER-LTL"
-
-
-def build_wms_params_from_group(oid: str, group: list, wh_key: str, pickup_date_str: str) -> dict:
-    first = group[0]
-    to = first.get("To") or {}
-    od = first.get("OrderDetails") or {}
-
-    province = (to.get("State") or "").strip()
-    city = (to.get("City") or "").strip()
-    street = (to.get("Street") or "").strip()
-    street2 = (to.get("Street2") or "").strip()
-    zipcode = (to.get("ZipCode") or "").strip()
-    company = (to.get("Company") or "").strip()
-    name = (to.get("Name") or "").strip()
-    phone = (to.get("PhoneNumber") or "").strip()
-    shipclass = (od.get("ShipClass") or "").strip()
-
-    # ★★★ 取得 carrier_name_final，供 platform_shop 回退用
-    ship_details = (first.get("ShippingDetails") or [{}])[0] or {}
-    pkg = ship_details.get("Package") or {}
-    tracking = pkg.get("TrackingInfo") or {}
-    carrier_name_raw = (tracking.get("CarrierName") or "").strip()
-    carrier_name_final = override_carrier_name_by_scac(shipclass, carrier_name_raw)
-
-    # 聚合 SKU 數量
-    items = _aggregate_items_by_sku(group)
-
-    # 依倉庫 + items 規則決定 shipping_method
-    shipping_method = decide_shipping_method(wh_key, items)
-
-    test_oid = f"{oid}".strip()
-
-    params = {
-        "platform": "OTHER",
-        "allocated_auto": "0",
-        "warehouse_code": WMS_CONFIGS.get(wh_key, {}).get("WAREHOUSE_CODE", ""),
-        "shipping_method": shipping_method,           # ← 這裡改成動態
-        "reference_no": test_oid,                     # 測試：test- + PO
-        "order_desc": f"pick up: {pickup_date_str}" if pickup_date_str else "",
-        "remark": "",
-        "country_code": "US",
-        "province": province,
-        "city": city,
-        "district": city,
-        "address1": street,
-        "address2": street2,
-        "address3": "",
-        "zipcode": zipcode,
-        "company": company,
-        "name": name,
-        "phone": phone,
-        "cell_phone": "",
-        "phone_extension": "",
-        "email": "",
-        # ★★★ 先用 carrier_name_final，找不到再用 shipclass
-        "platform_shop": carrier_name_final or shipclass,
-        "items": items,                               # ← 使用聚合後的 SKU/數量
-        "tracking_no": "",                            # 測試：test- + PO
-    }
-    return params
+        items_by_po.setdefault(oid, []).append({"product_sku": sku, "quantity": qty})
 
+    updated = 0
+    for row in order_rows:
+        oid = row["PO"]
+        rec = edit_map.get(oid)
+        if rec is None:
+            continue
+        new_params = dict(rec["params"])
+        for k in WMS_GRID_FIELDS:
+            new_params[k] = str(row.get(k) or "").strip()
+        pickup = row.get("pickup_date")
+        if pickup:
+            pickup = pickup.strftime("%Y-%m-%d") if hasattr(pickup, "strftime") else str(pickup)[:10]
+            new_params["order_desc"] = f"pick up: {pickup}"
+        new_params["items"] = items_by_po.get(oid, [])
+        rec["params"] = new_params
+        updated += 1
+    return updated, skipped
 
 # ---------- Streamlit UI ----------
 st.set_page_config(page_title=APP_TITLE, layout="wide")
@@ -591,10 +147,16 @@ if not TEAPPLIX_TOKEN:
 
 # 側邊：抓單（GET）
 days = st.sidebar.selectbox("抓取天數（一般抓單）", options=[1,2,3,4,5,6,7], index=2)
+force_full = st.sidebar.checkbox("完整重新抓取（忽略本地快取高水位）", value=False)
 if st.sidebar.button("抓取訂單", use_container_width=True):
-    st.session_state["orders_raw"] = fetch_orders(days)
-    st.session_state.pop("table_rows_override", None)
-    st.sidebar.success(f"已抓取最近 {days} 天的一般訂單。")
+    with profiled("fetch_orders", profile_enabled(), PROFILE_DIR) as prof:
+        # 邊抓邊過濾邊分組，session 只保留分組索引（指紋供衍生表格快取判斷）
+        st.session_state["orders_grouped"] = group_by_original_txn(iter_orders(days, force_full=force_full))
+        st.session_state["orders_fingerprint"] = orders_fingerprint(st.session_state["orders_grouped"])
+        st.session_state.pop("table_rows_override", None)
+        st.session_state.pop("table_view", None)   # 重新抓單一律重建衍生表格
+        st.sidebar.success(f"已抓取最近 {days} 天的一般訂單。")
+    show_profile(prof)
 
 # 側邊：PO 搜尋（固定 14 天）
 st.sidebar.markdown("---")
@@ -602,27 +164,31 @@ st.sidebar.subheader("🔎 PO 搜尋（最近 14 天）")
 po_text = st.sidebar.text_area("輸入 PO（每行一個）", placeholder="例如：\n32585340\n46722012", height=120)
 shipped_choice = st.sidebar.selectbox("出貨狀態（Shipped）", options=["不限", "未出貨", "已出貨"], index=0)
 if st.sidebar.button("搜尋 PO（14 天內）", use_container_width=True):
-    raw_lines = (po_text or "").splitlines()
-    pos_list = [ln.strip() for ln in raw_lines if ln.strip()]
-    if not pos_list:
-        st.warning("請輸入至少一個 PO（每行一個）。")
-    else:
-        shipped_val = "0" if shipped_choice.endswith("(0)") else ("1" if shipped_choice.endswith("(1)") else "")
-        orders = fetch_orders_by_pos(pos_list, shipped_val)
-        st.session_state["orders_raw"] = orders
-        st.session_state.pop("table_rows_override", None)
-        st.success(f"PO 搜尋完成（14 天內）：輸入 {len(pos_list)} 筆 PO，取得 {len(orders)} 筆原始訂單，並依 PO 合併顯示於下方表格。")
+    with profiled("search_po", profile_enabled(), PROFILE_DIR) as prof:
+        raw_lines = (po_text or "").splitlines()
+        pos_list = [ln.strip() for ln in raw_lines if ln.strip()]
+        if not pos_list:
+            st.warning("請輸入至少一個 PO（每行一個）。")
+        else:
+            shipped_val = "0" if shipped_choice.endswith("(0)") else ("1" if shipped_choice.endswith("(1)") else "")
+            grouped_pos = group_by_original_txn(iter_orders_by_pos(pos_list, shipped_val, force_full=force_full))
+            st.session_state["orders_grouped"] = grouped_pos
+            st.session_state["orders_fingerprint"] = orders_fingerprint(grouped_pos)
+            st.session_state.pop("table_rows_override", None)
+            st.session_state.pop("table_view", None)   # 重新抓單一律重建衍生表格
+            n_orders = sum(len(g) for g in grouped_pos.values())
+            st.success(f"PO 搜尋完成（14 天內）：輸入 {len(pos_list)} 筆 PO，取得 {n_orders} 筆原始訂單，並依 PO 合併顯示於下方表格。")
+    show_profile(prof)
 
 # ======== 合併表（依 OriginalTxnId 合併） + 產 BOL ========
-orders_raw = st.session_state.get("orders_raw", None)
+orders_grouped = st.session_state.get("orders_grouped", None)
 
-def build_table_rows_from_orders(orders_raw):
-    grouped = group_by_original_txn(orders_raw or [])
+def _base_table_rows(grouped):
+    """不含 Pushed 欄的表格列（日期解析等較重的部分），每次抓單只需算一次。"""
     table_rows = []
     for oid, group in grouped.items():
         first = group[0]
-        od = first.get("OrderDetails") or {}
-        scac = (od.get("ShipClass") or "").strip()
+        scac = first.ship_class.strip()
         sku8 = _sku8_from_order(first)
         order_date_str = _parse_order_date_str(first)
         table_rows.append({
@@ -631,13 +197,34 @@ def build_table_rows_from_orders(orders_raw):
             "OriginalTxnId": oid,
             "SKU8": sku8,
             "SCAC": scac,
-            "ToState": (first.get("To") or {}).get("State",""),
+            "ToState": first.to_state,
             "OrderDate": order_date_str,
         })
-    return grouped, table_rows
+    return table_rows
 
-if orders_raw:
-    grouped, table_rows = build_table_rows_from_orders(orders_raw)
+def _with_pushed(rows, ledger: PushLedger = None):
+    # reference_no 預設即 PO；列出已成功建單的 warehouse_code（推送紀錄會變，每次 rerun 重查，O(1) 查表）
+    return [
+        {**r, "Pushed": ", ".join(sorted(ledger.pushed_warehouses(r["OriginalTxnId"]))) if ledger is not None else ""}
+        for r in rows
+    ]
+
+def get_table_rows(grouped, fingerprint: str = None, ledger: PushLedger = None):
+    """
+    依指紋快取衍生表格：同一批抓單結果在各次 rerun（點選、勾選、編輯）間只建一次基礎列，
+    抓單 / PO 搜尋會清掉快取，指紋也含訂單內容，內容有變必定重建。快取放在 session_state，各使用者分開。
+    """
+    fp = fingerprint or orders_fingerprint(grouped)
+    cached = st.session_state.get("table_view")
+    if not cached or cached[0] != fp:
+        cached = (fp, _base_table_rows(grouped))
+        st.session_state["table_view"] = cached
+    return _with_pushed(cached[1], ledger)
+
+if orders_grouped:
+    grouped = orders_grouped
+    push_ledger = get_push_ledger()
+    table_rows = get_table_rows(grouped, st.session_state.get("orders_fingerprint"), push_ledger)
     st.caption(f"共 {len(table_rows)} 筆")
 
     # 可編輯表格
@@ -656,12 +243,24 @@ if orders_raw:
         "SCAC": st.column_config.TextColumn("SCAC", disabled=True),
         "ToState": st.column_config.TextColumn("州", disabled=True),
         "OrderDate": st.column_config.TextColumn("訂單日期 (mm/dd/yy)", disabled=True),
+        "Pushed": st.column_config.TextColumn("已推送", disabled=True),
     },
     key="orders_table",
     use_container_width=True,
 )
 
     # 產出 BOL（勾選列）
+    bol_output_mode = st.radio(
+        "BOL 輸出方式",
+        options=["ZIP（每張 BOL 一個檔）", "合併成單一 PDF（含 PO 書籤）"],
+        index=0,
+        horizontal=True,
+    )
+    col_save, col_flat = st.columns(2)
+    with col_save:
+        save_to_disk = st.checkbox(f"同時存檔到 {OUTPUT_DIR}/", value=SAVE_BOL_TO_DISK)
+    with col_flat:
+        flatten_bol = st.checkbox("攤平 BOL（移除表單欄位，檔案較小、列印較快、不可再編輯）", value=FLATTEN_BOL)
     if st.button("產生 BOL（勾選列）", type="primary", use_container_width=True):
         selected = [r for r in edited if r.get("Select")]
         if not selected:
@@ -672,8 +271,7 @@ if orders_raw:
             if missing:
                 st.error(f"以下 PO 未選倉庫，請先選擇倉庫：{', '.join(missing)}")
             else:
-                os.makedirs(OUTPUT_DIR, exist_ok=True)
-                made_files = []
+                jobs = []
                 for row_preview in selected:
                     oid = row_preview["OriginalTxnId"]
                     wh_key = row_preview["Warehouse"]
@@ -681,50 +279,90 @@ if orders_raw:
                     if not group:
                         continue
                     row_dict, WH = build_row_from_group(oid, group, wh_key)
-                    sku8 = row_preview["SKU8"] or (_sku8_from_order(group[0]) or "NOSKU")[:8]
-                    wh2 = (WH["name"][:2].upper() if WH["name"] else "WH")
-                    scac = (row_preview["SCAC"] or "").upper() or "NOSCAC"
-                    filename = f"{oid}.pdf".replace(" ", "")
-                    out_path = os.path.join(OUTPUT_DIR, filename)
-                    fill_pdf(row_dict, out_path)
-                    made_files.append(out_path)
-
-            if made_files:
-                st.success(f"已產生 {len(made_files)} 份 BOL。")
-                mem_zip = io.BytesIO()
-                with zipfile.ZipFile(mem_zip, "w", zipfile.ZIP_DEFLATED) as zf:
-                    for p in made_files:
-                        zf.write(p, arcname=os.path.basename(p))
-                mem_zip.seek(0)
-                st.download_button(
-                    "下載全部 BOL (ZIP)",
-                    data=mem_zip,
-                    file_name=f"BOL_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip",
-                    mime="application/zip",
-                    use_container_width=True,
-                )
+                    jobs.append((oid, row_dict))
+
+                # 背景執行緒產生，畫面由下方的 fragment 輪詢進度，不會卡住整頁或逾時
+                prev_job = st.session_state.get("bol_job")
+                if prev_job is not None and prev_job.running:
+                    st.warning("上一批 BOL 仍在產生中，請等待完成或先取消。")
+                else:
+                    if prev_job is not None:
+                        prev_job.discard()   # 上一批的 ZIP 暫存檔
+                    st.session_state["bol_job"] = BolJob(
+                        jobs,
+                        merged=bol_output_mode.startswith("合併"),
+                        flatten=flatten_bol,
+                        save_dir=OUTPUT_DIR if save_to_disk else None,
+                        profile=profile_enabled(),
+                    ).start()
+
+    bol_job = st.session_state.get("bol_job")
+    if bol_job is not None:
+        @st.fragment(run_every=1.0 if bol_job.running else None)
+        def bol_job_panel():
+            job = st.session_state.get("bol_job")
+            if job is None:
+                return
+            if job.running:
+                st.progress(job.fraction, text=f"產生 BOL 中… {job.done}/{job.total}（{job.current}）｜{job.elapsed():.0f} 秒")
+                if st.button("取消產生 BOL", key="bol_job_cancel"):
+                    job.cancel()
+                return
+            if st.session_state.get("bol_job_final") != job.job_id:
+                # 剛結束：整頁 rerun 一次，讓 fragment 停止輪詢
+                st.session_state["bol_job_final"] = job.job_id
+                st.rerun(scope="app")
+            for name, msg in job.warnings:
+                st.warning(f"{name}：{msg}")
+            if job.profile_path:
+                st.caption(f"🔬 剖析報告：{job.profile_path}")
+            if job.failed:
+                st.error(f"以下 {len(job.failed)} 份 BOL 產生失敗：\n" + "\n".join(job.failed))
+            if job.state == "error":
+                st.error(f"BOL 產生中斷：{job.error}")
+            elif job.state == "cancelled":
+                st.info(f"已取消；取消前完成 {job.done}/{job.total} 份。")
+            elif job.has_output:
+                if job.merged:
+                    st.success(f"已合併 {job.produced} 份 BOL 為單一 PDF。（{job.elapsed():.1f} 秒）")
+                else:
+                    st.success(f"已產生 {job.produced} 份 BOL。（{job.elapsed():.1f} 秒）")
+                with job.open_output() as output:
+                    st.download_button(
+                        "下載合併 BOL (PDF)" if job.merged else "下載全部 BOL (ZIP)",
+                        data=output,
+                        file_name=job.file_name,
+                        mime=job.mime,
+                        use_container_width=True,
+                    )
             else:
                 st.warning("沒有產生任何檔案。")
 
+        bol_job_panel()
+
     # ======== 新流程：推送到 WMS（先人工修改） ========
     if st.button("推送到 海外倉（先人工修改）", type="primary", use_container_width=True):
-        selected = [r for r in edited if r.get("Select")]
-        if not selected:
-            st.warning("尚未選取任何訂單。")
-        else:
-            edit_map = {}
-            for row_preview in selected:
-                oid = row_preview["OriginalTxnId"]
-                wh_key = row_preview["Warehouse"]
-                group = grouped.get(oid, [])
-                if not group:
-                    continue
-                pickup_str = default_pickup_date_str()   # 預設兩天後
-                params = build_wms_params_from_group(oid, group, wh_key, pickup_str)
-                edit_map[oid] = {"Warehouse": wh_key, "params": params}
-            st.session_state["wms_edit_map"] = edit_map
-            st.session_state["wms_groups"] = grouped
-            st.success(f"已建立 {len(edit_map)} 筆預設上傳資料，請在下方逐筆人工修改後送出。")
+        with profiled("build_wms_edit_map", profile_enabled(), PROFILE_DIR) as prof:
+            selected = [r for r in edited if r.get("Select")]
+            if not selected:
+                st.warning("尚未選取任何訂單。")
+            else:
+                edit_map = {}
+                for row_preview in selected:
+                    oid = row_preview["OriginalTxnId"]
+                    wh_key = row_preview["Warehouse"]
+                    group = grouped.get(oid, [])
+                    if not group:
+                        continue
+                    pickup_str = default_pickup_date_str()   # 預設兩天後
+                    params = build_wms_params_from_group(oid, group, wh_key, pickup_str)
+                    edit_map[oid] = {"Warehouse": wh_key, "params": params}
+                st.session_state["wms_edit_map"] = edit_map
+                st.session_state.pop("wms_bulk_results", None)
+                st.session_state["wms_groups"] = grouped
+                st.session_state["wms_grid_ver"] = st.session_state.get("wms_grid_ver", 0) + 1
+                st.success(f"已建立 {len(edit_map)} 筆預設上傳資料，請在下方逐筆人工修改後送出。")
+        show_profile(prof)
 
     # 顯示人工修改表單 + 單筆送出
     wms_edit_map = st.session_state.get("wms_edit_map")
@@ -732,41 +370,109 @@ if orders_raw:
         st.markdown("### 📝 推送前人工修改")
         st.caption("每筆資料都可修改（含取件日期、SKU/數量、warehouse_code 等），確認後再送出。")
 
-        for oid, rec in wms_edit_map.items():
-            p = rec["params"]
-            m = re.search(r"pick up:\s*(\d{4}-\d{2}-\d{2})", p.get("order_desc") or "")
-            pickup_default = m.group(1) if m else default_pickup_date_str()
-
-            with st.expander(f"🛠 人工修改：{oid}"):
-                col_pd, col_wc = st.columns(2)
-                with col_pd:
-                    new_pickup_date = st.date_input(
-                        "Pick up date",
-                        value=datetime.fromisoformat(pickup_default).date(),
-                        key=f"{oid}_pickup",
-                    )
-                with col_wc:
-                    new_wh_code = st.text_input("warehouse_code", value=p.get("warehouse_code",""), key=f"{oid}_whc")
-
-                c1, c2 = st.columns(2)
-                with c1:
-                    new_tracking = st.text_input("tracking_no", value=p.get("tracking_no",""), key=f"{oid}_trk")
-                    new_platform_shop = st.text_input("platform_shop", value=p.get("platform_shop",""), key=f"{oid}_pshop")
-                with c2:
-                    new_ref = st.text_input("reference_no", value=p.get("reference_no",""), key=f"{oid}_ref")
-                    new_shipping_method = st.text_input("shipping_method", value=p.get("shipping_method",""), key=f"{oid}_shipping_method")
-
-                st.markdown("**Items**")
-                new_items = []
-                for idx, it in enumerate(p.get("items", [])):
-                    col1, col2 = st.columns(2)
-                    with col1:
-                        new_sku = st.text_input(f"product_sku #{idx+1}", value=it.get("product_sku",""), key=f"{oid}_sku_{idx}")
-                    with col2:
-                        new_qty = st.number_input(f"quantity #{idx+1}", value=int(it.get("quantity",1)), min_value=1, step=1, key=f"{oid}_qty_{idx}")
-                    new_items.append({"product_sku": new_sku.strip(), "quantity": int(new_qty)})
-
-                if st.button("📤 送出此筆", key=f"send_{oid}"):
+        force_repush = st.checkbox("允許重送已成功建單的 PO（略過推送紀錄檢查）", value=False)
+        edit_mode = st.radio(
+            "編輯方式",
+            options=["表格（分頁、批次套用）", "逐筆展開"],
+            index=0 if len(wms_edit_map) > WMS_EXPANDER_MAX else 1,
+            horizontal=True,
+        )
+        edited_params = {}   # oid → 套用畫面修改後的 params（供批次推送）
+
+        if edit_mode.startswith("表格"):
+            # 表格模式：整頁只有兩個 data_editor，包在 form 裡，按「套用」才 rerun 並寫回 wms_edit_map
+            oids_all = list(wms_edit_map.keys())
+            col_ps, col_pg = st.columns(2)
+            with col_ps:
+                page_size = st.selectbox("每頁筆數", options=[50, 100, 200, 500], index=1, key="wms_grid_page_size")
+            n_pages = max(1, -(-len(oids_all) // page_size))
+            with col_pg:
+                page = st.number_input(f"頁數（共 {n_pages} 頁）", min_value=1, max_value=n_pages, value=1, step=1, key="wms_grid_page")
+            page_oids = oids_all[(page - 1) * page_size: page * page_size]
+            st.caption("修改後請按『套用本頁修改』；未套用就換頁，本頁修改會被捨棄。")
+
+            order_rows, item_rows = wms_grid_rows(page_oids, wms_edit_map, push_ledger)
+            grid_key = f"{st.session_state.get('wms_grid_ver', 0)}_{page}_{page_size}"
+            with st.form(f"wms_grid_form_{grid_key}"):
+                order_edits = st.data_editor(
+                    order_rows,
+                    num_rows="fixed",
+                    hide_index=True,
+                    column_config={
+                        "PO": st.column_config.TextColumn("PO", disabled=True),
+                        "pickup_date": st.column_config.DateColumn("Pick up date", format="YYYY-MM-DD", required=True),
+                        "warehouse_code": st.column_config.TextColumn("warehouse_code"),
+                        "reference_no": st.column_config.TextColumn("reference_no"),
+                        "tracking_no": st.column_config.TextColumn("tracking_no"),
+                        "platform_shop": st.column_config.TextColumn("platform_shop"),
+                        "shipping_method": st.column_config.TextColumn("shipping_method"),
+                        "Pushed": st.column_config.TextColumn("已推送", disabled=True),
+                    },
+                    key=f"wms_grid_orders_{grid_key}",
+                    use_container_width=True,
+                )
+                st.markdown("**Items**（可新增 / 刪除列；PO 欄決定所屬訂單）")
+                item_edits = st.data_editor(
+                    item_rows,
+                    num_rows="dynamic",
+                    hide_index=True,
+                    column_config={
+                        "PO": st.column_config.SelectboxColumn("PO", options=page_oids, required=True),
+                        "product_sku": st.column_config.TextColumn("product_sku", required=True),
+                        "quantity": st.column_config.NumberColumn("quantity", min_value=1, step=1, default=1, required=True),
+                    },
+                    key=f"wms_grid_items_{grid_key}",
+                    use_container_width=True,
+                )
+                applied = st.form_submit_button("套用本頁修改", use_container_width=True)
+            if applied:
+                n_upd, n_skip = apply_wms_grid_edits(wms_edit_map, order_edits, item_edits)
+                # 換新的 editor key：已寫回的修改不再以差異形式重複套用
+                st.session_state["wms_grid_ver"] = st.session_state.get("wms_grid_ver", 0) + 1
+                msg = f"已套用 {n_upd} 筆 PO 的修改。"
+                if n_skip:
+                    msg += f"（略過 {n_skip} 列空 SKU 或數量 < 1 的 items）"
+                st.session_state["wms_grid_msg"] = msg
+                st.rerun()
+            if st.session_state.get("wms_grid_msg"):
+                st.success(st.session_state.pop("wms_grid_msg"))
+            edited_params = {oid: rec["params"] for oid, rec in wms_edit_map.items()}
+        else:
+            ver = st.session_state.get("wms_grid_ver", 0)
+            for oid, rec in wms_edit_map.items():
+                p = rec["params"]
+                pickup_default = pickup_date_from_params(p)
+                wkey = f"{ver}_{oid}"   # 表格模式套用後換 key，欄位改顯示 wms_edit_map 的新值
+
+                with st.expander(f"🛠 人工修改：{oid}"):
+                    col_pd, col_wc = st.columns(2)
+                    with col_pd:
+                        new_pickup_date = st.date_input(
+                            "Pick up date",
+                            value=datetime.fromisoformat(pickup_default).date(),
+                            key=f"{wkey}_pickup",
+                        )
+                    with col_wc:
+                        new_wh_code = st.text_input("warehouse_code", value=p.get("warehouse_code",""), key=f"{wkey}_whc")
+
+                    c1, c2 = st.columns(2)
+                    with c1:
+                        new_tracking = st.text_input("tracking_no", value=p.get("tracking_no",""), key=f"{wkey}_trk")
+                        new_platform_shop = st.text_input("platform_shop", value=p.get("platform_shop",""), key=f"{wkey}_pshop")
+                    with c2:
+                        new_ref = st.text_input("reference_no", value=p.get("reference_no",""), key=f"{wkey}_ref")
+                        new_shipping_method = st.text_input("shipping_method", value=p.get("shipping_method",""), key=f"{wkey}_shipping_method")
+
+                    st.markdown("**Items**")
+                    new_items = []
+                    for idx, it in enumerate(p.get("items", [])):
+                        col1, col2 = st.columns(2)
+                        with col1:
+                            new_sku = st.text_input(f"product_sku #{idx+1}", value=it.get("product_sku",""), key=f"{wkey}_sku_{idx}")
+                        with col2:
+                            new_qty = st.number_input(f"quantity #{idx+1}", value=int(it.get("quantity",1)), min_value=1, step=1, key=f"{wkey}_qty_{idx}")
+                        new_items.append({"product_sku": new_sku.strip(), "quantity": int(new_qty)})
+
                     new_order_desc = f"pick up: {new_pickup_date.isoformat()}"
                     new_params = dict(p)
                     new_params.update({
@@ -778,45 +484,91 @@ if orders_raw:
                         "shipping_method": new_shipping_method,
                         "items": new_items,
                     })
+                    edited_params[oid] = new_params
+
+                    prev_push = push_ledger.get(new_params["warehouse_code"], new_params["reference_no"])
+                    if prev_push and prev_push["ok"]:
+                        st.info(f"此 reference_no 已於 {prev_push['pushed_at']} 在 {new_params['warehouse_code']} 建單成功。")
+
+                    if st.button("📤 送出此筆", key=f"send_{oid}"):
+                        with profiled("wms_send_one", profile_enabled(), PROFILE_DIR) as prof:
+                            target_wh_key, endpoint, app_token, app_key = resolve_wms_target(new_params, rec.get("Warehouse"))
 
-                    # 由 warehouse_code 反查倉別鍵（或保留原來選的倉）
-                    target_wh_key = None
-                    for k, cfg in WMS_CONFIGS.items():
-                        if cfg.get("WAREHOUSE_CODE") == new_params.get("warehouse_code"):
-                            target_wh_key = k
-                            break
-                    if not target_wh_key:
-                        target_wh_key = rec.get("Warehouse", "NJ 08816")
-
-                    cfg = WMS_CONFIGS.get(target_wh_key, {})
-                    endpoint = cfg.get("ENDPOINT_URL","").strip()
-                    app_token = cfg.get("APP_TOKEN","").strip()
-                    app_key = cfg.get("APP_KEY","").strip()
-
-                    if not (endpoint and app_token and app_key):
-                        st.error(f"{target_wh_key} WMS 設定不完整（endpoint/app_token/app_key）。")
-                    else:
-                        try:
-                            resp2 = send_create_order(endpoint, app_token, app_key, new_params, service=WMS_SERVICE)
-                            text2 = resp2.text[:5000]
-                            st.text_area("回應（前 5000 字）", text2, height=160)
-
-                            # 嘗試抓 JSON 片段並判斷成功與否
-                            parsed2 = _try_extract_json(text2)
-                            if parsed2:
-                                st.json(parsed2)
-                                # 成功條件：ask=Success 或 error_code=0
-                                if (str(parsed2.get("ask", "")).lower() == "success") or (str(parsed2.get("error_code", "")) == "0"):
-                                    st.success("✅ 海外倉 上傳成功！")
+                            if not (endpoint and app_token and app_key):
+                                st.error(f"{target_wh_key} WMS 設定不完整（endpoint/app_token/app_key）。")
+                            elif not push_ledger.reserve(new_params["warehouse_code"], new_params["reference_no"], force=force_repush):
+                                if push_ledger.is_pushed(new_params["warehouse_code"], new_params["reference_no"]):
+                                    st.warning("已推送過，未重送（如需重送請勾選上方『允許重送』）。")
                                 else:
-                                    st.warning("⚠️ 海外倉 回傳非成功狀態，請檢查上方 JSON/回應內容。")
+                                    st.warning("其他程序正在送出此筆，未重複送出。")
                             else:
-                                # 沒抓到 JSON，但若關鍵字含 Success 也當成功提示
-                                if ("\"ask\":\"Success\"" in text2) or ("\"message\":\"Success\"" in text2):
-                                    st.success("✅ 海外倉 上傳成功！")
-                                else:
-                                    st.info(f"HTTP {resp2.status_code}，請檢查回應內容。")
-                        except Exception as e:
-                            st.error(f"上傳失敗：{e}")
+                                try:
+                                    resp2 = send_create_order(endpoint, app_token, app_key, new_params, service=WMS_SERVICE)
+                                    text2 = resp2.text[:5000]
+                                    st.text_area("回應（前 5000 字）", text2, height=160)
+
+                                    # 解析回應中的 JSON 節點 / SOAP Fault 並判斷成功與否
+                                    parsed2 = parse_soap_response(resp2.content)
+                                    if parsed2.payload:
+                                        st.json(parsed2.payload)
+                                    if parsed2.fault:
+                                        st.error(f"SOAP Fault {parsed2.fault['faultcode']}: {parsed2.fault['faultstring']}")
+                                    ok = parsed2.ok
+                                    push_ledger.record(
+                                        new_params["warehouse_code"], new_params["reference_no"], bool(ok),
+                                        wms_status(parsed2), resp2.status_code, wms_message(parsed2, text2),
+                                    )
+                                    if ok:
+                                        st.success("✅ 海外倉 上傳成功！")
+                                    elif ok is False:
+                                        st.warning("⚠️ 海外倉 回傳非成功狀態，請檢查上方 JSON/回應內容。")
+                                    else:
+                                        st.info(f"HTTP {resp2.status_code}，請檢查回應內容。")
+                                except Exception as e:
+                                    push_ledger.record(new_params["warehouse_code"], new_params["reference_no"], False,
+                                                       "失敗", None, f"上傳失敗：{e}")
+                                    st.error(f"上傳失敗：{e}")
+                        show_profile(prof)
+
+        # ======== 批次推送：全部送出，各倉分別限制同時在途數 ========
+        st.markdown("---")
+        if st.button(f"📤 全部送出（{len(edited_params)} 筆）", type="primary", use_container_width=True):
+            with profiled("wms_push_bulk", profile_enabled(), PROFILE_DIR) as prof:
+                entries = [(oid, edited_params[oid], wms_edit_map[oid].get("Warehouse")) for oid in edited_params]
+                with st.spinner("批次推送中…"):
+                    st.session_state["wms_bulk_results"] = push_wms_orders_bulk(entries, push_ledger, force=force_repush)
+            show_profile(prof)
+
+        bulk_results = st.session_state.get("wms_bulk_results")
+        if bulk_results:
+            n_ok = sum(1 for r in bulk_results if r["狀態"] == "成功")
+            n_skip = sum(1 for r in bulk_results if r["狀態"] == "已推送（略過）")
+            st.markdown(f"**批次推送結果**：成功 {n_ok} / {len(bulk_results)}（略過已推送 {n_skip}）")
+            st.dataframe(bulk_results, hide_index=True, use_container_width=True)
 else:
     st.info("請先在左側按『抓取訂單』或『搜尋 PO（14 天內）』。")
+
+# ---------- 側邊：各階段計時 ----------
+# 放在最後：本次 rerun 內的抓單 / BOL / 推送都已計入
+flush_metrics()
+with st.sidebar.expander("⏱ 效能計時"):
+    timing_rows = metrics.REGISTRY.summary()
+    if timing_rows:
+        st.dataframe(timing_rows, hide_index=True, use_container_width=True)
+    else:
+        st.caption("尚無資料（抓單、產生 BOL、推送後會出現）。")
+    counters = metrics.REGISTRY.counters()
+    if counters:
+        st.json(counters, expanded=False)
+    if METRICS_PATH:
+        st.caption(f"輸出檔：{METRICS_PATH}")
+    st.checkbox(
+        "剖析按鈕動作（cProfile + tracemalloc）",
+        key="profile_actions",
+        value=PROFILE_ACTIONS,
+        disabled=PROFILE_ACTIONS,
+        help=f"開啟後每次抓單 / 產生 BOL / 推送都會把排名報告寫到 {PROFILE_DIR}/",
+    )
+    if st.button("清除計時", key="metrics_reset", use_container_width=True):
+        metrics.REGISTRY.reset()
+        st.rerun()
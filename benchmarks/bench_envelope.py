@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# bench_envelope.py — SOAP Envelope 產生速度：build_soap_envelope(...).encode() vs build_soap_envelope_bytes
+#   python benchmarks/bench_envelope.py [--n 20000]
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from importorder import build_params_dict, build_soap_envelope, build_soap_envelope_bytes, SERVICE  # noqa: E402
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--n", type=int, default=20000, help="每個 builder 產生的 envelope 數")
+    ap.add_argument("--repeat", type=int, default=5)
+    args = ap.parse_args()
+
+    params = build_params_dict()
+    token, key = "demo-app-token-0123456789", "demo-app-key-0123456789"
+    assert build_soap_envelope(params, token, key, SERVICE).encode("utf-8") == \
+        build_soap_envelope_bytes(params, token, key, SERVICE), "兩種 builder 的輸出應相同"
+
+    cases = {
+        "build_soap_envelope + encode": lambda: build_soap_envelope(params, token, key, SERVICE).encode("utf-8"),
+        "build_soap_envelope_bytes": lambda: build_soap_envelope_bytes(params, token, key, SERVICE),
+    }
+    base = None
+    for name, fn in cases.items():
+        best = min(timeit.repeat(fn, number=args.n, repeat=args.repeat))
+        rate = args.n / best
+        base = base or rate
+        print(f"{name:32s} {rate:12,.0f} envelopes/s  ({rate / base:4.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
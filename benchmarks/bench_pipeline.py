@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+bench_pipeline.py — 端到端效能量測（不連 api.teapplix.com / 正式 WMS）：
+模擬訂單 → 本機 Teapplix 模擬伺服器 → fetch_orders → 分組 → build_row_from_group → fill_pdf → ZIP
+→ send_create_order（本機 WMS 模擬伺服器）。每個階段回報 orders/s 與 p50 / p99 延遲。
+
+    python benchmarks/bench_pipeline.py                        # 預設 3000 筆訂單、100 份 BOL
+    python benchmarks/bench_pipeline.py --orders 20000 --latency 0.08 --error-rate 0.01 --json bench.json
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+# 須在匯入 pipeline 前設定：不用正式憑證、不動本地快取
+os.environ["TEAPPLIX_TOKEN"] = os.environ.get("TEAPPLIX_TOKEN") or "bench-token"
+os.environ["ORDER_STORE_PATH"] = ""
+
+import pipeline  # noqa: E402
+from bol_pdf import generate_bols, BolZipWriter  # noqa: E402
+from stub_servers import TeapplixStub, WmsStub  # noqa: E402
+from synth_orders import make_orders  # noqa: E402
+
+
+def percentile(values, p: float) -> float:
+    """最近秩百分位數（values 不需排序；空列表回傳 0）。"""
+    if not values:
+        return 0.0
+    xs = sorted(values)
+    k = max(0, min(len(xs) - 1, int(round(p / 100.0 * len(xs) + 0.5)) - 1))
+    return xs[k]
+
+
+class Stage:
+    def __init__(self, name: str, unit: str = "orders"):
+        self.name = name
+        self.unit = unit
+        self.count = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.latencies = []
+
+    def as_dict(self) -> dict:
+        return {
+            "stage": self.name,
+            "unit": self.unit,
+            "count": self.count,
+            "errors": self.errors,
+            "seconds": round(self.seconds, 4),
+            "per_second": round(self.count / self.seconds, 1) if self.seconds else 0.0,
+            "p50_ms": round(percentile(self.latencies, 50) * 1000, 3),
+            "p99_ms": round(percentile(self.latencies, 99) * 1000, 3),
+            "samples": len(self.latencies),
+        }
+
+
+def bench_fetch(args, tea):
+    """fetch_orders：延遲取自每一頁（包住 _get_orders_page）。"""
+    st = Stage("fetch_orders", "orders")
+    original = pipeline._get_orders_page
+
+    def timed_page(client, params, page):
+        t = time.perf_counter()
+        result = original(client, params, page)
+        st.latencies.append(time.perf_counter() - t)
+        if result[1]:
+            st.errors += 1
+        return result
+
+    pipeline._get_orders_page = timed_page
+    try:
+        t0 = time.perf_counter()
+        orders = pipeline.fetch_orders(args.days)
+        st.seconds = time.perf_counter() - t0
+    finally:
+        pipeline._get_orders_page = original
+    st.count = len(orders)
+    return st, orders
+
+
+def bench_group(args, orders):
+    st = Stage("group_by_original_txn", "orders")
+    grouped = None
+    for _ in range(args.repeat):
+        t = time.perf_counter()
+        grouped = pipeline.group_by_original_txn(orders)
+        dt = time.perf_counter() - t
+        st.latencies.append(dt)
+        st.seconds += dt
+        st.count += len(orders)
+    return st, grouped
+
+
+def bench_build_row(grouped, wh_key):
+    st = Stage("build_row_from_group", "POs")
+    rows = []
+    t0 = time.perf_counter()
+    for oid, group in grouped.items():
+        t = time.perf_counter()
+        row, _wh = pipeline.build_row_from_group(oid, group, wh_key)
+        st.latencies.append(time.perf_counter() - t)
+        rows.append((oid, row))
+    st.seconds = time.perf_counter() - t0
+    st.count = len(rows)
+    return st, rows
+
+
+def bench_fill_pdf(jobs, template, out_dir, flatten):
+    st = Stage("fill_pdf", "BOLs")
+    t0 = time.perf_counter()
+    for oid, row in jobs:
+        t = time.perf_counter()
+        try:
+            pipeline.fill_pdf(row, os.path.join(out_dir, f"{oid}.pdf"), flatten=flatten, template_path=template)
+        except Exception:
+            st.errors += 1
+        st.latencies.append(time.perf_counter() - t)
+    st.seconds = time.perf_counter() - t0
+    st.count = len(jobs) - st.errors
+    return st
+
+
+def bench_zip(jobs, template, workers, flatten):
+    """generate_bols + BolZipWriter；延遲為相鄰兩份 BOL 寫進 ZIP 的間隔。"""
+    st = Stage(f"zip (workers={workers})", "BOLs")
+    t0 = last = time.perf_counter()
+    writer = BolZipWriter()
+    for oid, data, _warnings, failure, _seconds in generate_bols(jobs, template, workers=workers, parallel_min=2, flatten=flatten):
+        if failure:
+            st.errors += 1
+        else:
+            writer.add(f"{oid}.pdf", data)
+        now = time.perf_counter()
+        st.latencies.append(now - last)
+        last = now
+    size = writer.close().seek(0, os.SEEK_END)
+    st.seconds = time.perf_counter() - t0
+    st.count = writer.count
+    return st, size
+
+
+def bench_send(args, grouped, wms, wh_key):
+    """send_create_order：每筆一個 SOAP POST，concurrency 個同時在途（共用連線池）。"""
+    st = Stage(f"send_create_order (x{args.push_concurrency})", "orders")
+    pickup = pipeline.default_pickup_date_str()
+    entries = [pipeline.build_wms_params_from_group(oid, g, wh_key, pickup) for oid, g in list(grouped.items())[:args.pushes]]
+
+    def one(params):
+        t = time.perf_counter()
+        try:
+            resp = pipeline.send_create_order(wms.url, "bench-token", "bench-key", params, service=pipeline.WMS_SERVICE)
+            ok = pipeline.parse_soap_response(resp.content).ok
+        except Exception:
+            ok = False
+        return time.perf_counter() - t, ok
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.push_concurrency) as pool:
+        for dt, ok in pool.map(one, entries):
+            st.latencies.append(dt)
+            if not ok:
+                st.errors += 1
+    st.seconds = time.perf_counter() - t0
+    st.count = len(entries)
+    return st
+
+
+def main():
+    ap = argparse.ArgumentParser(description="端到端效能量測（本機模擬 Teapplix / WMS）")
+    ap.add_argument("--orders", type=int, default=3000, help="模擬訂單數")
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--days", type=int, default=3)
+    ap.add_argument("--latency", type=float, default=0.05, help="模擬伺服器每個請求的延遲（秒）")
+    ap.add_argument("--jitter", type=float, default=0.01)
+    ap.add_argument("--error-rate", type=float, default=0.0, help="模擬伺服器注入 HTTP 錯誤的比例")
+    ap.add_argument("--rate-limit", type=float, default=0, help="模擬 Teapplix 每秒可接受的請求數，超過回 429（0 = 不限）")
+    ap.add_argument("--fetch-workers", type=int, default=pipeline.FETCH_WORKERS)
+    ap.add_argument("--teapplix-rate", type=float, default=pipeline.TEAPPLIX_RATE, help="用戶端限速（每秒請求數，0 = 不限）")
+    ap.add_argument("--repeat", type=int, default=5, help="分組重複次數")
+    ap.add_argument("--bols", type=int, default=100, help="fill_pdf / ZIP 階段的 BOL 份數")
+    ap.add_argument("--workers", type=int, default=pipeline.BOL_WORKERS, help="ZIP 階段的子行程數")
+    ap.add_argument("--flatten", action="store_true")
+    ap.add_argument("--pushes", type=int, default=300, help="send_create_order 筆數")
+    ap.add_argument("--push-concurrency", type=int, default=4)
+    ap.add_argument("--template", default=os.path.join(pipeline.APP_DIR, pipeline.TEMPLATE_PDF))
+    ap.add_argument("--json", help="另存 JSON 結果")
+    args = ap.parse_args()
+
+    pipeline.FETCH_WORKERS = args.fetch_workers
+    pipeline.TEAPPLIX_RATE = args.teapplix_rate
+    wh_key = next(iter(pipeline.WAREHOUSES))
+    stub_kw = {"latency": args.latency, "jitter": args.jitter, "error_rate": args.error_rate}
+    tea = TeapplixStub(make_orders(args.orders, seed=args.seed), rate_limit=args.rate_limit, **stub_kw).start()
+    wms = WmsStub(**stub_kw).start()
+    pipeline.BASE_URL = tea.url
+    out_dir = tempfile.mkdtemp(prefix="bench_bol_")
+    stages = []
+    try:
+        st, orders = bench_fetch(args, tea)
+        stages.append(st)
+        st, grouped = bench_group(args, orders)
+        stages.append(st)
+        st, rows = bench_build_row(grouped, wh_key)
+        stages.append(st)
+        jobs = rows[:args.bols]
+        stages.append(bench_fill_pdf(jobs, args.template, out_dir, args.flatten))
+        st, zip_size = bench_zip(jobs, args.template, args.workers, args.flatten)
+        stages.append(st)
+        stages.append(bench_send(args, grouped, wms, wh_key))
+    finally:
+        tea.stop()
+        wms.stop()
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+    print(f"\nTeapplix 模擬伺服器：{tea.requests + tea.throttled} 個請求，注入錯誤 {tea.errors}、限流 429 {tea.throttled}")
+    print(f"\n模擬訂單 {args.orders}（PO {len(grouped) if stages else 0}）｜延遲 {args.latency * 1000:.0f}ms ± "
+          f"{args.jitter * 1000:.0f}ms｜錯誤率 {args.error_rate:.1%}｜ZIP {zip_size / 1024 / 1024:.1f} MB\n")
+    print(f"{'stage':34s} {'count':>7s} {'errors':>6s} {'sec':>8s} {'per sec':>12s} {'p50 ms':>9s} {'p99 ms':>9s}")
+    results = [s.as_dict() for s in stages]
+    for r in results:
+        print(f"{r['stage']:34s} {r['count']:7d} {r['errors']:6d} {r['seconds']:8.3f} "
+              f"{r['per_second']:8.1f} {r['unit']:<3.3s} {r['p50_ms']:9.2f} {r['p99_ms']:9.2f}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "stages": results}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
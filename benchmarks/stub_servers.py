@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""
+stub_servers.py — 本機模擬 Teapplix OrderNotification (GET) 與 WMS callService (SOAP POST)，可設定延遲與錯誤率。
+
+    python benchmarks/stub_servers.py --orders 5000 --latency 0.05 --error-rate 0.01
+    （印出兩個 URL；把 pipeline.BASE_URL / W1_WMS_ENDPOINT 指過去即可手動測試）
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from collections import deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+SOAP_OK = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<SOAP-ENV:Envelope xmlns:SOAP-ENV="http://schemas.xmlsoap.org/soap/envelope/" xmlns:ns1="http://www.example.org/Ec/">'
+    '<SOAP-ENV:Body><ns1:callServiceResponse><response>{payload}</response></ns1:callServiceResponse>'
+    '</SOAP-ENV:Body></SOAP-ENV:Envelope>'
+)
+
+
+class _StubServer:
+    """ThreadingHTTPServer 包一層：背景執行緒服務，記錄請求數 / 注入的錯誤數。"""
+
+    handler = None
+    path = "/"
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0, seed: int = 1):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.requests = 0
+        self.errors = 0
+        self._rnd = random.Random(seed)
+        self._lock = threading.Lock()
+        self._srv = None
+
+    def start(self, port: int = 0):
+        stub = self
+
+        class Handler(self.handler):
+            server_stub = stub
+
+        self._srv = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self._srv.daemon_threads = True
+        threading.Thread(target=self._srv.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._srv is not None:
+            self._srv.shutdown()
+            self._srv.server_close()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self._srv.server_port}{self.path}"
+
+    def _tick(self) -> bool:
+        """模擬延遲；回傳這次是否要注入錯誤。"""
+        with self._lock:
+            self.requests += 1
+            delay = max(0.0, self.latency + self._rnd.uniform(-self.jitter, self.jitter))
+            fail = self._rnd.random() < self.error_rate
+            if fail:
+                self.errors += 1
+        if delay:
+            time.sleep(delay)
+        return fail
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   # keep-alive，才量得到連線重用的效果
+    server_stub = None
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, code: int, body: bytes, ctype: str, headers=None):
+        self.send_response(code)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class _TeapplixHandler(_Handler):
+    def do_GET(self):
+        stub = self.server_stub
+        if stub._over_limit():
+            self._send(429, b'{"error":"rate limited"}', "application/json", {"Retry-After": "1"})
+            return
+        if stub._tick():
+            self._send(503, b'{"error":"stub injected failure"}', "application/json", {"Retry-After": "1"})
+            return
+        q = {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+        rows = stub.orders
+        if "OriginalTxnId" in q:
+            rows = stub.by_po.get(q["OriginalTxnId"], [])
+        if q.get("Shipped") in ("0", "1"):
+            rows = [o for o in rows if o.get("Shipped") == q["Shipped"]]
+        size = int(q.get("PageSize", 500))
+        page = int(q.get("PageNumber", 1))
+        body = json.dumps({"orders": rows[(page - 1) * size: page * size]}).encode("utf-8")
+        self._send(200, body, "application/json")
+
+
+class TeapplixStub(_StubServer):
+    """
+    模擬 GET /api2/OrderNotification：依 PageSize / PageNumber 分頁，支援 OriginalTxnId / Shipped 過濾。
+    rate_limit > 0 時，最近一秒內的請求數超過它就回 429 + Retry-After。
+    """
+
+    handler = _TeapplixHandler
+    path = "/api2/OrderNotification"
+
+    def __init__(self, orders, rate_limit: float = 0, **kw):
+        super().__init__(**kw)
+        self.orders = list(orders)
+        self.by_po = {}
+        for o in self.orders:
+            self.by_po.setdefault(o.get("OriginalTxnId"), []).append(o)
+        self.rate_limit = rate_limit
+        self.throttled = 0
+        self._recent = deque()
+
+    def _over_limit(self) -> bool:
+        if self.rate_limit <= 0:
+            return False
+        now = time.monotonic()
+        with self._lock:
+            while self._recent and now - self._recent[0] > 1.0:
+                self._recent.popleft()
+            if len(self._recent) >= self.rate_limit:
+                self.throttled += 1
+                return True
+            self._recent.append(now)
+        return False
+
+
+class _WmsHandler(_Handler):
+    def do_POST(self):
+        stub = self.server_stub
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if stub._tick():
+            self._send(500, b"stub injected failure", "text/plain")
+            return
+        with stub._lock:
+            stub.seq += 1
+            seq = stub.seq
+        if stub.fail_ratio and stub._rnd.random() < stub.fail_ratio:
+            payload = '{"ask":"Failure","message":"stub business error","error_code":"E100"}'
+        else:
+            payload = '{"ask":"Success","message":"Success","order_code":"OC%08d"}' % seq
+        self._send(200, SOAP_OK.format(payload=payload).encode("utf-8"), "text/xml; charset=utf-8")
+
+
+class WmsStub(_StubServer):
+    """模擬 WMS callService：HTTP 錯誤依 error_rate 注入，業務失敗（ask=Failure）依 fail_ratio 注入。"""
+
+    handler = _WmsHandler
+    path = "/default/svc/web-service"
+
+    def __init__(self, fail_ratio: float = 0.0, **kw):
+        super().__init__(**kw)
+        self.fail_ratio = fail_ratio
+        self.seq = 0
+
+
+def main():
+    from synth_orders import make_orders
+
+    ap = argparse.ArgumentParser(description="本機 Teapplix / WMS 模擬伺服器")
+    ap.add_argument("--orders", type=int, default=2000)
+    ap.add_argument("--latency", type=float, default=0.05, help="每個請求的延遲秒數")
+    ap.add_argument("--jitter", type=float, default=0.01)
+    ap.add_argument("--error-rate", type=float, default=0.0, help="HTTP 錯誤比例（Teapplix 503 / WMS 500）")
+    ap.add_argument("--rate-limit", type=float, default=0, help="Teapplix 每秒可接受的請求數，超過回 429（0 = 不限）")
+    ap.add_argument("--teapplix-port", type=int, default=8801)
+    ap.add_argument("--wms-port", type=int, default=8802)
+    args = ap.parse_args()
+
+    kw = {"latency": args.latency, "jitter": args.jitter, "error_rate": args.error_rate}
+    tea = TeapplixStub(make_orders(args.orders), rate_limit=args.rate_limit, **kw).start(args.teapplix_port)
+    wms = WmsStub(**kw).start(args.wms_port)
+    print(f"Teapplix: {tea.url}\nWMS:      {wms.url}\nCtrl+C 結束")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        tea.stop()
+        wms.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+# synth_orders.py — 產生模擬的 Teapplix OrderNotification 訂單（多筆訂單同 PO、ShippingDetails、OrderItems）
+import random
+
+STATES = [
+    ("AZ", "Phoenix", "850"), ("CA", "Ontario", "917"), ("TX", "Dallas", "752"), ("NJ", "Edison", "088"),
+    ("NY", "Albany", "122"), ("FL", "Tampa", "336"), ("GA", "Atlanta", "303"), ("WA", "Kent", "980"),
+]
+SCACS = ["SAIA", "EXLA", "ODFL", "RLCA", "FXFE", "ABFS", "PITD", "AACT"]
+SKU_PREFIXES = ["FP-48", "FP-60", "FP-72", "ST-36", "MN-50"]
+
+
+def make_orders(n_orders: int, seed: int = 42, multi_ratio: float = 0.3, unsp_ratio: float = 0.02,
+                shipped: str = "0", payment_date: str = "2026-10-15T10:00:00"):
+    """
+    回傳 n_orders 筆原始訂單 dict（與 Teapplix API 回傳結構相同）。
+    multi_ratio：每張 PO 拆成 2~3 筆訂單的比例；unsp_ratio：ShipClass = UNSP_CG（會被過濾）的比例。
+    同一個 seed 產生的資料完全相同，方便前後比較。
+    """
+    rnd = random.Random(seed)
+    orders = []
+    po = 30000000
+    while len(orders) < n_orders:
+        po += rnd.randint(1, 97)
+        parts = rnd.choice((2, 3)) if rnd.random() < multi_ratio else 1
+        state, city, zip3 = rnd.choice(STATES)
+        scac = "UNSP_CG" if rnd.random() < unsp_ratio else rnd.choice(SCACS)
+        to = {
+            "Name": f"Customer {po}",
+            "Company": "" if rnd.random() < 0.8 else f"Company {po % 1000}",
+            "Street": f"{rnd.randint(1, 9999)} Main St",
+            "Street2": "" if rnd.random() < 0.7 else f"Apt {rnd.randint(1, 300)}",
+            "City": city,
+            "State": state,
+            "ZipCode": f"{zip3}{rnd.randint(0, 99):02d}",
+            "PhoneNumber": f"555{rnd.randint(0, 9999999):07d}",
+        }
+        for part in range(parts):
+            if len(orders) >= n_orders:
+                break
+            n_items = 1 if rnd.random() < 0.85 else 2
+            items = [
+                {"ItemSKU": f"{rnd.choice(SKU_PREFIXES)}-{rnd.randint(100, 999)}", "Quantity": rnd.choice((1, 1, 1, 2))}
+                for _ in range(n_items)
+            ]
+            pkg_count = sum(it["Quantity"] for it in items)
+            orders.append({
+                "TxnId": f"{po}-{part}",
+                "OriginalTxnId": str(po),
+                "Shipped": shipped,
+                "StoreKey": "HD",
+                "To": to,
+                "OrderDetails": {
+                    "ShipClass": scac,
+                    "PaymentDate": payment_date,
+                    "Custom": f"C{po}{part}",
+                },
+                "ShippingDetails": [{
+                    "Package": {
+                        "IdenticalPackageCount": pkg_count,
+                        "Weight": {"Value": rnd.choice((1920, 2080, 2400, 2880)), "Unit": "OZ"},
+                        "TrackingInfo": {"CarrierName": scac, "TrackingNumber": f"PRO{rnd.randint(0, 10**9):09d}"},
+                    },
+                }],
+                "OrderItems": items,
+            })
+    return orders
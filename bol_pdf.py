@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+# bol_pdf.py — BOL.pdf 模板快取 + 欄位索引 + 填寫（不依賴 Streamlit）
+import multiprocessing as mp
+import os
+import tempfile
+import threading
+import time
+import zipfile
+from collections import deque
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import fitz  # PyMuPDF
+
+CHECKBOX_FIELDS   = {"MasterBOL", "Term_Pre", "Term_Collect", "Term_CustChk", "FromFOB", "ToFOB"}
+FORCE_TEXT_FIELDS = {"PrePaid", "Collect", "3rdParty"}
+
+CHECKED_VALUES = {"on", "yes", "1", "true", "x", "✔"}
+
+
+class BolTemplate:
+    """
+    模板 bytes + 欄位索引：field_name → [(page_no, widget_xref, field_type, is_checkbox), ...]。
+    同名欄位（例如 radio 群組）會有多筆。field_roots 為各欄位最上層物件的 xref（合併 PDF 改名用）。
+    """
+
+    __slots__ = ("path", "mtime", "data", "fields", "field_roots")
+
+    def __init__(self, path: str, mtime: float, data: bytes):
+        self.path = path
+        self.mtime = mtime
+        self.data = data
+        self.fields = {}
+        roots = set()
+        doc = fitz.open("pdf", data)
+        try:
+            for page in doc:
+                for w in (page.widgets() or []):
+                    roots.add(_field_root(doc, w.xref))
+                    name = w.field_name
+                    if not name:
+                        continue
+                    is_checkbox_type  = (w.field_type == fitz.PDF_WIDGET_TYPE_CHECKBOX)
+                    is_checkbox_named = (name in CHECKBOX_FIELDS)
+                    is_forced_text    = (name in FORCE_TEXT_FIELDS)
+                    is_checkbox = (is_checkbox_type or is_checkbox_named) and not is_forced_text
+                    self.fields.setdefault(name, []).append((page.number, w.xref, w.field_type, is_checkbox))
+        finally:
+            doc.close()
+        self.field_roots = tuple(sorted(roots))
+
+
+def _field_root(doc, xref: int) -> int:
+    """沿 /Parent 往上找到欄位的最上層物件。"""
+    while True:
+        typ, val = doc.xref_get_key(xref, "Parent")
+        if typ != "xref":
+            return xref
+        xref = int(val.split()[0])
+
+
+_templates = {}
+_templates_lock = threading.Lock()
+
+
+def get_template(path: str) -> BolTemplate:
+    """每個行程只讀一次模板；檔案 mtime 改變時自動重新載入。"""
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"找不到 BOL 模板：{path}")
+    mtime = os.path.getmtime(path)
+    key = os.path.abspath(path)
+    tpl = _templates.get(key)
+    if tpl is not None and tpl.mtime == mtime:
+        return tpl
+    with _templates_lock:
+        tpl = _templates.get(key)
+        if tpl is None or tpl.mtime != mtime:
+            with open(path, "rb") as f:
+                tpl = BolTemplate(path, mtime, f.read())
+            _templates[key] = tpl
+    return tpl
+
+
+def _set_widget(widget, is_checkbox: bool, value):
+    if is_checkbox:
+        v = str(value).strip().lower()
+        widget.field_value = "Yes" if v in CHECKED_VALUES else "Off"
+    else:
+        widget.field_value = "" if value is None else str(value)
+    widget.update()
+
+
+def fill_template(row: dict, template_path: str, flatten: bool = False):
+    """
+    以快取的模板 bytes 開新文件，只處理 row 中有、模板也有的欄位。
+    flatten=True 時把填好的值烘焙進頁面內容並移除所有表單欄位（靜態、不可再編輯）。
+    回傳 (已開啟的 fitz.Document, 填寫失敗訊息列表)；呼叫端負責存檔與 close。
+    """
+    tpl = get_template(template_path)
+    doc = fitz.open("pdf", tpl.data)
+    pages = {}
+    errors = []
+    for name, value in row.items():
+        for page_no, xref, _field_type, is_checkbox in tpl.fields.get(name, ()):
+            try:
+                page = pages.get(page_no)
+                if page is None:
+                    page = pages[page_no] = doc[page_no]
+                _set_widget(page.load_widget(xref), is_checkbox, value)
+            except Exception as e:
+                errors.append(f"填欄位 {name} 失敗：{e}")
+    if flatten:
+        doc.bake(annots=True, widgets=True)
+        return doc, errors
+    try: doc.need_appearances = True
+    except Exception: pass
+    return doc, errors
+
+
+def render_bol(row: dict, template_path: str, flatten: bool = False):
+    """填好一份 BOL，回傳 (pdf bytes, 填寫失敗訊息列表)。"""
+    doc, errors = fill_template(row, template_path, flatten=flatten)
+    try:
+        # 攤平後原本的 AcroForm 物件已無引用，garbage=1 順便清掉
+        data = doc.tobytes(deflate=True, garbage=1 if flatten else 0, encryption=fitz.PDF_ENCRYPT_KEEP)
+    finally:
+        doc.close()
+    return data, errors
+
+
+# ---------- 批次產生（多核心） ----------
+def _render_job(job):
+    """
+    子行程執行：任何例外都轉成失敗訊息，不讓單一檔案中斷整批。
+    一併回傳 render_bol 的耗時（子行程的 metrics 不會回到主行程，由呼叫端記錄）。
+    """
+    name, row, template_path, flatten = job
+    t = time.perf_counter()
+    try:
+        data, errors = render_bol(row, template_path, flatten=flatten)
+        return name, data, errors, None, time.perf_counter() - t
+    except Exception as e:
+        return name, None, [], f"{type(e).__name__}: {e}", time.perf_counter() - t
+
+
+def _render_chunk(chunk):
+    return [_render_job(job) for job in chunk]
+
+
+def generate_bols(jobs, template_path: str, workers: int = 1, parallel_min: int = 10, flatten: bool = False):
+    """
+    jobs: [(name, row_dict), ...]，依輸入順序 yield
+    (name, pdf_bytes 或 None, 填寫警告, 失敗訊息 或 None, 填寫秒數 或 None（行程池異常終止時）)。
+    workers > 1 且筆數 >= parallel_min 時改用 spawn 的 ProcessPoolExecutor，
+    每個子行程各自快取模板；子行程異常終止時，尚未完成的檔案逐一標示失敗。
+    平行時一次只送出 workers * 2 個小批次；呼叫端提前關閉產生器（取消）時丟掉尚未開始的批次，
+    只等正在算的那幾批，不會把整批跑完。
+    """
+    tasks = [(name, row, template_path, flatten) for name, row in jobs]
+    if workers <= 1 or len(tasks) < max(2, parallel_min):
+        for task in tasks:
+            yield _render_job(task)
+        return
+
+    chunksize = max(1, min(4, len(tasks) // (workers * 4)))
+    chunks = [tasks[i:i + chunksize] for i in range(0, len(tasks), chunksize)]
+    done = 0
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context("spawn"))
+    try:
+        pending = deque()
+        next_chunk = 0
+        while pending or next_chunk < len(chunks):
+            while next_chunk < len(chunks) and len(pending) < workers * 2:
+                pending.append(pool.submit(_render_chunk, chunks[next_chunk]))
+                next_chunk += 1
+            for result in pending.popleft().result():
+                done += 1
+                yield result
+    except BrokenProcessPool as e:
+        for name, *_ in tasks[done:]:
+            yield name, None, [], f"BrokenProcessPool: {e}", None
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+# ---------- 合併成單一 PDF ----------
+def _prefix_field_names(doc, roots, prefix: str):
+    """替整份文件的欄位名加前綴，避免合併後各頁同名欄位互相連動。"""
+    for xref in roots:
+        typ, name = doc.xref_get_key(xref, "T")
+        if typ == "string":
+            doc.xref_set_key(xref, "T", fitz.get_pdf_str(prefix + name))
+
+
+def build_merged_bol(jobs, template_path: str, flatten: bool = False, progress=None, cancelled=None):
+    """
+    jobs: [(OriginalTxnId, row_dict), ...]。
+    在同一行程內逐份填寫並附加到同一份輸出文件，每份 BOL 建一個書籤，最後只存檔一次。
+    flatten=True 時每份先攤平再附加（不需要欄位改名）。
+    progress(oid) 於每份處理完後呼叫；cancelled() 回傳 True 時停止附加後續的 BOL。
+    回傳 (pdf bytes 或 None, [(OriginalTxnId, 填寫警告, 失敗訊息 或 None, 填寫秒數), ...])。
+    """
+    out = fitz.open()
+    toc = []
+    results = []
+    for idx, (oid, row) in enumerate(jobs, start=1):
+        if cancelled is not None and cancelled():
+            break
+        t = time.perf_counter()
+        try:
+            doc, errors = fill_template(row, template_path, flatten=flatten)
+            try:
+                if not flatten:
+                    _prefix_field_names(doc, get_template(template_path).field_roots, f"BOL{idx}_")
+                page = len(out) + 1
+                out.insert_pdf(doc)
+                toc.append([1, str(oid), page])   # 插入成功才加書籤，失敗的單不會留下指錯頁的目錄
+            finally:
+                doc.close()
+            results.append((oid, errors, None, time.perf_counter() - t))
+        except Exception as e:
+            results.append((oid, [], f"{type(e).__name__}: {e}", time.perf_counter() - t))
+        if progress is not None:
+            progress(oid)
+    if not len(out):
+        out.close()
+        return None, results
+    try:
+        out.set_toc(toc)
+        if not flatten:
+            try: out.need_appearances = True
+            except Exception: pass
+        data = out.tobytes(deflate=True, garbage=4)  # 4：合併重複的字型 / 串流
+    finally:
+        out.close()
+    return data, results
+
+
+# ---------- ZIP 串流打包 ----------
+class BolZipWriter:
+    """
+    邊產生邊寫入 ZIP：每份 PDF 的 bytes 直接以 ZIP_STORED 寫進封存檔
+    （PDF 內容已 deflate，再壓一次只浪費 CPU）。
+    fileobj 未指定時寫進 SpooledTemporaryFile（超過 spool_max 才落到暫存檔）；
+    要交給 Streamlit 下載的呼叫端請傳入磁碟上的檔案，結束後以路徑重新開啟。
+    """
+
+    def __init__(self, fileobj=None, spool_max: int = 64 * 1024 * 1024):
+        self.fileobj = fileobj if fileobj is not None else tempfile.SpooledTemporaryFile(max_size=spool_max)
+        self._zf = zipfile.ZipFile(self.fileobj, "w", zipfile.ZIP_STORED, allowZip64=True)
+        self._stamp = datetime.now().timetuple()[:6]
+        self.count = 0
+
+    def add(self, arcname: str, data: bytes):
+        info = zipfile.ZipInfo(arcname, date_time=self._stamp)
+        info.compress_type = zipfile.ZIP_STORED
+        self._zf.writestr(info, data)
+        self.count += 1
+
+    def close(self):
+        """結束封存並把檔案指標移回開頭，回傳 fileobj（不會關閉 fileobj）。"""
+        self._zf.close()
+        self.fileobj.seek(0)
+        return self.fileobj
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self._zf.close()
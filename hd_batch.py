@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""
+hd_batch.py — 無畫面批次：抓單 → 依規則檔分配倉別 → 平行產生 BOL →（選用）推送 WMS → 輸出 JSON 報告。
+
+    python hd_batch.py --days 3 --rules warehouse_rules.json --out-dir output_bols --report report.json
+    python hd_batch.py --po-file pos.txt --rules warehouse_rules.json --merged --push
+
+設定（TEAPPLIX_TOKEN、W1_/W2_ 倉別與 WMS 憑證……）與 app.py 相同，改由環境變數 / .env 讀取。
+結束碼：0 = 全部成功；1 = 抓單不完整、有 BOL 失敗、未分配倉別或推送非成功；2 = 參數 / 設定錯誤。
+抓單不完整（Teapplix 錯誤 / 重試用完；有本地快取時代表讀回的可能是舊資料）時預設不產 BOL、不推送，
+除非加上 --allow-partial。
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+from datetime import datetime
+
+import metrics
+import pipeline
+from bol_pdf import generate_bols, build_merged_bol
+from profiling import profiled
+
+log = logging.getLogger("hd_batch")
+
+
+def _read_pos(args):
+    pos = list(args.po or [])
+    if args.po_file:
+        with open(args.po_file, "r", encoding="utf-8") as f:
+            pos.extend(ln.strip() for ln in f if ln.strip())
+    return pos
+
+
+def _write_bols(jobs, args, report):
+    """產生 BOL 寫到 out_dir；結果寫進 report["bol"]。"""
+    out_dir = args.out_dir
+    os.makedirs(out_dir, exist_ok=True)
+    bol = report["bol"]
+    if args.merged:
+        name = f"BOL_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
+        data, results = build_merged_bol(jobs, args.template, flatten=args.flatten)
+        for oid, warnings, failure, seconds in results:
+            pipeline.observe_fill(seconds, failure)
+            if warnings:
+                bol["warnings"][oid] = warnings
+            if failure:
+                bol["failed"].append({"PO": oid, "error": failure})
+            else:
+                bol["ok"] += 1
+        if data:
+            path = os.path.join(out_dir, name)
+            with open(path, "wb") as f:
+                f.write(data)
+            bol["files"].append(path)
+        return
+
+    for oid, data, warnings, failure, seconds in generate_bols(
+        jobs, args.template, workers=args.workers, parallel_min=pipeline.BOL_PARALLEL_MIN, flatten=args.flatten,
+    ):
+        pipeline.observe_fill(seconds, failure)
+        if warnings:
+            bol["warnings"][oid] = warnings
+        if failure:
+            bol["failed"].append({"PO": oid, "error": failure})
+            continue
+        path = os.path.join(out_dir, f"{oid}.pdf".replace(" ", ""))
+        with open(path, "wb") as f:
+            f.write(data)
+        bol["ok"] += 1
+        bol["files"].append(path)
+
+
+def run(args) -> tuple:
+    """執行一次批次，回傳 (report dict, 結束碼)。"""
+    rules = pipeline.load_warehouse_rules(args.rules)   # 先讀規則：格式錯誤時不必白抓單
+    pos = _read_pos(args)
+    report = {
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "source": {"po": len(pos)} if pos else {"days": args.days},
+        "fetch_complete": False,
+        "fetch_error": "",
+        "orders": 0,
+        "pos": 0,
+        "assigned": {},
+        "unassigned": [],
+        "bol": {"ok": 0, "failed": [], "warnings": {}, "files": []},
+        "push": None,
+    }
+
+    # 1) 抓單並依 PO 分組（與畫面相同：有本地快取時先增量同步）
+    fetch = {}
+    if pos:
+        grouped = pipeline.group_by_original_txn(
+            pipeline.iter_orders_by_pos(pos, args.shipped, force_full=args.force_full, status=fetch))
+    else:
+        grouped = pipeline.group_by_original_txn(
+            pipeline.iter_orders(args.days, force_full=args.force_full, status=fetch))
+    report["fetch_complete"] = bool(fetch.get("complete"))
+    report["fetch_error"] = fetch.get("error", "")
+    report["orders"] = sum(len(g) for g in grouped.values())
+    report["pos"] = len(grouped)
+    if not report["fetch_complete"] and not args.allow_partial:
+        log.error("抓單不完整，略過 BOL 與推送：%s", report["fetch_error"] or "（無錯誤訊息）")
+        report["finished_at"] = datetime.now().isoformat(timespec="seconds")
+        report["timings"] = metrics.REGISTRY.summary()
+        report["ok"] = False
+        return report, 1
+
+    # 2) 依規則分配倉別
+    assigned = {}
+    for oid, group in grouped.items():
+        wh = pipeline.assign_warehouse(group, rules)
+        if not wh:
+            report["unassigned"].append(oid)
+            continue
+        assigned[oid] = wh
+        report["assigned"][wh] = report["assigned"].get(wh, 0) + 1
+
+    # 3) BOL
+    if not args.no_bol:
+        jobs = [(oid, pipeline.build_row_from_group(oid, grouped[oid], wh)[0]) for oid, wh in assigned.items()]
+        _write_bols(jobs, args, report)
+
+    # 4) WMS 推送（選用；已成功建單者依推送紀錄略過）
+    push_bad = 0
+    if args.push:
+        pickup = args.pickup_date or pipeline.default_pickup_date_str()
+        entries = [
+            (oid, pipeline.build_wms_params_from_group(oid, grouped[oid], wh, pickup), wh)
+            for oid, wh in assigned.items()
+        ]
+        results = pipeline.push_wms_orders_bulk(entries, pipeline.get_push_ledger(), force=args.force_push)
+        report["push"] = results
+        push_bad = sum(1 for r in results if r["狀態"] not in ("成功", "已推送（略過）"))
+
+    report["finished_at"] = datetime.now().isoformat(timespec="seconds")
+    report["timings"] = metrics.REGISTRY.summary()
+    ok = report["fetch_complete"] and not report["unassigned"] and not report["bol"]["failed"] and not push_bad
+    report["ok"] = ok
+    return report, 0 if ok else 1
+
+
+def build_parser() -> argparse.ArgumentParser:
+    ap = argparse.ArgumentParser(description="Teapplix HD 訂單批次：抓單 → BOL →（選用）推送 WMS")
+    src = ap.add_argument_group("抓單")
+    src.add_argument("--days", type=int, default=3, help="一般抓單天數（預設 3）")
+    src.add_argument("--po", nargs="*", help="改以 PO 搜尋（最近 14 天）")
+    src.add_argument("--po-file", help="PO 清單檔（每行一個）")
+    src.add_argument("--shipped", choices=["0", "1", ""], default="", help="PO 搜尋的出貨狀態（預設不限）")
+    src.add_argument("--force-full", action="store_true", help="忽略本地快取高水位，整窗重抓")
+    src.add_argument("--allow-partial", action="store_true",
+                     help="抓單不完整時仍以已抓到的訂單產 BOL / 推送（結束碼仍為 1）")
+
+    ap.add_argument("--rules", required=True, help="倉別規則 JSON 檔（見 pipeline.load_warehouse_rules）")
+
+    bol = ap.add_argument_group("BOL")
+    bol.add_argument("--out-dir", default=pipeline.OUTPUT_DIR, help=f"BOL 輸出目錄（預設 {pipeline.OUTPUT_DIR}）")
+    bol.add_argument("--template", default=os.path.join(pipeline.APP_DIR, pipeline.TEMPLATE_PDF), help="BOL 模板 PDF")
+    bol.add_argument("--merged", action="store_true", help="合併成單一 PDF（含 PO 書籤）")
+    bol.add_argument("--flatten", action=argparse.BooleanOptionalAction, default=pipeline.FLATTEN_BOL,
+                     help="攤平 BOL（移除表單欄位）；--no-flatten 可覆寫 FLATTEN_BOL=1")
+    bol.add_argument("--workers", type=int, default=pipeline.BOL_WORKERS, help="產生 BOL 的子行程數")
+    bol.add_argument("--no-bol", action="store_true", help="不產生 BOL（只推送）")
+
+    wms = ap.add_argument_group("WMS")
+    wms.add_argument("--push", action="store_true", help="推送到海外倉 WMS")
+    wms.add_argument("--force-push", action="store_true", help="已成功建單的 PO 也重送")
+    wms.add_argument("--pickup-date", help="取件日 YYYY-MM-DD（預設兩天後）")
+
+    ap.add_argument("--report", default="-", help="JSON 報告輸出路徑（預設 - = stdout）")
+    ap.add_argument("--metrics", default=None,
+                    help="各階段計時輸出檔（.prom / .json / .jsonl；預設沿用 METRICS_PATH，空字串停用）")
+    ap.add_argument("--profile", action="store_true",
+                    help="以 cProfile + tracemalloc 剖析整批執行，報告寫到 PROFILE_DIR（預設 profiles/）")
+    ap.add_argument("-v", "--verbose", action="store_true")
+    return ap
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.INFO,
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s",
+        stream=sys.stderr,
+    )
+    if not pipeline.TEAPPLIX_TOKEN:
+        log.error("找不到 TEAPPLIX_TOKEN，請在環境變數或 .env 設定。")
+        return 2
+    if args.metrics is not None:
+        pipeline.METRICS_PATH = args.metrics
+    try:
+        with profiled("hd_batch", args.profile or pipeline.PROFILE_ACTIONS, pipeline.PROFILE_DIR) as prof:
+            report, code = run(args)
+        if prof.path:
+            report["profile"] = prof.path
+            log.info("剖析報告已寫入 %s", prof.path)
+    except (OSError, ValueError) as e:
+        log.error("%s", e)
+        return 2
+    finally:
+        pipeline.flush_metrics()
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.report == "-":
+        print(text)
+    else:
+        with open(args.report, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+        log.info("報告已寫入 %s", args.report)
+    return code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
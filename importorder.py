@@ -1,12 +1,28 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import asyncio
 import json
+import os
+import threading
+import time
+from functools import lru_cache
+from urllib.parse import urlsplit
+from xml.sax.saxutils import escape as xml_escape
+
 import requests
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 import xml.etree.ElementTree as ET
 
+try:
+    import aiohttp  # 只有非同步版（AsyncSoapClient）需要
+except ImportError:
+    aiohttp = None
+
+import metrics
+from teapplix_client import parse_retry_after
+
 # ====== 必填：改成你的實際 API 入口與憑證 ======
 SERVICE = "createOrder" # ← 服務名
 # ===========================================
@@ -189,56 +205,419 @@ def build_soap_envelope(params: dict, app_token: str, app_key: str, service: str
 </SOAP-ENV:Envelope>'''
     return envelope
 
-def requests_session_with_retry() -> requests.Session:
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+# ----- 預先編譯的 Envelope：靜態前後綴 bytes 依 (token, key, service) 快取 -----
+_PARAMS_ENCODER = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+
+def _xml_text(value) -> str:
+    """XML 文字節點跳脫（&、<、>）；大多數值不含這些字元，先檢查以免多餘的字串複製。"""
+    s = "" if value is None else str(value)
+    if "&" in s or "<" in s or ">" in s:
+        return xml_escape(s)
+    return s
+
+class EnvelopeTemplate:
+    """
+    與 build_soap_envelope 相同版面的 SOAP Envelope，但：
+      - 靜態前綴 / 後綴（含已跳脫的 appToken、appKey、service）只編碼一次
+      - paramsJson 做 XML 跳脫，避免參數中的 & / < 破壞 XML
+      - render() 直接回傳可送上線的 UTF-8 bytes
+    """
+
+    __slots__ = ("prefix", "suffix")
+
+    def __init__(self, app_token: str, app_key: str, service: str):
+        self.prefix = (
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<SOAP-ENV:Envelope xmlns:SOAP-ENV="http://schemas.xmlsoap.org/soap/envelope/" xmlns:ns1="http://www.example.org/Ec/">\n'
+            '  <SOAP-ENV:Body>\n'
+            '    <ns1:callService>\n'
+            '      <paramsJson>\n'
+        ).encode("utf-8")
+        self.suffix = (
+            '\n      </paramsJson>\n'
+            f'      <appToken>{_xml_text(app_token)}</appToken>\n'
+            f'      <appKey>{_xml_text(app_key)}</appKey>\n'
+            f'      <service>{_xml_text(service)}</service>\n'
+            '    </ns1:callService>\n'
+            '  </SOAP-ENV:Body>\n'
+            '</SOAP-ENV:Envelope>'
+        ).encode("utf-8")
+
+    def render(self, params: dict) -> bytes:
+        body = _xml_text(_PARAMS_ENCODER.encode(params)).encode("utf-8")
+        return b"".join((self.prefix, body, self.suffix))
+
+@lru_cache(maxsize=64)
+def get_envelope_template(app_token: str, app_key: str, service: str) -> EnvelopeTemplate:
+    return EnvelopeTemplate(app_token, app_key, service)
+
+def build_soap_envelope_bytes(params: dict, app_token: str, app_key: str, service: str) -> bytes:
+    """build_soap_envelope 的 bytes 版（預先編譯 + 正確跳脫），供 SoapClient / AsyncSoapClient 使用。"""
+    return get_envelope_template(app_token, app_key, service).render(params)
+
+def requests_session_with_retry(total: int = 3, backoff_factor: float = 0.5, pool_maxsize: int = 10) -> requests.Session:
     """建立帶重試機制的 requests Session。"""
     retry = Retry(
-        total=3,
-        backoff_factor=0.5,
-        status_forcelist=(429, 500, 502, 503, 504),
+        total=total,
+        backoff_factor=backoff_factor,
+        status_forcelist=RETRY_STATUS,
         allowed_methods=("POST", "GET"),
         raise_on_status=False,
     )
-    adapter = HTTPAdapter(max_retries=retry)
+    adapter = HTTPAdapter(max_retries=retry, pool_connections=1, pool_maxsize=pool_maxsize)
     s = requests.Session()
     s.mount("http://", adapter)
     s.mount("https://", adapter)
     return s
 
-def call_soap(endpoint: str, envelope_xml: str) -> requests.Response:
-    headers = {
-        "Content-Type": "text/xml; charset=utf-8",
-        "SOAPAction": SERVICE,  # 有些服務需要，若報錯可移除或改為實際值
-    }
-    session = requests_session_with_retry()
-    resp = session.post(endpoint, data=envelope_xml.encode("utf-8"), headers=headers, timeout=30)
-    return resp
+class SoapClient:
+    """
+    長駐的 SOAP 用戶端：每個 endpoint（scheme + host）一個 keep-alive 連線池，
+    重複送單時沿用既有 TCP/TLS 連線。執行緒安全，可在多個 Streamlit session 間共用。
+    """
 
-def try_parse_fault(xml_text: str):
-    """嘗試解析 SOAP Fault，若無 Fault 則回傳 None。"""
-    try:
-        ns = {
-            "soap": "http://schemas.xmlsoap.org/soap/envelope/"
+    def __init__(self, pool_maxsize: int = 10, timeout: float = 30, retry_total: int = 3, backoff_factor: float = 0.5):
+        self.pool_maxsize = pool_maxsize
+        self.timeout = timeout
+        self.retry_total = retry_total
+        self.backoff_factor = backoff_factor
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def session_for(self, endpoint: str) -> requests.Session:
+        parts = urlsplit(endpoint)
+        key = f"{parts.scheme}://{parts.netloc}"
+        s = self._sessions.get(key)
+        if s is None:
+            with self._lock:
+                s = self._sessions.get(key)
+                if s is None:
+                    s = requests_session_with_retry(self.retry_total, self.backoff_factor, self.pool_maxsize)
+                    self._sessions[key] = s
+        return s
+
+    def post(self, endpoint: str, envelope_xml) -> requests.Response:
+        headers = {
+            "Content-Type": "text/xml; charset=utf-8",
+            "SOAPAction": SERVICE,  # 有些服務需要，若報錯可移除或改為實際值
         }
-        root = ET.fromstring(xml_text)
-        fault = root.find(".//soap:Fault", ns)
+        body = envelope_xml.encode("utf-8") if isinstance(envelope_xml, str) else envelope_xml
+        # 延遲直方圖依端點（host + path，不含 query）分開記錄；含 urllib3 重試在內的總時間
+        parts = urlsplit(endpoint)
+        label = f"{parts.netloc}{parts.path}"
+        t = time.perf_counter()
+        status = "error"
+        try:
+            resp = self.session_for(endpoint).post(endpoint, data=body, headers=headers, timeout=self.timeout)
+            status = str(resp.status_code)
+            return resp
+        finally:
+            metrics.observe("wms_request_seconds", time.perf_counter() - t, endpoint=label, status=status)
+
+    def send_create_order(self, endpoint: str, app_token: str, app_key: str, params: dict, service: str = SERVICE) -> requests.Response:
+        envelope = build_soap_envelope_bytes(params, app_token, app_key, service)
+        return self.post(endpoint, envelope)
+
+    def close(self):
+        with self._lock:
+            for s in self._sessions.values():
+                s.close()
+            self._sessions.clear()
+
+_default_client = None
+_default_client_lock = threading.Lock()
+_client_options = None   # set_soap_client_options() 設定；未設定時讀環境變數
+
+def _env_client_options() -> dict:
+    return {
+        "pool_maxsize": int(os.getenv("WMS_POOL_MAXSIZE", "10")),
+        "timeout": float(os.getenv("WMS_TIMEOUT", "30")),
+        "retry_total": int(os.getenv("WMS_RETRY_TOTAL", "3")),
+        "backoff_factor": float(os.getenv("WMS_RETRY_BACKOFF", "0.5")),
+    }
+
+def set_soap_client_options(**kwargs):
+    """
+    設定行程共用 SoapClient 的參數（pipeline.load_config 依 env / secrets 呼叫）。
+    用戶端已建立且參數有變時才替換，相同參數重複呼叫不會關掉既有連線池。
+    """
+    global _client_options
+    with _default_client_lock:
+        changed = kwargs != _client_options
+        _client_options = dict(kwargs)
+        rebuild = changed and _default_client is not None
+    if rebuild:
+        configure_soap_client(**kwargs)
+
+def get_soap_client() -> SoapClient:
+    """
+    行程共用的 SoapClient（第一次呼叫時建立）。
+    參數來自 set_soap_client_options()；單獨使用本模組時讀環境變數
+    WMS_POOL_MAXSIZE、WMS_TIMEOUT、WMS_RETRY_TOTAL、WMS_RETRY_BACKOFF。
+    """
+    global _default_client
+    if _default_client is None:
+        with _default_client_lock:
+            if _default_client is None:
+                _default_client = SoapClient(**(_client_options or _env_client_options()))
+    return _default_client
+
+def configure_soap_client(**kwargs) -> SoapClient:
+    """以指定參數替換行程共用的 SoapClient（舊的連線池會關閉）。"""
+    global _default_client
+    with _default_client_lock:
+        old, _default_client = _default_client, SoapClient(**kwargs)
+    if old is not None:
+        old.close()
+    return _default_client
+
+def call_soap(endpoint: str, envelope_xml: str) -> requests.Response:
+    return get_soap_client().post(endpoint, envelope_xml)
+
+# ----- 回應解析：XML 只 parse 一次，同時取出 JSON 節點與 SOAP Fault -----
+SOAP_ENV_NAMESPACES = (
+    "http://schemas.xmlsoap.org/soap/envelope/",   # SOAP 1.1
+    "http://www.w3.org/2003/05/soap-envelope",     # SOAP 1.2
+)
+
+class SoapResult:
+    """
+    createOrder 回應的結構化結果。
+    ok：有 SOAP Fault → False；ask=Success 或 error_code=0 → True；有 JSON 但不符 → False；
+    無 JSON 也無 Success 關鍵字 → None（無法判斷）。
+    """
+
+    __slots__ = ("ask", "error_code", "message", "order_code", "fault", "payload", "ok")
+
+    def __init__(self, payload: dict = None, fault: dict = None, ok=None):
+        payload = payload or {}
+        self.payload = payload
+        self.fault = fault
+        self.ask = str(payload.get("ask", "") or "")
+        self.error_code = str(payload.get("error_code", "") or "")
+        self.message = str(payload.get("message", "") or "")
+        self.order_code = str(payload.get("order_code", "") or "")
         if fault is not None:
-            faultcode = fault.findtext("faultcode") or ""
-            faultstring = fault.findtext("faultstring") or ""
-            return {"faultcode": faultcode, "faultstring": faultstring}
-        return None
+            ok = False
+        elif ok is None and payload:
+            ok = (self.ask.lower() == "success") or (self.error_code == "0")
+        self.ok = ok
+
+    def __repr__(self):
+        return (f"SoapResult(ok={self.ok!r}, ask={self.ask!r}, error_code={self.error_code!r}, "
+                f"message={self.message!r}, order_code={self.order_code!r}, fault={self.fault!r})")
+
+def _has_success_keyword(text) -> bool:
+    """舊版的判斷方式：回應內文直接含 "ask":"Success" / "message":"Success"。"""
+    if isinstance(text, (bytes, bytearray)):
+        return b'"ask":"Success"' in text or b'"message":"Success"' in text
+    return '"ask":"Success"' in text or '"message":"Success"' in text
+
+def _fault_fields(el, ns: str) -> dict:
+    """SOAP 1.1：faultcode / faultstring（無 namespace）；SOAP 1.2：env:Code/env:Value、env:Reason/env:Text。"""
+    code = el.findtext("faultcode")
+    reason = el.findtext("faultstring")
+    if code is None:
+        code = el.findtext(f"{{{ns}}}Code/{{{ns}}}Value")
+    if reason is None:
+        reason = el.findtext(f"{{{ns}}}Reason/{{{ns}}}Text")
+    return {"faultcode": (code or "").strip(), "faultstring": (reason or "").strip()}
+
+def _slice_json(text: str) -> dict:
+    """非 XML（或 XML 壞掉）時的退路：取第一個 { 到最後一個 } 之間嘗試解析。"""
+    start = text.find("{")
+    end = text.rfind("}")
+    if start == -1 or end <= start:
+        return {}
+    js = text[start:end+1]
+    for candidate in (js, js.replace("&quot;", '"').replace("&lt;", "<").replace("&gt;", ">")):
+        try:
+            data = json.loads(candidate)
+            return data if isinstance(data, dict) else {}
+        except ValueError:
+            continue
+    return {}
+
+def parse_soap_response(raw) -> SoapResult:
+    """
+    解析 callService 回應（bytes 或 str）。XML 只 parse 一次：
+    逐一走訪節點，取第一個文字內容以 { 開頭的節點當 JSON payload（實體已由 XML parser 還原），
+    同時記下 SOAP Fault 的 faultcode / faultstring（SOAP 1.2 取 Code/Value 與 Reason/Text）。
+    找不到 JSON 節點時，退回舊版的 "ask":"Success" 關鍵字判斷。
+    """
+    if not raw:
+        return SoapResult()
+    with metrics.timer("soap_parse_seconds"):
+        return _parse_soap_response(raw)
+
+def _parse_soap_response(raw) -> SoapResult:
+    try:
+        root = ET.fromstring(raw)
     except ET.ParseError:
-        return None
+        text = raw.decode("utf-8", "replace") if isinstance(raw, (bytes, bytearray)) else str(raw)
+        payload = _slice_json(text)
+        ok = True if not payload and _has_success_keyword(text) else None
+        return SoapResult(payload, None, ok)
+
+    payload = {}
+    fault = None
+    for el in root.iter():
+        tag = el.tag
+        if fault is None and isinstance(tag, str) and tag.endswith("}Fault") and tag[1:tag.index("}")] in SOAP_ENV_NAMESPACES:
+            fault = _fault_fields(el, tag[1:tag.index("}")])
+            continue
+        if not payload and el.text:
+            text = el.text.strip()
+            if text.startswith("{"):
+                try:
+                    data = json.loads(text)
+                except ValueError:
+                    data = None
+                if isinstance(data, dict):
+                    payload = data
+    ok = True if not payload and fault is None and _has_success_keyword(raw) else None
+    return SoapResult(payload, fault, ok)
+
+def try_parse_fault(xml_text: str):
+    """嘗試解析 SOAP Fault，若無 Fault 則回傳 None。"""
+    return parse_soap_response(xml_text).fault
 # ===== Added: lightweight exports to be imported by app-ok.py =====
 def send_create_order(endpoint: str, app_token: str, app_key: str, params: dict, service: str = SERVICE) -> requests.Response:
     """
     Compose SOAP envelope from params and POST to the given endpoint.
     Returns the raw requests.Response (caller can inspect .status_code and .text).
+    Thin wrapper over the process-wide SoapClient (pooled keep-alive connections).
     """
-    envelope = build_soap_envelope(params, app_token, app_key, service)
-    return call_soap(endpoint, envelope)
+    return get_soap_client().send_create_order(endpoint, app_token, app_key, params, service=service)
 # ===== End Added =====
 
 
+# ===== 非同步版（供自有腳本大量送單；需要 aiohttp） =====
+class AsyncSoapResponse:
+    """非同步送單的回應：欄位與 requests.Response 常用的部分同名（可直接 parse_soap_response(resp.content)）。"""
+
+    __slots__ = ("status_code", "content", "text", "headers")
+
+    def __init__(self, status_code: int, content: bytes, text: str, headers: dict):
+        self.status_code = status_code
+        self.content = content
+        self.text = text
+        self.headers = headers
+
+
+class AsyncSoapClient:
+    """
+    asyncio 版 SoapClient：一個 aiohttp.ClientSession（每個 host 最多 limit_per_host 條連線）。
+    重試語意與 requests_session_with_retry（urllib3 Retry）相同：429/5xx 與連線錯誤最多重試 retry_total 次，
+    第 1 次立即重試，之後間隔 backoff_factor * 2**n（上限 max_backoff）；
+    429/503 有 Retry-After（秒數或 HTTP 日期）時以其為準，同樣不超過 max_backoff。
+
+        async with AsyncSoapClient() as client:
+            resp = await client.send_create_order(endpoint, token, key, params)
+    """
+
+    def __init__(self, limit_per_host: int = 10, timeout: float = 30, retry_total: int = 3, backoff_factor: float = 0.5,
+                 max_backoff: float = 120):
+        if aiohttp is None:
+            raise ImportError("AsyncSoapClient 需要 aiohttp（選用套件，未列在 requirements.txt）：pip install aiohttp")
+        self.limit_per_host = limit_per_host
+        self.timeout = timeout
+        self.retry_total = retry_total
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff   # 同 urllib3 Retry.DEFAULT_BACKOFF_MAX
+        self._session = None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def open(self):
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=0, limit_per_host=self.limit_per_host),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _backoff(self, attempt: int, retry_after=None) -> float:
+        """第 attempt 次重試前的等待秒數（attempt 從 0 起算），公式同 urllib3 Retry.get_backoff_time。"""
+        seconds = parse_retry_after(retry_after)
+        if seconds is None:
+            seconds = self.backoff_factor * (2 ** attempt) if attempt else 0.0
+        return min(self.max_backoff, seconds)
+
+    async def post(self, endpoint: str, envelope_xml) -> AsyncSoapResponse:
+        await self.open()
+        headers = {
+            "Content-Type": "text/xml; charset=utf-8",
+            "SOAPAction": SERVICE,
+        }
+        body = envelope_xml.encode("utf-8") if isinstance(envelope_xml, str) else envelope_xml
+        attempt = 0
+        while True:
+            try:
+                async with self._session.post(endpoint, data=body, headers=headers) as r:
+                    content = await r.read()
+                    if r.status in RETRY_STATUS and attempt < self.retry_total:
+                        retry_after = r.headers.get("Retry-After") if r.status in (429, 503) else None
+                        await asyncio.sleep(self._backoff(attempt, retry_after))
+                        attempt += 1
+                        continue
+                    try:
+                        text = content.decode(r.charset or "utf-8", "replace")
+                    except LookupError:   # 伺服器給了不認得的 charset
+                        text = content.decode("utf-8", "replace")
+                    return AsyncSoapResponse(r.status, content, text, dict(r.headers))
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                if attempt >= self.retry_total:
+                    raise
+                await asyncio.sleep(self._backoff(attempt))
+                attempt += 1
+
+    async def send_create_order(self, endpoint: str, app_token: str, app_key: str, params: dict, service: str = SERVICE) -> AsyncSoapResponse:
+        envelope = build_soap_envelope_bytes(params, app_token, app_key, service)
+        return await self.post(endpoint, envelope)
+
+
+async def async_send_create_order(endpoint: str, app_token: str, app_key: str, params: dict,
+                                  service: str = SERVICE, client: AsyncSoapClient = None) -> AsyncSoapResponse:
+    """send_create_order 的 async 版；未給 client 時建立一次性的 AsyncSoapClient。"""
+    if client is not None:
+        return await client.send_create_order(endpoint, app_token, app_key, params, service=service)
+    async with AsyncSoapClient() as c:
+        return await c.send_create_order(endpoint, app_token, app_key, params, service=service)
+
+
+async def async_send_many(jobs, concurrency: int = 20, service: str = SERVICE, client: AsyncSoapClient = None) -> list:
+    """
+    jobs: [(endpoint, app_token, app_key, params), ...]；以 Semaphore 限制同時在途數。
+    回傳與 jobs 同順序的列表，每個元素是 AsyncSoapResponse 或該筆的例外物件（不會中斷其他筆）。
+    """
+    sem = asyncio.Semaphore(concurrency)
+    own = client is None
+    client = client or AsyncSoapClient(limit_per_host=concurrency)
+
+    async def one(job):
+        endpoint, app_token, app_key, params = job
+        async with sem:
+            return await client.send_create_order(endpoint, app_token, app_key, params, service=service)
+
+    try:
+        return await asyncio.gather(*(one(job) for job in jobs), return_exceptions=True)
+    finally:
+        if own:
+            await client.close()
+
+
 def main():
     params = build_params_dict()
     envelope = build_soap_envelope(params, APP_TOKEN, APP_KEY, SERVICE)
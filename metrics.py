@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+# metrics.py — 行程內的輕量計時 / 計數（各階段延遲直方圖），可輸出 Prometheus 文字格式或 JSON
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# 秒；涵蓋單次 SOAP / 單頁 API（數十毫秒）到整批抓單 / BOL（數分鐘）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+RECENT_SAMPLES = 256   # 每個序列保留最近幾筆原始值，給畫面算 p50 / p99
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _quantile(sorted_vals, q: float) -> float:
+    if not sorted_vals:
+        return 0.0
+    return sorted_vals[min(len(sorted_vals) - 1, int(q * len(sorted_vals)))]
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "count", "sum", "max", "recent")
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.recent = deque(maxlen=RECENT_SAMPLES)
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+        self.recent.append(value)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+
+class Registry:
+    """
+    名稱 + 標籤 → Histogram / 計數器。所有方法皆可在 worker thread 呼叫。
+    直方圖名稱以 _seconds 結尾、計數器以 _total 結尾（Prometheus 慣例）。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hists = {}      # (name, label_key) → Histogram
+        self._counters = {}   # (name, label_key) → float
+        self._help = {}
+        self.dirty = False
+
+    def describe(self, name: str, text: str):
+        self._help[name] = text
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            h = self._hists.get(key)
+            if h is None:
+                h = self._hists[key] = Histogram()
+            h.observe(seconds)
+            self.dirty = True
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+            self.dirty = True
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """with metrics.timer("fill_pdf_seconds"): ...；例外時標籤加上 outcome=error。"""
+        t = time.perf_counter()
+        outcome = "ok"
+        try:
+            yield
+        except BaseException:
+            outcome = "error"
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - t, outcome=outcome, **labels)
+
+    def reset(self):
+        with self._lock:
+            self._hists.clear()
+            self._counters.clear()
+            self.dirty = True
+
+    # ----- 輸出 -----
+    def summary(self):
+        """畫面用：每個直方圖序列一列（次數、平均、p50、p99、最大，毫秒）。"""
+        rows = []
+        with self._lock:
+            items = [(name, lk, h.count, h.sum, h.max, sorted(h.recent)) for (name, lk), h in self._hists.items()]
+        for name, lk, count, total, mx, recent in sorted(items):
+            rows.append({
+                "metric": name.removesuffix("_seconds"),
+                "labels": ", ".join(f"{k}={v}" for k, v in lk),
+                "count": count,
+                "avg_ms": round(total / count * 1000, 1) if count else 0.0,
+                "p50_ms": round(_quantile(recent, 0.50) * 1000, 1),
+                "p99_ms": round(_quantile(recent, 0.99) * 1000, 1),
+                "max_ms": round(mx * 1000, 1),
+            })
+        return rows
+
+    def counters(self):
+        with self._lock:
+            return {
+                name + ("{" + ",".join(f"{k}={v}" for k, v in lk) + "}" if lk else ""): value
+                for (name, lk), value in sorted(self._counters.items())
+            }
+
+    def to_prometheus(self, prefix: str = "hdltl_") -> str:
+        def fmt_labels(lk, extra=()):
+            pairs = list(lk) + list(extra)
+            if not pairs:
+                return ""
+            esc = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+            return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, esc)) + "}"
+
+        lines = []
+        with self._lock:
+            hists = sorted(self._hists.items())
+            counters = sorted(self._counters.items())
+            seen = set()
+            for (name, lk), h in hists:
+                full = prefix + name
+                if full not in seen:
+                    seen.add(full)
+                    if name in self._help:
+                        lines.append(f"# HELP {full} {self._help[name]}")
+                    lines.append(f"# TYPE {full} histogram")
+                cum = 0
+                for bound, c in zip(h.buckets, h.counts):
+                    cum += c
+                    lines.append(f"{full}_bucket{fmt_labels(lk, [('le', repr(float(bound)))])} {cum}")
+                lines.append(f"{full}_bucket{fmt_labels(lk, [('le', '+Inf')])} {h.count}")
+                lines.append(f"{full}_sum{fmt_labels(lk)} {h.sum:.6f}")
+                lines.append(f"{full}_count{fmt_labels(lk)} {h.count}")
+            for (name, lk), value in counters:
+                full = prefix + name
+                if full not in seen:
+                    seen.add(full)
+                    if name in self._help:
+                        lines.append(f"# HELP {full} {self._help[name]}")
+                    lines.append(f"# TYPE {full} counter")
+                lines.append(f"{full}{fmt_labels(lk)} {value:g}")
+        return "\n".join(lines) + "\n"
+
+    def to_json(self) -> dict:
+        return {"ts": time.time(), "timers": self.summary(), "counters": self.counters()}
+
+    def write(self, path: str):
+        """
+        依副檔名輸出：.jsonl → 追加一行 JSON 快照；.json → 覆寫 JSON 快照；其他 → Prometheus 文字格式
+        （給 node_exporter textfile collector，先寫暫存檔再 rename，避免讀到半份）。
+        """
+        if not path:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        if path.endswith(".jsonl"):
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(self.to_json(), ensure_ascii=False) + "\n")
+        else:
+            text = json.dumps(self.to_json(), ensure_ascii=False, indent=2) if path.endswith(".json") else self.to_prometheus()
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(text)
+            os.replace(tmp, path)
+        self.dirty = False
+
+
+# 行程共用的預設 registry
+REGISTRY = Registry()
+observe = REGISTRY.observe
+inc = REGISTRY.inc
+timer = REGISTRY.timer
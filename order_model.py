@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+# order_model.py — Teapplix 訂單的精簡投影（只留 app 用得到的欄位，取代整包 JSON 放在 session_state）
+import json
+from dataclasses import dataclass, field
+from datetime import datetime
+
+from order_store import txn_key, TZ_PHX  # 與本地快取使用相同主鍵 / 時區
+
+# ---------- 衍生欄位（投影時每筆只算一次） ----------
+SCAC_CARRIER_NAMES = {
+    "EXLA": "Estes Express Lines",
+    "AACT": "AAA Cooper Transportation",
+    "CTII": "Central Transport Inc.",
+    "CETR": "Central Transport Inc.",
+    "ABF":  "ABF",
+    "PITD": "PITT Ohio",
+    "FXFE": "FedEx Freight",
+    "UPGF": "UPS Freight",
+    "RLCA": "R+L Carriers",
+    "SAIA": "SAIA",
+    "ODFL": "Old Dominion",
+    "PYLR": "A Duie Pyle",
+    "ABFS": "ABF Freight System",
+}
+
+def override_carrier_name_by_scac(scac: str, current_name: str) -> str:
+    return SCAC_CARRIER_NAMES.get((scac or "").strip().upper(), current_name)
+
+def oz_to_lb(oz):
+    try:
+        return round(float(oz)/16.0, 2)
+    except Exception:
+        return None
+
+_DATE_FORMATS = ("%Y/%m/%d %H:%M:%S", "%Y-%m-%d %H:%M:%S", "%Y/%m/%d", "%Y-%m-%d")
+_DIGITS_TO_9 = str.maketrans("0123456789", "9999999999")
+_date_format_by_shape = {}   # 數字全換成 9 的「外形」→ 上次成功的格式；同一來源的日期外形幾乎都一樣
+
+def _parse_naive_date(val: str):
+    shape = val.translate(_DIGITS_TO_9)
+    fmt = _date_format_by_shape.get(shape)
+    if fmt:
+        try:
+            return datetime.strptime(val, fmt)
+        except ValueError:
+            pass
+    # 各格式分隔符 / 是否含時間都不同，同一字串最多只會符合其中一個
+    for fmt in _DATE_FORMATS:
+        try:
+            dt = datetime.strptime(val, fmt)
+        except ValueError:
+            continue
+        _date_format_by_shape[shape] = fmt
+        return dt
+    return None
+
+def order_date_str(raw: str) -> str:
+    """PaymentDate 等原始字串 → 鳳凰城時區的 MM/DD/YY；無法解析回傳空字串。"""
+    val = (raw or "").strip()
+    if not val:
+        return ""
+    dt = None
+    if "T" in val:
+        try:
+            dt = datetime.fromisoformat(val.replace("Z", "+00:00"))
+        except ValueError:
+            dt = None
+    else:
+        dt = _parse_naive_date(val)
+    if dt is None:
+        try:
+            dt = datetime.fromisoformat(val[:19])
+        except ValueError:
+            return ""
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=TZ_PHX)
+    return dt.astimezone(TZ_PHX).strftime("%m/%d/%y")
+
+def _package_totals(packages) -> tuple:
+    """(總件數, 總磅數)；件數至少算 1，磅數四捨五入成整數（與逐筆加總 BOL 的規則一致）。"""
+    total_pkgs = 0
+    total_lb = 0.0
+    for pkg in packages:
+        count = max(1, pkg.count)
+        total_pkgs += count
+        total_lb   += (oz_to_lb(pkg.weight_oz) or 0.0) * count
+    return total_pkgs, int(round(total_lb))
+
+
+@dataclass(slots=True, frozen=True)
+class OrderItem:
+    sku: str          # ItemSKU，無則 ItemCustom（未 strip，與原始資料一致）
+    quantity: int     # 解析失敗視為 0
+
+
+@dataclass(slots=True, frozen=True)
+class PackageInfo:
+    count: int        # IdenticalPackageCount（預設 1）
+    weight_oz: object  # Weight.Value 原值，可能是 None / 字串
+
+
+@dataclass(slots=True)
+class OrderRecord:
+    txn_key: str
+    original_txn_id: str
+    shipped: str
+    # To.*
+    to_name: str
+    to_company: str
+    to_street: str
+    to_street2: str
+    to_city: str
+    to_state: str
+    to_zip: str
+    to_phone: str
+    # OrderDetails.*
+    ship_class: str
+    custom: str
+    date_raw: str     # PaymentDate / OrderDate / Created ... 第一個非空值
+    # ShippingDetails[*].Package
+    packages: tuple
+    tracking_number: str   # 取自 ShippingDetails[0]
+    carrier_name: str      # 取自 ShippingDetails[0]
+    items: tuple
+    raw: dict | None = field(default=None, repr=False, compare=False)
+    # 衍生欄位：__post_init__ 一次算好，分組 / 表格 / BOL / WMS 都直接讀
+    order_date: str = field(init=False)      # date_raw → 鳳凰城 MM/DD/YY
+    first_sku: str = field(init=False)       # 第一個品項的 SKU（無品項為空字串）
+    first_qty: int = field(init=False)
+    total_pkgs: int = field(init=False)
+    total_lb: int = field(init=False)
+    carrier_final: str = field(init=False)   # 依 ShipClass（SCAC）覆寫後的承運商名稱
+
+    def __post_init__(self):
+        self.order_date = order_date_str(self.date_raw)
+        first = self.items[0] if self.items else None
+        self.first_sku = first.sku if first else ""
+        self.first_qty = first.quantity if first else 0
+        self.total_pkgs, self.total_lb = _package_totals(self.packages)
+        self.carrier_final = override_carrier_name_by_scac(self.ship_class.strip(), self.carrier_name.strip())
+
+    @classmethod
+    def from_teapplix(cls, order: dict, keep_raw: bool = False) -> "OrderRecord":
+        """由 Teapplix OrderNotification 的單筆訂單投影；keep_raw=True 才保留原始 dict。"""
+        to = order.get("To") or {}
+        od = order.get("OrderDetails") or {}
+
+        details = order.get("ShippingDetails") or []
+        packages = []
+        for sd in details:
+            pkg = (sd or {}).get("Package") or {}
+            try:
+                count = int(pkg.get("IdenticalPackageCount") or 1)
+            except (TypeError, ValueError):
+                count = 1
+            packages.append(PackageInfo(count, (pkg.get("Weight") or {}).get("Value")))
+        first_pkg = ((details or [{}])[0] or {}).get("Package") or {}
+        tracking = first_pkg.get("TrackingInfo") or {}
+
+        raw_items = order.get("OrderItems") or []
+        if isinstance(raw_items, dict):
+            raw_items = [raw_items]
+        items = []
+        for it in raw_items:
+            try:
+                qty = int(it.get("Quantity") or 0)
+            except (TypeError, ValueError):
+                qty = 0
+            items.append(OrderItem(it.get("ItemSKU") or it.get("ItemCustom") or "", qty))
+
+        date_raw = next((v for v in (
+            od.get("PaymentDate"),
+            od.get("OrderDate"),
+            order.get("PaymentDate"),
+            order.get("Created"),
+            order.get("CreateDate"),
+        ) if v), "")
+
+        def s(v):
+            return "" if v is None else str(v)
+
+        return cls(
+            txn_key=txn_key(order),
+            original_txn_id=str(order.get("OriginalTxnId") or "").strip(),
+            shipped=str(order.get("Shipped") or order.get("shipped") or "").strip(),
+            to_name=s(to.get("Name")),
+            to_company=s(to.get("Company")),
+            to_street=s(to.get("Street")),
+            to_street2=s(to.get("Street2")),
+            to_city=s(to.get("City")),
+            to_state=s(to.get("State")),
+            to_zip=s(to.get("ZipCode")),
+            to_phone=s(to.get("PhoneNumber")),
+            ship_class=s(od.get("ShipClass")),
+            custom=s(od.get("Custom")),
+            date_raw=s(date_raw),
+            packages=tuple(packages),
+            tracking_number=s(tracking.get("TrackingNumber")),
+            carrier_name=s(tracking.get("CarrierName")),
+            items=tuple(items),
+            raw=order if keep_raw else None,
+        )
+
+    def load_raw(self, store=None) -> dict | None:
+        """需要原始 JSON 時才取：先看投影時是否保留，否則向本地快取以 txn_key 查回。"""
+        if self.raw is not None:
+            return self.raw
+        if store is None:
+            return None
+        raw = store.get_raw(self.txn_key)
+        return json.loads(raw) if raw else None
@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+# order_store.py — Teapplix 訂單本地快取（SQLite），以 PaymentDate 高水位做增量同步
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+try:
+    from zoneinfo import ZoneInfo
+except ImportError:
+    from backports.zoneinfo import ZoneInfo
+
+TZ_PHX = ZoneInfo("America/Phoenix")
+DATE_FMT = "%Y-%m-%dT%H:%M:%S"   # 與 phoenix_range_days 相同格式，可直接做字串比較
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS orders (
+    txn_key         TEXT PRIMARY KEY,          -- TxnId（無則 OriginalTxnId + 內容雜湊）
+    store_key       TEXT NOT NULL,
+    original_txn_id TEXT NOT NULL DEFAULT '',
+    payment_date    TEXT NOT NULL DEFAULT '',  -- Phoenix 時間，DATE_FMT；無法解析為空字串（不落在任何區間）
+    shipped         TEXT NOT NULL DEFAULT '',
+    raw_json        TEXT NOT NULL,
+    synced_at       TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_orders_otid ON orders(original_txn_id);
+CREATE INDEX IF NOT EXISTS idx_orders_paydate ON orders(store_key, payment_date);
+
+CREATE TABLE IF NOT EXISTS sync_state (
+    scope          TEXT PRIMARY KEY,           -- "<StoreKey>|<Shipped 或 *>"
+    window_start   TEXT NOT NULL,              -- 已連續同步區間的起點
+    high_water     TEXT NOT NULL,              -- 已同步的最新 PaymentDate
+    full_synced_at TEXT NOT NULL               -- 最近一次完整同步（UTC ISO）
+);
+"""
+
+
+def _utc_now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+
+def payment_date_key(order) -> str:
+    """取訂單付款日並轉成 Phoenix DATE_FMT 字串；無法解析時回傳空字串。"""
+    od = order.get("OrderDetails") or {}
+    raw = next((v for v in (
+        od.get("PaymentDate"),
+        od.get("OrderDate"),
+        order.get("PaymentDate"),
+        order.get("Created"),
+        order.get("CreateDate"),
+    ) if v), None)
+    if not raw:
+        return ""
+    val = str(raw).strip()
+    dt = None
+    try:
+        dt = datetime.fromisoformat(val.replace("Z", "+00:00").replace("/", "-"))
+    except ValueError:
+        try:
+            dt = datetime.fromisoformat(val[:19].replace("/", "-"))
+        except ValueError:
+            return ""
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=TZ_PHX)
+    return dt.astimezone(TZ_PHX).strftime(DATE_FMT)
+
+
+def txn_key(order) -> str:
+    txn = str(order.get("TxnId") or "").strip()
+    if txn:
+        return txn
+    oid = str(order.get("OriginalTxnId") or "").strip()
+    digest = hashlib.sha1(json.dumps(order, sort_keys=True).encode("utf-8")).hexdigest()[:12]
+    return f"{oid}#{digest}"
+
+
+def scope_of(store_key: str, shipped: str) -> str:
+    return f"{store_key}|{shipped if shipped in ('0', '1') else '*'}"
+
+
+class OrderStore:
+    """
+    以 txn_key 為主鍵、OriginalTxnId / PaymentDate 為索引的訂單快取。
+    每個 scope（StoreKey + Shipped 條件）各自記錄高水位；
+    增量同步只抓 [high_water - overlap, end]，超過 full_resync_hours 則整窗重抓。
+    """
+
+    def __init__(self, path: str, overlap_minutes: int = 60, full_resync_hours: float = 6.0):
+        self.path = path
+        self.overlap = timedelta(minutes=overlap_minutes)
+        self.full_resync = timedelta(hours=full_resync_hours)
+        self._lock = threading.Lock()
+        d = os.path.dirname(os.path.abspath(path))
+        os.makedirs(d, exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            with conn:  # 成功 commit、例外 rollback
+                yield conn
+        finally:
+            conn.close()
+
+    # ----- 同步規劃 -----
+    def plan_sync(self, scope: str, start: str, end: str, force_full: bool = False):
+        """回傳 (實際要抓的 PaymentDateStart, 是否為完整同步)。"""
+        if force_full:
+            return start, True
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT window_start, high_water, full_synced_at FROM sync_state WHERE scope = ?",
+                (scope,),
+            ).fetchone()
+        if not row:
+            return start, True
+        window_start, high_water, full_synced_at = row
+        try:
+            age = datetime.now(timezone.utc) - datetime.fromisoformat(full_synced_at)
+        except ValueError:
+            return start, True
+        if window_start > start or age > self.full_resync or not high_water:
+            return start, True
+        delta_start = datetime.strptime(high_water, DATE_FMT) - self.overlap
+        return max(start, delta_start.strftime(DATE_FMT)), False
+
+    def mark_synced(self, scope: str, start: str, seen_high_water: str, full: bool):
+        """同步成功後推進高水位；完整同步時重設區間起點與完整同步時間。"""
+        with self._lock, self._connect() as conn:
+            row = conn.execute(
+                "SELECT window_start, high_water, full_synced_at FROM sync_state WHERE scope = ?",
+                (scope,),
+            ).fetchone()
+            if full or not row:
+                window_start, high_water, full_at = start, "", _utc_now_iso()
+            else:
+                window_start, high_water, full_at = row
+            high_water = max(high_water, seen_high_water or "")
+            conn.execute(
+                "INSERT OR REPLACE INTO sync_state (scope, window_start, high_water, full_synced_at) "
+                "VALUES (?, ?, ?, ?)",
+                (scope, window_start, high_water, full_at),
+            )
+
+    # ----- 寫入 -----
+    def upsert(self, orders, store_key: str, shipped_hint: str = ""):
+        """
+        寫入 / 覆蓋訂單；訂單本身沒有 Shipped 時以查詢條件 shipped_hint 補上。
+        付款日無法解析的訂單 payment_date 存空字串：區間查詢不會撈到，由呼叫端以 extra_keys 指定。
+        回傳 (寫入的 txn_key 列表, 這批中最新的 PaymentDate, 付款日無法解析的 txn_key 列表)。
+        """
+        now = _utc_now_iso()
+        rows = []
+        undated = []
+        high_water = ""
+        for o in orders:
+            shipped = str(o.get("Shipped") or o.get("shipped") or shipped_hint or "").strip()
+            paid = payment_date_key(o)
+            high_water = max(high_water, paid)
+            key = txn_key(o)
+            if not paid:
+                undated.append(key)
+            rows.append((
+                key,
+                store_key,
+                str(o.get("OriginalTxnId") or "").strip(),
+                paid,
+                shipped,
+                json.dumps(o, ensure_ascii=False, separators=(",", ":")),
+                now,
+            ))
+        if not rows:
+            return [], high_water, undated
+        with self._lock, self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO orders "
+                "(txn_key, store_key, original_txn_id, payment_date, shipped, raw_json, synced_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+        return [r[0] for r in rows], high_water, undated
+
+    def prune_missing(self, keep_keys, store_key: str, start: str, end: str, shipped: str):
+        """完整同步後，刪除區間內（含付款日無法解析的）此 scope 應回傳卻未回傳的舊資料（例如已出貨）。"""
+        keep = set(keep_keys)
+        sql = "SELECT txn_key FROM orders WHERE store_key = ? AND (payment_date BETWEEN ? AND ? OR payment_date = '')"
+        args = [store_key, start, end]
+        if shipped in ("0", "1"):
+            sql += " AND shipped = ?"
+            args.append(shipped)
+        with self._lock, self._connect() as conn:
+            stale = [(k,) for (k,) in conn.execute(sql, args) if k not in keep]
+            conn.executemany("DELETE FROM orders WHERE txn_key = ?", stale)
+
+    # ----- 讀取 -----
+    @staticmethod
+    def _key_chunks(keys):
+        keys = sorted(set(keys))
+        for i in range(0, len(keys), 500):  # SQLite 參數數量上限
+            yield keys[i:i + 500]
+
+    def iter_query(self, store_key: str, start: str, end: str, shipped: str = "", extra_keys=()):
+        """
+        依 PaymentDate 區間逐筆讀回原始訂單 dict（依付款日排序；游標串流，不一次載入）。
+        extra_keys：區間外另外要讀回的 txn_key（這次同步抓到、但付款日無法解析的訂單），排在最後。
+        """
+        where = "store_key = ?"
+        args = [store_key]
+        if shipped in ("0", "1"):
+            where += " AND shipped = ?"
+            args.append(shipped)
+        with self._connect() as conn:
+            cur = conn.execute(
+                f"SELECT raw_json FROM orders WHERE {where} AND payment_date BETWEEN ? AND ? "
+                "ORDER BY payment_date, rowid",
+                [*args, start, end],
+            )
+            for (raw,) in cur:
+                yield json.loads(raw)
+            for chunk in self._key_chunks(extra_keys):
+                marks = ",".join("?" * len(chunk))
+                cur = conn.execute(
+                    f"SELECT raw_json FROM orders WHERE {where} AND payment_date = '' AND txn_key IN ({marks}) "
+                    "ORDER BY rowid",
+                    [*args, *chunk],
+                )
+                for (raw,) in cur:
+                    yield json.loads(raw)
+
+    def get_raw(self, key: str):
+        """以 txn_key 取回原始 JSON 字串（供 OrderRecord.load_raw 使用）。"""
+        with self._connect() as conn:
+            row = conn.execute("SELECT raw_json FROM orders WHERE txn_key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def find_by_original(self, oids, store_key: str, start: str, end: str, extra_keys=()):
+        """OriginalTxnId → [order, ...]；只回傳有命中的 PO。extra_keys 同 iter_query（付款日無法解析的訂單）。"""
+        index = {}
+        extra = set(extra_keys)
+        with self._connect() as conn:
+            for chunk in self._key_chunks(o for o in oids if o):
+                marks = ",".join("?" * len(chunk))
+                cur = conn.execute(
+                    f"SELECT original_txn_id, txn_key, payment_date, raw_json FROM orders "
+                    f"WHERE store_key = ? AND (payment_date BETWEEN ? AND ? OR payment_date = '') "
+                    f"AND original_txn_id IN ({marks}) ORDER BY payment_date = '', payment_date, rowid",
+                    [store_key, start, end, *chunk],
+                )
+                for oid, key, paid, raw in cur:
+                    if paid or key in extra:
+                        index.setdefault(oid, []).append(json.loads(raw))
+        return index
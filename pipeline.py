@@ -0,0 +1,1067 @@
+# -*- coding: utf-8 -*-
+# pipeline.py — 抓單 → 分組 → BOL → WMS 推送的核心邏輯（不依賴 Streamlit；app.py 與 hd_batch.py 共用）
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from dotenv import load_dotenv
+
+# ★ 使用你可用的 SOAP 封裝與送單邏輯
+from importorder import send_create_order, parse_soap_response, set_soap_client_options  # endpoint, app_token, app_key, params, service
+from order_store import OrderStore, scope_of, TZ_PHX
+from order_model import OrderRecord
+from push_ledger import PushLedger
+from teapplix_client import TeapplixClient
+from bol_pdf import render_bol, generate_bols, build_merged_bol, BolZipWriter
+import metrics
+from profiling import profiled
+
+log = logging.getLogger("pipeline")
+
+# ---------- 固定設定 ----------
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+TEMPLATE_PDF = "BOL.pdf"
+OUTPUT_DIR = "output_bols"
+BASE_URL  = "https://api.teapplix.com/api2/OrderNotification"  # ← 保留 GET + 固定路徑
+STORE_KEY = "HD"
+SHIPPED_DEFAULT = "0"   # 一般抓單預設：未出貨
+PAGE_SIZE = 500
+
+BILL_NAME         = "THE HOME DEPOT"
+BILL_ADDRESS      = "2455 PACES FERRY RD"
+BILL_CITYSTATEZIP = "ATLANTA, GA 30339"
+
+# ---------- secrets / env ----------
+def _env(name, default=""):
+    return os.getenv(name, default)
+
+def _flag(value) -> bool:
+    return str(value).strip().lower() in ("1", "true", "yes", "on")
+
+def load_config(get=_env):
+    """
+    讀取可調設定到模組變數。get(name, default) 為設定來源：
+    預設只看環境變數（.env 已載入）；app.py 傳入先查 st.secrets 的 _sec。
+    行程共用物件（HTTP Session / Teapplix 用戶端 / 訂單快取 / 推送紀錄）在第一次使用時才依當下設定建立。
+    """
+    global TEAPPLIX_TOKEN, AUTH_BEARER, X_API_KEY
+    global FETCH_WORKERS, PO_BATCH_MIN, TEAPPLIX_RATE, TEAPPLIX_BURST, TEAPPLIX_RETRIES, TEAPPLIX_BACKOFF, TEAPPLIX_MAX_BACKOFF
+    global BOL_WORKERS, BOL_PARALLEL_MIN, FLATTEN_BOL
+    global ORDER_STORE_PATH, STORE_OVERLAP_MINUTES, STORE_FULL_RESYNC_HOURS, PUSH_LEDGER_PATH
+    global WMS_SERVICE, WAREHOUSES, WMS_CONFIGS, METRICS_PATH, PROFILE_ACTIONS, PROFILE_DIR
+
+    TEAPPLIX_TOKEN = get("TEAPPLIX_TOKEN", "")
+    AUTH_BEARER    = get("TEAPPLIX_AUTH_BEARER", "")
+    X_API_KEY      = get("TEAPPLIX_X_API_KEY", "")
+
+    # Teapplix 分頁平行抓取的執行緒數（同時在途的頁數上限）
+    FETCH_WORKERS  = max(1, int(get("TEAPPLIX_FETCH_WORKERS", "4") or 4))
+    # PO 搜尋：輸入的 PO 數達此門檻時，改為整窗批次抓取 + 索引比對
+    PO_BATCH_MIN   = max(1, int(get("PO_BATCH_MIN", "5") or 5))
+    # Teapplix 限速 / 重試：每秒請求數（0 = 不限速）與突發量；429 / 5xx / 連線錯誤的重試次數與退避秒數
+    TEAPPLIX_RATE        = float(get("TEAPPLIX_RATE", "8") or 0)
+    TEAPPLIX_BURST       = max(1, int(get("TEAPPLIX_BURST", str(FETCH_WORKERS)) or FETCH_WORKERS))
+    TEAPPLIX_RETRIES     = max(0, int(get("TEAPPLIX_RETRIES", "4") or 0))
+    TEAPPLIX_BACKOFF     = float(get("TEAPPLIX_BACKOFF", "0.5") or 0.5)
+    TEAPPLIX_MAX_BACKOFF = float(get("TEAPPLIX_MAX_BACKOFF", "60") or 60)
+
+    # BOL 產生的子行程數（1 = 不開行程池）；筆數達 BOL_PARALLEL_MIN 才開行程池
+    BOL_WORKERS      = max(1, int(get("BOL_WORKERS", str(min(4, os.cpu_count() or 1))) or 1))
+    BOL_PARALLEL_MIN = int(get("BOL_PARALLEL_MIN", "10") or 10)
+    # 預設是否輸出攤平（無表單欄位）的 BOL
+    FLATTEN_BOL      = _flag(get("FLATTEN_BOL", "0"))
+
+    # 本地訂單快取（SQLite）；設成空字串則停用，每次都直接向 Teapplix 抓整個區間
+    ORDER_STORE_PATH = get("ORDER_STORE_PATH", os.path.join(APP_DIR, "orders_cache.sqlite3"))
+    STORE_OVERLAP_MINUTES   = int(get("STORE_OVERLAP_MINUTES", "60") or 60)      # 增量同步回看的重疊時間
+    STORE_FULL_RESYNC_HOURS = float(get("STORE_FULL_RESYNC_HOURS", "6") or 6)    # 超過則整窗重抓（更新出貨狀態）
+
+    # WMS 推送紀錄（避免同一 reference_no 重複建單）
+    PUSH_LEDGER_PATH = get("PUSH_LEDGER_PATH", os.path.join(APP_DIR, "push_ledger.sqlite3"))
+
+    # 各階段計時輸出檔：.prom / .txt → Prometheus 文字格式；.json → JSON 快照；.jsonl → 逐次追加；空字串停用
+    METRICS_PATH = get("METRICS_PATH", os.path.join(APP_DIR, "metrics.prom"))
+    # 剖析模式：每個按鈕動作以 cProfile + tracemalloc 剖析，報告寫到 PROFILE_DIR（畫面上也可臨時開啟）
+    PROFILE_ACTIONS = _flag(get("PROFILE_ACTIONS", "0"))
+    PROFILE_DIR     = get("PROFILE_DIR", os.path.join(APP_DIR, "profiles"))
+
+    # 送單服務名（沿用你可用版本的預設 createOrder；若供應商改名，可在 .env 或 secrets 覆寫）
+    WMS_SERVICE = get("WMS_SERVICE", "createOrder")
+
+    # 倉庫基本資料（BOL 用）
+    WAREHOUSES = {
+        "CA 91789": {
+            "name": get("W1_NAME", "Festival Neo CA"),
+            "addr": get("W1_ADDR", "5500 Mission Blvd"),
+            "citystatezip": get("W1_CITYSTATEZIP", "Montclair, CA 91763"),
+            "sid": get("W1_SID", "CA-001"),
+        },
+        "NJ 08816": {
+            "name": get("W2_NAME", "Festival Neo NJ"),
+            "addr": get("W2_ADDR", "10 Main St"),
+            "citystatezip": get("W2_CITYSTATEZIP", "East Brunswick, NJ 08816"),
+            "sid": get("W2_SID", "NJ-001"),
+        },
+    }
+
+    # WMS 送單憑證（依倉別）
+    WMS_CONFIGS = {
+        "CA 91789": {
+            "ENDPOINT_URL": get("W1_WMS_ENDPOINT", ""),
+            "APP_TOKEN": get("W1_WMS_APP_TOKEN", ""),
+            "APP_KEY": get("W1_WMS_APP_KEY", ""),
+            "WAREHOUSE_CODE": get("W1_WMS_CODE", "CAW"),
+            "CONCURRENCY": max(1, int(get("W1_WMS_CONCURRENCY", "4") or 4)),  # 批次推送同時在途上限
+        },
+        "NJ 08816": {
+            "ENDPOINT_URL": get("W2_WMS_ENDPOINT", ""),
+            "APP_TOKEN": get("W2_WMS_APP_TOKEN", ""),
+            "APP_KEY": get("W2_WMS_APP_KEY", ""),
+            "WAREHOUSE_CODE": get("W2_WMS_CODE", "NJW"),
+            "CONCURRENCY": max(1, int(get("W2_WMS_CONCURRENCY", "4") or 4)),
+        },
+    }
+
+    # WMS 連線池 / 逾時 / 重試：連線池至少容納各倉批次推送的同時在途數總和
+    # （各倉可能共用同一個 host，池太小時多出的連線用完即丟，下一筆又要重新連線）
+    set_soap_client_options(
+        pool_maxsize=max(int(get("WMS_POOL_MAXSIZE", "10") or 10), sum(c["CONCURRENCY"] for c in WMS_CONFIGS.values())),
+        timeout=float(get("WMS_TIMEOUT", "30") or 30),
+        retry_total=max(0, int(get("WMS_RETRY_TOTAL", "3") or 0)),
+        backoff_factor=float(get("WMS_RETRY_BACKOFF", "0.5") or 0.5),
+    )
+
+load_dotenv(override=False)
+load_config()
+
+# ---------- 計時 ----------
+metrics.REGISTRY.describe("teapplix_page_seconds", "Teapplix OrderNotification 單頁請求延遲")
+metrics.REGISTRY.describe("teapplix_po_query_seconds", "Teapplix 單一 PO 查詢延遲")
+metrics.REGISTRY.describe("teapplix_retries_total", "Teapplix 請求重試次數（依原因：HTTP 狀態碼 / error）")
+metrics.REGISTRY.describe("fetch_orders_seconds", "一般抓單（含同步與讀回）總時間")
+metrics.REGISTRY.describe("fetch_orders_by_pos_seconds", "PO 搜尋總時間")
+metrics.REGISTRY.describe("fill_pdf_seconds", "單份 BOL 填寫（render_bol / 合併模式的填寫 + 附加）")
+metrics.REGISTRY.describe("bol_job_seconds", "一批 BOL（ZIP / 合併）總時間")
+metrics.REGISTRY.describe("wms_request_seconds", "WMS callService 請求延遲（依端點）")
+metrics.REGISTRY.describe("soap_parse_seconds", "SOAP 回應解析")
+
+def _timed_iter(name: str, it, **labels):
+    """包住產生器：從開始到耗盡（或被放棄）的總時間記成一筆，並累計產出的訂單數。"""
+    t = time.perf_counter()
+    n = 0
+    try:
+        for x in it:
+            n += 1
+            yield x
+    finally:
+        metrics.observe(name, time.perf_counter() - t, **labels)
+        metrics.inc("orders_fetched_total", n, **labels)
+
+def flush_metrics(force: bool = False):
+    """有新資料時把計時寫到 METRICS_PATH；寫檔失敗只記 log，不影響主流程。"""
+    if not METRICS_PATH or not (force or metrics.REGISTRY.dirty):
+        return
+    try:
+        metrics.REGISTRY.write(METRICS_PATH)
+    except OSError as e:
+        log.warning("寫入 metrics 失敗：%s", e)
+
+# ---------- 訊息回報 ----------
+_notifier = None
+
+def set_notifier(fn):
+    """
+    設定訊息回報函式 fn(level, msg)，level 為 "error" / "warning" / "info"。
+    app.py 轉成 st.error / st.warning / st.info；未設定時寫進 logging（CLI / 排程）。
+    """
+    global _notifier
+    _notifier = fn
+
+def notify(level: str, msg: str):
+    if _notifier is not None:
+        _notifier(level, msg)
+    else:
+        getattr(log, level, log.info)(msg)
+
+# ---------- 常用工具 ----------
+def phoenix_range_days(days=3):
+    now = datetime.now(TZ_PHX)
+    end   = now.replace(hour=23, minute=59, second=59, microsecond=0)
+    start = (end - timedelta(days=days-1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    fmt = "%Y-%m-%dT%H:%M:%S"
+    return start.strftime(fmt), end.strftime(fmt)
+
+def default_pickup_date_str():
+    return (datetime.now(TZ_PHX) + timedelta(days=2)).date().isoformat()
+
+def get_headers():
+    hdr = {
+        "APIToken": TEAPPLIX_TOKEN,
+        "Content-Type": "application/json;charset=UTF-8",
+        "Accept": "application/json",
+    }
+    if AUTH_BEARER:
+        hdr["Authorization"] = f"Bearer {AUTH_BEARER}"
+    if X_API_KEY:
+        hdr["x-api-key"] = X_API_KEY  # 依你可用檔案的小寫 key
+    return hdr
+
+def orders_fingerprint(grouped) -> str:
+    """
+    分組結果的指紋：PO 與其各筆訂單的內容（OrderRecord 的 repr，不含 raw）組成。
+    重新抓單時 txn_key 相同但內容變了（改地址、補 SKU、ShipClass 變更…）指紋也會變。
+    """
+    h = hashlib.sha1()
+    for oid in sorted(grouped):
+        h.update(oid.encode("utf-8"))
+        for od in grouped[oid]:
+            h.update(b"\x1f" + repr(od).encode("utf-8"))
+        h.update(b"\x1e")
+    return h.hexdigest()
+
+def group_by_original_txn(orders):
+    """OriginalTxnId → [OrderRecord, ...]；可直接吃 iter_orders() 的原始 dict（在此投影）。"""
+    grouped = {}
+    for order in orders:
+        if not isinstance(order, OrderRecord):
+            order = OrderRecord.from_teapplix(order)
+        oid = order.original_txn_id
+        if not oid:
+            continue
+        grouped.setdefault(oid, []).append(order)
+    return grouped
+
+def _desc_value_from_order(order):
+    sku = order.first_sku if order.items else None
+    return f"{sku}  (Electric Fireplace)".strip()
+
+def _sku8_from_order(order):
+    return order.first_sku[:8]
+
+def _qty_from_order(order):
+    return order.first_qty
+
+def _sum_group_totals(group):
+    total_pkgs = 0
+    total_lb = 0
+    for od in group:
+        total_pkgs += od.total_pkgs
+        total_lb   += od.total_lb
+    return total_pkgs, total_lb
+
+def _parse_order_date_str(first_order: OrderRecord):
+    return first_order.order_date
+
+def luhn_check_digit(number_without_check: str) -> str:
+    """
+    回傳 Luhn 校驗碼（單一數字字元）。
+    number_without_check 須為數字字串（長度任意）；此函式不做長度檢查。
+    """
+    s = number_without_check[::-1]
+    total = 0
+    for i, ch in enumerate(s, start=1):
+        d = ord(ch) - 48  # '0' -> 48
+        if (i % 2) == 1:
+            # 反向序列中奇數位（原字串從右數的偶數位）→ 加倍
+            d *= 2
+            if d > 9:
+                d -= 9
+        total += d
+    check = (10 - (total % 10)) % 10
+    return str(check)
+
+def build_bol_number(oid: str) -> str:
+    """
+    規則：
+      1) 固定前 9 碼：081003089
+      2) 接上 oid 的數字（去除非數字）
+      3) 右側補 0，直到長度達 19
+      4) 第 20 碼為 Luhn 校驗碼
+    """
+    prefix = "081003089"
+    oid_digits = re.sub(r"\D", "", f"{oid or ''}")
+    base = (prefix + oid_digits)[:19]      # 超過則截斷到 19
+    base = base.ljust(19, "0")             # 不足則補 0 到 19
+    check = luhn_check_digit(base)
+    return base + check                    # 共 20 碼
+
+# ---------- API：Teapplix 分頁抓取引擎 ----------
+_http_session = None
+_teapplix_client = None
+_order_store = None
+_push_ledger = None
+_singletons_lock = threading.Lock()
+
+def get_http_session() -> requests.Session:
+    """行程共用的 keep-alive Session（跨 rerun / session / 批次），連線池大小 = FETCH_WORKERS。"""
+    global _http_session
+    if _http_session is None:
+        with _singletons_lock:
+            if _http_session is None:
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=FETCH_WORKERS)
+                s = requests.Session()
+                s.mount("http://", adapter)
+                s.mount("https://", adapter)
+                _http_session = s
+    return _http_session
+
+def get_teapplix_client() -> TeapplixClient:
+    """行程共用的 Teapplix 用戶端：所有抓單（分頁平行 / 單一 PO）共用同一個限速與並行上限。"""
+    global _teapplix_client
+    if _teapplix_client is None:
+        session = get_http_session()
+        with _singletons_lock:
+            if _teapplix_client is None:
+                _teapplix_client = TeapplixClient(
+                    session, rate=TEAPPLIX_RATE, burst=TEAPPLIX_BURST, concurrency=FETCH_WORKERS,
+                    retries=TEAPPLIX_RETRIES, backoff=TEAPPLIX_BACKOFF, max_backoff=TEAPPLIX_MAX_BACKOFF,
+                )
+    return _teapplix_client
+
+def _is_kept_order(order) -> bool:
+    """排除 ShipClass = UNSP_CG 的訂單。"""
+    od = order.get("OrderDetails") or {}
+    return (od.get("ShipClass") or "").strip().upper() != "UNSP_CG"
+
+def _get_orders_page(client: TeapplixClient, params: dict, page: int):
+    """抓單一頁（429 / 5xx 由 client 重試），回傳 (orders, error)；在 worker thread 執行，故不直接 notify。"""
+    q = dict(params, PageSize=str(PAGE_SIZE), PageNumber=str(page))
+    try:
+        r = client.get(BASE_URL, params=q, headers=get_headers(), metric="teapplix_page_seconds")
+    except Exception as e:
+        return None, f"連線錯誤（第 {page} 頁）：{e}"
+    if r.status_code != 200:
+        return None, f"API 錯誤: {r.status_code}\n{r.text}"
+    try:
+        data = r.json()
+    except Exception:
+        return None, f"JSON 解析錯誤：{r.text[:1000]}"
+    return (data.get("orders") or data.get("Orders") or []), None
+
+def _fetch_failed(status: dict | None, msg: str):
+    """抓單失敗：通知畫面 / log，並記進 status（complete=False、error=第一個錯誤）。"""
+    notify("error", msg)
+    if status is not None:
+        status["complete"] = False
+        status.setdefault("error", msg)
+
+def iter_order_pages(params: dict, workers: int = None, status: dict | None = None):
+    """
+    逐頁產出原始訂單 list（generator），頁碼順序不變。
+    先抓第 1 頁；若為滿頁，其餘頁以最多 workers（預設 FETCH_WORKERS）個請求同時在途的方式平行抓取，
+    因此同一時間在記憶體中的頁數 ≤ workers + 1。
+    遇到錯誤（client 重試用完仍失敗）/ 空頁 / 不滿頁即停止；若傳入 status，
+    結束時寫入 status["complete"]，出錯時另寫 status["error"]。
+    """
+    workers = FETCH_WORKERS if workers is None else workers
+    status = {} if status is None else status
+    status["complete"] = False
+    client = get_teapplix_client()
+    orders, err = _get_orders_page(client, params, 1)
+    if err:
+        _fetch_failed(status, err); return
+    yield orders
+    if len(orders) < PAGE_SIZE:
+        status["complete"] = True
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = {}
+        next_submit = 2
+        page = 2
+        try:
+            while True:
+                while len(pending) < workers:
+                    pending[next_submit] = pool.submit(_get_orders_page, client, params, next_submit)
+                    next_submit += 1
+                orders, err = pending.pop(page).result()
+                if err:
+                    _fetch_failed(status, err); break
+                if not orders:
+                    status["complete"] = True; break
+                yield orders
+                if len(orders) < PAGE_SIZE:
+                    status["complete"] = True; break
+                page += 1
+        finally:
+            for fut in pending.values():
+                fut.cancel()
+
+# ---------- 本地訂單快取：增量同步 ----------
+def get_order_store():
+    """行程共用的本地訂單快取；ORDER_STORE_PATH 為空字串時回傳 None（停用）。"""
+    global _order_store
+    if not ORDER_STORE_PATH:
+        return None
+    if _order_store is None:
+        with _singletons_lock:
+            if _order_store is None:
+                _order_store = OrderStore(ORDER_STORE_PATH, STORE_OVERLAP_MINUTES, STORE_FULL_RESYNC_HOURS)
+    return _order_store
+
+def _window_params(ps: str, pe: str, shipped: str) -> dict:
+    params = {
+        "PaymentDateStart": ps,
+        "PaymentDateEnd": pe,
+        "StoreKey": STORE_KEY,
+        "Combine": "combine",
+        "DetailLevel": "shipping|inventory|marketplace",
+    }
+    if shipped in ("0", "1"):
+        params["Shipped"] = shipped
+    return params
+
+def sync_window(ps: str, pe: str, shipped: str, force_full: bool = False, status: dict | None = None) -> set:
+    """
+    把 PaymentDate 區間 [ps, pe] 同步進本地快取（逐頁寫入，不保留整窗資料）。
+    已有有效高水位時只抓 [high_water - overlap, pe] 的 delta；
+    抓取中途出錯則不推進高水位（下次重抓同一段）。是否完整同步成功記在 status（同 iter_order_pages）。
+    回傳這次抓到、但付款日無法解析的 txn_key：快取的區間查詢撈不到它們，讀回時以 extra_keys 補上。
+    """
+    store = get_order_store()
+    scope = scope_of(STORE_KEY, shipped)
+    start, full = store.plan_sync(scope, ps, pe, force_full=force_full)
+    status = {} if status is None else status
+    seen_keys = set()
+    undated = set()
+    high_water = ""
+    for page in iter_order_pages(_window_params(start, pe, shipped), status=status):
+        keys, page_high, page_undated = store.upsert(page, STORE_KEY, shipped_hint=shipped)
+        seen_keys.update(keys)
+        undated.update(page_undated)
+        high_water = max(high_water, page_high)
+    if status["complete"]:
+        if full:
+            store.prune_missing(seen_keys, STORE_KEY, start, pe, shipped)
+        store.mark_synced(scope, start, high_water, full)
+    return undated
+
+# ---------- API：抓取一般訂單（GET） ----------
+def iter_orders(days: int, force_full: bool = False, status: dict | None = None):
+    """
+    一般抓單的串流版本：逐筆產出已排除 UNSP_CG 的原始訂單。
+    有本地快取時先做增量同步，再以游標逐列讀回；否則直接邊抓頁邊過濾。
+    傳入 status 時，耗盡後 status["complete"] 表示 Teapplix 是否完整抓到（False 時結果可能缺頁，
+    或是有快取時讀回的是上次同步的舊資料），status["error"] 為第一個錯誤訊息。
+    """
+    return _timed_iter("fetch_orders_seconds", _iter_orders(days, force_full, status), source="days")
+
+def _iter_orders(days: int, force_full: bool, status: dict | None):
+    ps, pe = phoenix_range_days(days)
+    store = get_order_store()
+    if store is not None:
+        undated = sync_window(ps, pe, SHIPPED_DEFAULT, force_full=force_full, status=status)
+        pages = [store.iter_query(STORE_KEY, ps, pe, SHIPPED_DEFAULT, extra_keys=undated)]
+    else:
+        pages = iter_order_pages(_window_params(ps, pe, SHIPPED_DEFAULT), status=status)
+    for page in pages:
+        for o in page:
+            if _is_kept_order(o):
+                yield o
+
+def fetch_orders(days: int, force_full: bool = False, status: dict | None = None):
+    return list(iter_orders(days, force_full=force_full, status=status))
+
+# ---------- API：以 PO(OriginalTxnId) 查詢（固定最近 14 天 + 嚴格等於過濾） ----------
+def _index_by_original_txn(orders, wanted=None):
+    """OriginalTxnId → [order, ...] 的雜湊索引（未過濾 ShipClass）；給 wanted 時只收錄其中的 PO。"""
+    index = {}
+    for o in orders:
+        oid = str(o.get("OriginalTxnId") or "").strip()
+        if oid and (wanted is None or oid in wanted):
+            index.setdefault(oid, []).append(o)
+    return index
+
+def _fetch_single_po(oid: str, ps: str, pe: str, shipped: str, status: dict | None = None):
+    """單一 PO 查詢（逐筆模式 / 批次模式未命中時的回退）；失敗時記進 status 並回傳空列表。"""
+    params = {
+        "StoreKey": STORE_KEY,
+        "DetailLevel": "shipping|inventory|marketplace",
+        "Combine": "combine",
+        "PageSize": str(PAGE_SIZE),
+        "PageNumber": "1",
+        "OriginalTxnId": oid,
+        "PaymentDateStart": ps,
+        "PaymentDateEnd": pe,
+    }
+    if shipped in ("0", "1"):
+        params["Shipped"] = shipped
+    try:
+        r = get_teapplix_client().get(BASE_URL, params=params, headers=get_headers(), metric="teapplix_po_query_seconds")
+    except Exception as e:
+        _fetch_failed(status, f"PO {oid} 連線錯誤：{e}"); return []
+    if r.status_code != 200:
+        _fetch_failed(status, f"PO {oid} API 錯誤: {r.status_code}\n{r.text[:400]}"); return []
+    try:
+        data = r.json()
+    except Exception:
+        _fetch_failed(status, f"PO {oid} 回傳非 JSON：{r.text[:400]}"); return []
+
+    raw_orders = data.get("orders") or data.get("Orders") or []
+
+    # 嚴格等於過濾 + 排除 UNSP_CG
+    matched = _index_by_original_txn(raw_orders).get(oid, [])
+    if raw_orders and not matched:
+        notify("info", f"提示：API 在最近 14 天回 {len(raw_orders)} 筆，但無『OriginalTxnId 等於 {oid}』資料。")
+    return [o for o in matched if _is_kept_order(o)]
+
+def iter_orders_by_pos(pos_list, shipped: str, force_full: bool = False, status: dict | None = None):
+    """
+    PO 搜尋的串流版本，依輸入 PO 順序逐筆產出原始訂單。
+    有本地快取時：14 天窗先做增量同步，再以 OriginalTxnId 索引（SQLite）回答。
+    無快取且 PO 數 >= PO_BATCH_MIN：邊抓整個 14 天窗邊建索引（只收錄要找的 PO）。
+    其餘情況逐筆查詢；索引中找不到的 PO 也回退逐筆查詢。
+    status 同 iter_orders：整窗同步 / 批次抓取或任一 PO 查詢失敗時 complete=False。
+    """
+    return _timed_iter("fetch_orders_by_pos_seconds", _iter_orders_by_pos(pos_list, shipped, force_full, status), source="po")
+
+def _iter_orders_by_pos(pos_list, shipped: str, force_full: bool, status: dict | None):
+    ps, pe = phoenix_range_days(14)  # ★ 固定 14 天
+    pos_list = [(oid or "").strip() for oid in pos_list]
+    pos_list = [oid for oid in pos_list if oid]
+    status = {} if status is None else status
+    status["complete"] = True
+
+    index = {}
+    window = {}
+    store = get_order_store()
+    if store is not None:
+        undated = sync_window(ps, pe, shipped, force_full=force_full, status=window)
+        index = store.find_by_original(pos_list, STORE_KEY, ps, pe, extra_keys=undated)
+    elif len(pos_list) >= PO_BATCH_MIN:
+        pages = iter_order_pages(_window_params(ps, pe, shipped), status=window)
+        index = _index_by_original_txn((o for page in pages for o in page), wanted=set(pos_list))
+    if window and not window["complete"]:
+        status["complete"] = False
+        status.setdefault("error", window.get("error", ""))
+
+    for oid in pos_list:
+        if oid in index:
+            found = [o for o in index[oid] if _is_kept_order(o)]
+        else:
+            found = _fetch_single_po(oid, ps, pe, shipped, status)
+            if store is not None:
+                store.upsert(found, STORE_KEY, shipped_hint=shipped)
+        for o in found:
+            if shipped not in ("0", "1") or str(o.get("Shipped") or o.get("shipped") or "").strip() == shipped:
+                yield o
+
+def fetch_orders_by_pos(pos_list, shipped: str, force_full: bool = False, status: dict | None = None):
+    return list(iter_orders_by_pos(pos_list, shipped, force_full=force_full, status=status))
+
+# ---------- PDF 填寫 ----------
+def build_row_from_group(oid, group, wh_key: str):
+    first = group[0]
+
+    scac_from_shipclass = first.ship_class.strip()
+    carrier_name_final = first.carrier_final
+
+    street  = first.to_street
+    street2 = first.to_street2
+    to_address = (street + (" " + street2 if street2 else "")).strip()
+    custom_code = first.custom.strip()
+
+    total_pkgs, total_lb = _sum_group_totals(group)
+
+    # ★ 依規則生成 20 碼 BOL
+    bol_num = build_bol_number(oid)
+
+    WH = WAREHOUSES.get(wh_key, list(WAREHOUSES.values())[0])
+
+    row = {
+        "BillName": BILL_NAME,
+        "BillAddress": BILL_ADDRESS,
+        "BillCityStateZip": BILL_CITYSTATEZIP,
+        "ToName": first.to_name,
+        "ToAddress": to_address,
+        "ToCityStateZip": f"{first.to_city}, {first.to_state} {first.to_zip}".strip().strip(", "),
+        "ToCID": first.to_phone,
+        "FromName": WH["name"],
+        "FromAddr": WH["addr"],
+        "FromCityStateZip": WH["citystatezip"],
+        "FromSIDNum": WH["sid"],
+        "3rdParty": "X", "PrePaid": "", "Collect": "",
+        # 原本空字串 → 改成 20 碼 BOL 號
+        "BOLnum": bol_num,
+        "CarrierName": carrier_name_final,
+        "SCAC": scac_from_shipclass,
+        "PRO": first.tracking_number,
+        "CustomerOrderNumber": custom_code,
+        "BillInstructions": f"PO#{oid or bol_num}",
+        "OrderNum1": custom_code,
+        "SpecialInstructions": "",
+        "TotalPkgs": str(total_pkgs) if total_pkgs else "",
+        "Total_Weight": str(total_lb) if total_lb else "",
+        "Date": datetime.now().strftime("%Y/%m/%d"),
+        "Page_ttl": "1",
+        "NMFC1": "69420",
+        "Class1": "125",
+    }
+
+    total_qty_sum = 0
+    for idx, od_item in enumerate(group, start=1):
+        desc_val = _desc_value_from_order(od_item)
+        qty = _qty_from_order(od_item)
+        if desc_val:
+            row[f"Desc_{idx}"] = desc_val
+            row[f"HU_Type_{idx}"]  = "piece"
+            row[f"Pkg_Type_{idx}"] = "piece"
+            row[f"HU_QTY_{idx}"]   = str(qty) if qty else ""
+            row[f"Pkg_QTY_{idx}"]  = str(qty) if qty else ""
+            total_qty_sum += qty
+            row[f"NMFC{idx}"] = "69420"
+            row[f"Class{idx}"] = "125"
+
+    row["NumPkgs1"] = str(total_qty_sum)
+    row["Weight1"] = "130 lbs" if total_qty_sum <= 1 else f"{130 + (total_qty_sum - 1) * 30} lbs"
+    return row, WH
+
+def observe_fill(seconds, failure=None):
+    """記錄 generate_bols / build_merged_bol 回傳的單份填寫秒數（行程池異常終止時為 None，不記）。"""
+    if seconds is not None:
+        metrics.observe("fill_pdf_seconds", seconds, outcome="error" if failure else "ok")
+
+def fill_pdf(row: dict, out_path: str, flatten: bool = False, template_path: str = None):
+    """填一份 BOL 並寫檔（render_bol 的薄包裝）；填寫警告逐筆 notify，並回傳警告列表。"""
+    # 模板 bytes 與欄位索引由 bol_pdf 依 mtime 快取，這裡只填 row 有的欄位
+    data, errors = render_bol(row, template_path or TEMPLATE_PDF, flatten=flatten)
+    os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+    with open(out_path, "wb") as f:
+        f.write(data)
+    for msg in errors:
+        notify("warning", msg)
+    return errors
+
+# ---------- WMS 參數組裝 ----------
+def _aggregate_items_by_sku(group):
+    sku_qty = {}
+    for od in group:
+        for it in od.items:
+            sku = it.sku.strip()
+            if not sku:
+                continue
+            q = it.quantity
+            if q <= 0:
+                continue
+            sku_qty[sku] = sku_qty.get(sku, 0) + q
+    items_arr = [{"product_sku": sku, "quantity": qty} for sku, qty in sku_qty.items()]
+    return items_arr
+
+def decide_shipping_method(wh_key: str, items: list[dict]) -> str:
+    """
+    根據倉庫與 SKU/數量規則決定 shipping_method。
+
+    規則：
+      - 如果為 NJ 08816 → "CUSTOMER_SHIP"
+      - 如果為 CA 91789：
+          - 僅 1 個 SKU 且其 quantity == 1 → "SELF_LTL-SINGLE"
+          - 其他情況 → "ALL_SELF_LTL"
+      - 其他倉（若未定義）預設回傳 "CUSTOMER_SHIP"
+    """
+    wh_key = (wh_key or "").strip()
+    if wh_key == "NJ 08816":
+        return "CUSTOMER-LTL"
+
+    if wh_key == "CA 91789":
+        # items 結構來自 _aggregate_items_by_sku：
+        # [{"product_sku": "<SKU>", "quantity": <int>}, ...]
+        if len(items) == 1:
+            only_item_qty = int(items[0].get("quantity") or 0)
+            if only_item_qty == 1:
+                return "SELF_LTL-SINGLE"
+        return "ALL_SELF_LTL"
+
+    # 預設：未指定規則的倉別
+    return "CUSTOMER-LTL"
+
+
+def build_wms_params_from_group(oid: str, group: list, wh_key: str, pickup_date_str: str) -> dict:
+    first = group[0]
+
+    province = first.to_state.strip()
+    city = first.to_city.strip()
+    street = first.to_street.strip()
+    street2 = first.to_street2.strip()
+    zipcode = first.to_zip.strip()
+    company = first.to_company.strip()
+    name = first.to_name.strip()
+    phone = first.to_phone.strip()
+    shipclass = first.ship_class.strip()
+
+    # ★★★ 取得 carrier_name_final（投影時已依 SCAC 覆寫），供 platform_shop 回退用
+    carrier_name_final = first.carrier_final
+
+    # 聚合 SKU 數量
+    items = _aggregate_items_by_sku(group)
+
+    # 依倉庫 + items 規則決定 shipping_method
+    shipping_method = decide_shipping_method(wh_key, items)
+
+    test_oid = f"{oid}".strip()
+
+    params = {
+        "platform": "OTHER",
+        "allocated_auto": "0",
+        "warehouse_code": WMS_CONFIGS.get(wh_key, {}).get("WAREHOUSE_CODE", ""),
+        "shipping_method": shipping_method,           # ← 這裡改成動態
+        "reference_no": test_oid,                     # 測試：test- + PO
+        "order_desc": f"pick up: {pickup_date_str}" if pickup_date_str else "",
+        "remark": "",
+        "country_code": "US",
+        "province": province,
+        "city": city,
+        "district": city,
+        "address1": street,
+        "address2": street2,
+        "address3": "",
+        "zipcode": zipcode,
+        "company": company,
+        "name": name,
+        "phone": phone,
+        "cell_phone": "",
+        "phone_extension": "",
+        "email": "",
+        # ★★★ 先用 carrier_name_final，找不到再用 shipclass
+        "platform_shop": carrier_name_final or shipclass,
+        "items": items,                               # ← 使用聚合後的 SKU/數量
+        "tracking_no": "",                            # 測試：test- + PO
+    }
+    return params
+
+
+# ---------- WMS 送單 ----------
+def resolve_wms_target(params: dict, fallback_wh: str):
+    """由 warehouse_code 反查倉別鍵（或保留原來選的倉），回傳 (wh_key, endpoint, app_token, app_key)。"""
+    target_wh_key = None
+    for k, cfg in WMS_CONFIGS.items():
+        if cfg.get("WAREHOUSE_CODE") == params.get("warehouse_code"):
+            target_wh_key = k
+            break
+    if not target_wh_key:
+        target_wh_key = fallback_wh or "NJ 08816"
+    cfg = WMS_CONFIGS.get(target_wh_key, {})
+    return (
+        target_wh_key,
+        cfg.get("ENDPOINT_URL", "").strip(),
+        cfg.get("APP_TOKEN", "").strip(),
+        cfg.get("APP_KEY", "").strip(),
+    )
+
+def wms_status(result) -> str:
+    """SoapResult.ok（True / False / None）→ 摘要狀態文字。"""
+    return "成功" if result.ok else ("失敗" if result.ok is False else "未知")
+
+def wms_message(result, text: str) -> str:
+    """摘要訊息：JSON message → SOAP Fault → 回應前 200 字。"""
+    if result.payload:
+        return result.message
+    if result.fault:
+        return f"SOAP Fault {result.fault['faultcode']}: {result.fault['faultstring']}"
+    return text[:200]
+
+def get_push_ledger() -> PushLedger:
+    global _push_ledger
+    if _push_ledger is None:
+        with _singletons_lock:
+            if _push_ledger is None:
+                _push_ledger = PushLedger(PUSH_LEDGER_PATH)
+    return _push_ledger
+
+def push_wms_order(oid: str, params: dict, fallback_wh: str, ledger: PushLedger = None, force: bool = False) -> dict:
+    """
+    送出單筆並整理成摘要列（不呼叫 st.*，可在 worker thread 執行）。
+    有 ledger 時：送出前先佔位，已成功建單者（force=True 才重送）或其他程序送出中者直接略過，送出後寫回結果。
+    """
+    result = _push_wms_order(oid, params, fallback_wh, ledger, force)
+    metrics.inc("wms_push_total", warehouse=result["倉別"], status=result["狀態"])
+    return result
+
+def _push_wms_order(oid: str, params: dict, fallback_wh: str, ledger: PushLedger, force: bool) -> dict:
+    wh_key, endpoint, app_token, app_key = resolve_wms_target(params, fallback_wh)
+    result = {"PO": oid, "倉別": wh_key, "reference_no": params.get("reference_no", ""),
+              "HTTP": None, "狀態": "", "ask": "", "error_code": "", "order_code": "", "message": ""}
+    wh_code = params.get("warehouse_code", "")
+    ref = result["reference_no"]
+    if not (endpoint and app_token and app_key):
+        result.update({"狀態": "設定不完整", "message": f"{wh_key} WMS 設定不完整（endpoint/app_token/app_key）。"})
+        return result
+    # 先在推送紀錄佔位（跨行程原子），同一鍵不會被兩個送出者同時建單
+    if ledger is not None and not ledger.reserve(wh_code, ref, force=force):
+        prev = ledger.get(wh_code, ref)
+        if prev and prev["ok"]:
+            result.update({"狀態": "已推送（略過）", "message": f"已於 {prev['pushed_at']} 建單成功"})
+        else:
+            result.update({"狀態": "送出中（略過）", "message": "其他程序正在送出此筆，未重複送出"})
+        return result
+    try:
+        resp = send_create_order(endpoint, app_token, app_key, params, service=WMS_SERVICE)
+    except Exception as e:
+        result.update({"狀態": "失敗", "message": f"上傳失敗：{e}"})
+        if ledger is not None:
+            ledger.record(wh_code, ref, False, result["狀態"], None, result["message"])
+        return result
+    parsed = parse_soap_response(resp.content)
+    result.update({
+        "HTTP": resp.status_code,
+        "狀態": wms_status(parsed),
+        "ask": parsed.ask,
+        "error_code": parsed.error_code,
+        "order_code": parsed.order_code,
+        "message": wms_message(parsed, resp.text),
+    })
+    if ledger is not None:
+        ledger.record(wh_code, ref, bool(parsed.ok), result["狀態"], resp.status_code, result["message"])
+    return result
+
+def push_wms_orders_bulk(entries, ledger: PushLedger = None, force: bool = False) -> list:
+    """
+    entries: [(oid, params, fallback_wh), ...]。
+    依目標倉別分組，每倉一個執行緒池（大小 = 該倉 CONCURRENCY），各倉的同時在途數分開限制。
+    回傳依輸入順序排列的摘要列。
+    """
+    by_wh = {}
+    for i, (oid, params, fallback_wh) in enumerate(entries):
+        wh_key = resolve_wms_target(params, fallback_wh)[0]
+        by_wh.setdefault(wh_key, []).append((i, oid, params, fallback_wh))
+
+    results = [None] * len(entries)
+    pools = []
+    futures = []
+    try:
+        for wh_key, items in by_wh.items():
+            workers = WMS_CONFIGS.get(wh_key, {}).get("CONCURRENCY", 1)
+            pool = ThreadPoolExecutor(max_workers=min(workers, len(items)))
+            pools.append(pool)
+            for i, oid, params, fallback_wh in items:
+                futures.append((i, pool.submit(push_wms_order, oid, params, fallback_wh, ledger, force)))
+        for i, fut in futures:
+            results[i] = fut.result()
+    finally:
+        for pool in pools:
+            pool.shutdown(wait=True)
+    return results
+
+# ---------- BOL 背景產生 ----------
+class BolJob:
+    """
+    在背景執行緒產生一批 BOL（ZIP 或合併 PDF），進度寫在物件屬性上供畫面輪詢；
+    執行緒內不呼叫 notify / st.*，警告與失敗累積在 warnings / failed，結束後由畫面一次顯示。
+
+        job = BolJob(jobs, merged=False, flatten=False).start()
+        job.done / job.total / job.state  # "running" → "done" / "cancelled" / "error"
+        with job.open_output() as f: ...   # 完成後的下載內容（has_output 為 True 時），另有 file_name / mime
+
+    ZIP 寫在磁碟暫存檔（zip_path），session 只保留路徑；換下一批或不再需要時呼叫 discard() 刪檔。
+    合併 PDF 由 build_merged_bol 一次產生，仍以 bytes 保留在 data。
+    """
+
+    def __init__(self, jobs, merged: bool = False, flatten: bool = False, save_dir: str = None,
+                 template_path: str = None, workers: int = None, parallel_min: int = None, profile: bool = False):
+        self.jobs = list(jobs)          # [(OriginalTxnId, row_dict), ...]，由 build_row_from_group 產生
+        self.merged = merged
+        self.flatten = flatten
+        self.save_dir = save_dir        # 非空時每份（或合併檔）另存一份到此目錄
+        self.template_path = template_path or TEMPLATE_PDF
+        self.workers = BOL_WORKERS if workers is None else workers
+        self.parallel_min = BOL_PARALLEL_MIN if parallel_min is None else parallel_min
+        self.profile = profile          # True 時在背景執行緒內剖析整批（ZIP 的子行程不在內）
+        self.profile_path = ""
+
+        self.total = len(self.jobs)
+        self.done = 0
+        self.current = ""
+        self.state = "pending"
+        self.error = ""
+        self.warnings = []              # [(檔名或 PO, 訊息), ...]
+        self.failed = []                # ["檔名（原因）", ...]
+        self.produced = 0
+        self.data = None                # 合併 PDF 的 bytes
+        self.zip_path = None            # ZIP 暫存檔路徑
+        self.job_id = uuid.uuid4().hex   # 畫面判斷「是否已為這個工作 rerun 過」用（id() 會被重複使用）
+        self.stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        self.file_name = f"BOL_{self.stamp}.pdf" if merged else f"BOL_{self.stamp}.zip"
+        self.mime = "application/pdf" if merged else "application/zip"
+        self.started_at = None
+        self.finished_at = None
+        self._cancel = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self) -> bool:
+        return self.state in ("pending", "running")
+
+    @property
+    def has_output(self) -> bool:
+        return bool(self.data or self.zip_path)
+
+    def open_output(self):
+        """可讀的檔案物件（ZIP 為磁碟上的暫存檔），交給 download_button 後由呼叫端關閉。"""
+        return open(self.zip_path, "rb") if self.zip_path else io.BytesIO(self.data or b"")
+
+    def discard(self):
+        """刪掉 ZIP 暫存檔（工作仍在執行時不動）。"""
+        if self.running or not self.zip_path:
+            return
+        try:
+            os.remove(self.zip_path)
+        except OSError:
+            pass
+        self.zip_path = None
+
+    @property
+    def fraction(self) -> float:
+        return (self.done / self.total) if self.total else 1.0
+
+    def elapsed(self) -> float:
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    def start(self) -> "BolJob":
+        self.state = "running"
+        self.started_at = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name="bol-job", daemon=True)
+        self._thread.start()
+        return self
+
+    def cancel(self):
+        """要求停止；ZIP 模式下只等行程池中正在算的小批次，其餘直接取消。"""
+        self._cancel.set()
+
+    def _save(self, name: str, data: bytes):
+        if self.save_dir:
+            with open(os.path.join(self.save_dir, name), "wb") as f:
+                f.write(data)
+
+    def _run(self):
+        try:
+            if self.save_dir:
+                os.makedirs(self.save_dir, exist_ok=True)
+            action = "bol_merged" if self.merged else "bol_zip"
+            with profiled(action, self.profile, PROFILE_DIR) as prof:
+                if self.merged:
+                    self._run_merged()
+                else:
+                    self._run_zip()
+            self.profile_path = prof.path
+            self.state = "cancelled" if self._cancel.is_set() else "done"
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+            self.state = "error"
+        finally:
+            self.finished_at = time.monotonic()
+            mode = "merged" if self.merged else "zip"
+            metrics.observe("bol_job_seconds", self.finished_at - self.started_at, mode=mode, outcome=self.state)
+            metrics.inc("bols_generated_total", self.produced, mode=mode)
+            metrics.inc("bols_failed_total", len(self.failed), mode=mode)
+
+    def _on_merged_progress(self, oid):
+        self.done += 1
+        self.current = oid
+
+    def _run_merged(self):
+        data, results = build_merged_bol(
+            self.jobs, self.template_path, flatten=self.flatten,
+            progress=self._on_merged_progress, cancelled=self._cancel.is_set,
+        )
+        for oid, warnings, failure, seconds in results:
+            observe_fill(seconds, failure)
+            self.warnings.extend((oid, msg) for msg in warnings)
+            if failure:
+                self.failed.append(f"{oid}（{failure}）")
+        self.produced = len(results) - len(self.failed)
+        if data and not self._cancel.is_set():
+            self._save(self.file_name, data)
+            self.data = data
+
+    def _run_zip(self):
+        # 直接寫到磁碟上的暫存檔：記憶體只有正在寫的那一份 PDF，下載時由 Streamlit 讀檔
+        zip_file = tempfile.NamedTemporaryFile(prefix=f"BOL_{self.stamp}_", suffix=".zip", delete=False)
+        zip_writer = BolZipWriter(zip_file)
+        finished = False
+        try:
+            results = generate_bols(self.jobs, self.template_path, self.workers, self.parallel_min, flatten=self.flatten)
+            for oid, data, warnings, failure, seconds in results:
+                if self._cancel.is_set():
+                    results.close()   # 取消行程池中尚未開始的批次
+                    break
+                observe_fill(seconds, failure)
+                filename = f"{oid}.pdf".replace(" ", "")
+                self.current = oid
+                self.warnings.extend((filename, msg) for msg in warnings)
+                if failure:
+                    self.failed.append(f"{filename}（{failure}）")
+                else:
+                    zip_writer.add(filename, data)
+                    self._save(filename, data)
+                self.done += 1
+            zip_writer.close()
+            finished = True
+        finally:
+            zip_file.close()
+            if not (finished and zip_writer.count) or self._cancel.is_set():
+                os.remove(zip_file.name)   # 失敗 / 取消 / 沒有任何檔案：不留暫存檔
+            else:
+                self.zip_path = zip_file.name
+        self.produced = zip_writer.count
+
+# ---------- 倉別規則（批次用） ----------
+RULE_KEYS = ("states", "zip_prefix", "scac", "sku_prefix")
+
+def load_warehouse_rules(path: str) -> dict:
+    """
+    讀取 JSON 倉別規則檔：
+        {"default": "CA 91789",
+         "rules": [{"warehouse": "NJ 08816", "states": ["NJ", "NY"]},
+                   {"warehouse": "CA 91789", "scac": ["SAIA"], "sku_prefix": ["ABC"]}]}
+    每條規則內的條件皆須符合（AND），由上而下第一條符合者勝出；都不符合時用 default（可省略）。
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    rules = []
+    for i, rule in enumerate(data.get("rules") or [], start=1):
+        wh = (rule.get("warehouse") or "").strip()
+        if wh not in WAREHOUSES:
+            raise ValueError(f"規則 #{i} 的 warehouse 不存在：{wh!r}（可用：{', '.join(WAREHOUSES)}）")
+        conds = {}
+        for k in RULE_KEYS:
+            vals = rule.get(k)
+            if vals:
+                vals = [vals] if isinstance(vals, str) else vals
+                conds[k] = tuple(str(v).strip().upper() for v in vals)
+        rules.append((wh, conds))
+    default = (data.get("default") or "").strip()
+    if default and default not in WAREHOUSES:
+        raise ValueError(f"default 倉別不存在：{default!r}（可用：{', '.join(WAREHOUSES)}）")
+    return {"rules": rules, "default": default}
+
+def assign_warehouse(group: list, rules: dict) -> str:
+    """依規則替一個 PO（同 OriginalTxnId 的訂單群組）決定倉別鍵；無符合且無 default 時回傳空字串。"""
+    first = group[0]
+    state = first.to_state.strip().upper()
+    zipcode = first.to_zip.strip().upper()
+    scac = first.ship_class.strip().upper()
+    skus = [it.sku.strip().upper() for od in group for it in od.items if it.sku]
+    for wh, conds in rules["rules"]:
+        if "states" in conds and state not in conds["states"]:
+            continue
+        if "zip_prefix" in conds and not zipcode.startswith(conds["zip_prefix"]):
+            continue
+        if "scac" in conds and scac not in conds["scac"]:
+            continue
+        if "sku_prefix" in conds and not any(s.startswith(conds["sku_prefix"]) for s in skus):
+            continue
+        return wh
+    return rules["default"]
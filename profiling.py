@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+# profiling.py — 單次動作的 cProfile + tracemalloc 剖析，輸出排名報告（.txt）與原始 .prof
+import cProfile
+import io
+import os
+import pstats
+import re
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+_trace_lock = threading.Lock()
+_trace_users = 0   # 同時在剖析的動作數；tracemalloc 是整個行程共用，最後一個結束才 stop
+
+
+class ActionProfile:
+    """一次剖析的結果摘要；path 為報告檔（未啟用或失敗時為空字串）。"""
+
+    __slots__ = ("action", "path", "wall", "peak_bytes", "error")
+
+    def __init__(self, action: str):
+        self.action = action
+        self.path = ""
+        self.wall = 0.0
+        self.peak_bytes = 0
+        self.error = ""
+
+
+def _safe_name(action: str) -> str:
+    return re.sub(r"[^0-9A-Za-z_.-]+", "_", action).strip("_") or "action"
+
+
+def _trace_start():
+    global _trace_users
+    with _trace_lock:
+        if _trace_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        else:
+            tracemalloc.reset_peak()
+        _trace_users += 1
+
+
+def _trace_stop():
+    global _trace_users
+    with _trace_lock:
+        _trace_users -= 1
+        if _trace_users == 0 and tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+
+def _format_report(res: ActionProfile, prof: cProfile.Profile, snapshot, top: int) -> str:
+    out = io.StringIO()
+    out.write(f"action      : {res.action}\n")
+    out.write(f"finished    : {datetime.now().isoformat(timespec='seconds')}\n")
+    out.write(f"wall time   : {res.wall:.3f} s\n")
+    out.write(f"peak memory : {res.peak_bytes / 1024 / 1024:.1f} MiB（tracemalloc，整個行程）\n")
+    if res.error:
+        out.write(f"error       : {res.error}\n")
+    out.write("note        : cProfile 只涵蓋執行此動作的執行緒；子行程 / 其他 worker thread 的 CPU 不在內\n")
+
+    for key, title in (("cumulative", "累計時間"), ("tottime", "自身時間")):
+        out.write(f"\n===== Top {top} 函式（依{title} {key}） =====\n")
+        stats = pstats.Stats(prof, stream=out)
+        stats.strip_dirs().sort_stats(key).print_stats(top)
+
+    out.write(f"\n===== Top {top} 記憶體配置位置（動作結束時仍存活） =====\n")
+    if snapshot is None:
+        out.write("（無 tracemalloc 快照）\n")
+    else:
+        snapshot = snapshot.filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+        ))
+        for stat in snapshot.statistics("lineno")[:top]:
+            frame = stat.traceback[0]
+            out.write(f"{stat.size / 1024:10.1f} KiB {stat.count:8d} blocks  {frame.filename}:{frame.lineno}\n")
+    return out.getvalue()
+
+
+@contextmanager
+def profiled(action: str, enabled: bool = True, out_dir: str = "profiles", top: int = 30):
+    """
+    with profiled("generate_bol", enabled) as prof: ...
+    啟用時以 cProfile 剖析目前執行緒、以 tracemalloc 追蹤配置，結束後寫出
+    <out_dir>/<時間>_<action>.txt（依累計 / 自身時間排名的函式 + 配置最多的程式行）與同名 .prof。
+    剖析本身出錯只記在 prof.error，不影響被包住的動作；動作的例外照常往外拋。
+    """
+    res = ActionProfile(action)
+    if not enabled:
+        yield res
+        return
+
+    prof = cProfile.Profile()
+    _trace_start()
+    t = time.perf_counter()
+    try:
+        prof.enable()
+    except ValueError as e:   # 同一執行緒已有其他 profiler
+        res.error = f"無法啟動 cProfile：{e}"
+        _trace_stop()
+        yield res
+        return
+    try:
+        yield res
+    except BaseException as e:
+        res.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        prof.disable()
+        res.wall = time.perf_counter() - t
+        snapshot = None
+        try:
+            res.peak_bytes = tracemalloc.get_traced_memory()[1]
+            snapshot = tracemalloc.take_snapshot()
+        finally:
+            _trace_stop()
+        try:
+            os.makedirs(out_dir, exist_ok=True)
+            base = os.path.join(out_dir, f"{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}_{_safe_name(action)}")
+            prof.dump_stats(base + ".prof")
+            with open(base + ".txt", "w", encoding="utf-8") as f:
+                f.write(_format_report(res, prof, snapshot, top))
+            res.path = base + ".txt"
+        except Exception as e:
+            res.error = res.error or f"寫入剖析報告失敗：{e}"
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+# push_ledger.py — WMS 推送紀錄（SQLite），以 (warehouse_code, reference_no) 為鍵避免重複建單
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pushes (
+    warehouse_code TEXT NOT NULL,
+    reference_no   TEXT NOT NULL,
+    ok             INTEGER NOT NULL,          -- 1 = 海外倉回傳成功
+    status         TEXT NOT NULL DEFAULT '',  -- 成功 / 失敗 / 未知 / 送出中 ...
+    http_status    INTEGER,
+    message        TEXT NOT NULL DEFAULT '',
+    pushed_at      TEXT NOT NULL,             -- UTC ISO
+    reserved_at    TEXT,                      -- 送出前佔位的時間（UTC ISO）；寫回結果後清空
+    PRIMARY KEY (warehouse_code, reference_no)
+);
+"""
+INDEXES = "CREATE INDEX IF NOT EXISTS pushes_pushed_at ON pushes (pushed_at);"
+
+PENDING_STATUS = "送出中"
+RESERVE_TIMEOUT = timedelta(minutes=5)   # 佔位超過此時間視為送出者已中斷，可再佔
+REFRESH_INTERVAL = 1.0                   # pushed_warehouses 重讀其他行程寫入的最短間隔（秒）
+
+_COLUMNS = "warehouse_code, reference_no, ok, status, http_status, message, pushed_at"
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _iso(dt: datetime) -> str:
+    return dt.isoformat(timespec="seconds")
+
+
+class PushLedger:
+    """
+    SQLite 是唯一依據：hd_batch 與其他 Streamlit 行程也會寫同一個檔，所以 get / is_pushed 都以主鍵查表。
+    記憶體只快取「已成功」的紀錄（成功不會被後來的失敗覆蓋，快取不會過期）。
+    送出前以 reserve() 用 INSERT … ON CONFLICT 在表內佔位，同一鍵同時只會有一個送出者。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._ok = {}          # (warehouse_code, reference_no) → dict（僅成功）
+        self._by_ref = {}      # reference_no → {warehouse_code, ...}（僅成功）
+        self._seen = ""        # 已讀到的最大 pushed_at
+        self._refreshed = 0.0
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+            cols = {row[1] for row in conn.execute("PRAGMA table_info(pushes)")}
+            if "reserved_at" not in cols:   # 舊版的表：補欄位（多個行程同時升級時，其他行程已補過就略過）
+                try:
+                    conn.execute("ALTER TABLE pushes ADD COLUMN reserved_at TEXT")
+                except sqlite3.OperationalError:
+                    pass
+            conn.executescript(INDEXES)
+        self._refresh(force=True)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _key(warehouse_code: str, reference_no: str) -> tuple:
+        return (warehouse_code or "").strip(), (reference_no or "").strip()
+
+    @staticmethod
+    def _rec(ok, status, http_status, message, pushed_at) -> dict:
+        return {"ok": bool(ok), "status": status, "http_status": http_status, "message": message, "pushed_at": pushed_at}
+
+    def _remember(self, wh, ref, ok, status, http_status, message, pushed_at):
+        rec = self._rec(ok, status, http_status, message, pushed_at)
+        if ok:
+            with self._lock:
+                self._ok[(wh, ref)] = rec
+                self._by_ref.setdefault(ref, set()).add(wh)
+                self._seen = max(self._seen, pushed_at)
+        return rec
+
+    def _refresh(self, force: bool = False):
+        """把（其他行程）新寫入的成功紀錄讀進快取；以 pushed_at 遞增讀，不重讀整張表。"""
+        now = time.monotonic()
+        if not force and now - self._refreshed < REFRESH_INTERVAL:
+            return
+        self._refreshed = now
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT {_COLUMNS} FROM pushes WHERE ok = 1 AND pushed_at >= ?", (self._seen,)
+            ).fetchall()
+        for row in rows:
+            self._remember(*row)
+
+    def get(self, warehouse_code: str, reference_no: str):
+        key = self._key(warehouse_code, reference_no)
+        rec = self._ok.get(key)
+        if rec is not None:
+            return rec
+        with self._connect() as conn:
+            row = conn.execute(
+                f"SELECT {_COLUMNS} FROM pushes WHERE warehouse_code = ? AND reference_no = ?", key
+            ).fetchone()
+        return self._remember(*row) if row else None
+
+    def is_pushed(self, warehouse_code: str, reference_no: str) -> bool:
+        rec = self.get(warehouse_code, reference_no)
+        return bool(rec and rec["ok"])
+
+    def pushed_warehouses(self, reference_no: str) -> set:
+        """此 reference_no 已成功建單的 warehouse_code 集合（含其他行程寫入的，最多延遲 REFRESH_INTERVAL 秒）。"""
+        self._refresh()
+        return self._by_ref.get((reference_no or "").strip(), set())
+
+    def reserve(self, warehouse_code: str, reference_no: str, force: bool = False) -> bool:
+        """
+        送出前佔位；回傳 True 才可送出，之後必須以 record() 寫回結果（會清掉佔位）。
+        已成功建單（force=False）或其他送出者佔位中（未逾 RESERVE_TIMEOUT）時回傳 False。
+        """
+        wh, ref = self._key(warehouse_code, reference_no)
+        if not ref:
+            return True
+        now = _now()
+        with self._connect() as conn:
+            cur = conn.execute(
+                f"INSERT INTO pushes ({_COLUMNS}, reserved_at) VALUES (?, ?, 0, ?, NULL, '', ?, ?) "
+                "ON CONFLICT (warehouse_code, reference_no) DO UPDATE SET reserved_at = excluded.reserved_at "
+                "WHERE (pushes.reserved_at IS NULL OR pushes.reserved_at < ?) AND (pushes.ok = 0 OR ?)",
+                (wh, ref, PENDING_STATUS, _iso(now), _iso(now), _iso(now - RESERVE_TIMEOUT), 1 if force else 0),
+            )
+            return cur.rowcount == 1
+
+    def record(self, warehouse_code: str, reference_no: str, ok: bool, status: str = "",
+               http_status=None, message: str = ""):
+        """寫回結果並清掉佔位；已成功的紀錄不會被失敗覆蓋（避免重送失敗時把「已建單」洗掉）。"""
+        wh, ref = self._key(warehouse_code, reference_no)
+        if not ref:
+            return
+        pushed_at = _iso(_now())
+        message = (message or "")[:500]
+        with self._connect() as conn:
+            conn.execute(
+                f"INSERT INTO pushes ({_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (warehouse_code, reference_no) DO UPDATE SET "
+                "ok = excluded.ok, status = excluded.status, http_status = excluded.http_status, "
+                "message = excluded.message, pushed_at = excluded.pushed_at, reserved_at = NULL "
+                "WHERE excluded.ok = 1 OR pushes.ok = 0",
+                (wh, ref, 1 if ok else 0, status, http_status, message, pushed_at),
+            )
+            if not ok:
+                conn.execute(
+                    "UPDATE pushes SET reserved_at = NULL WHERE warehouse_code = ? AND reference_no = ?", (wh, ref)
+                )
+        if ok:
+            self._remember(wh, ref, ok, status, http_status, message, pushed_at)
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+# teapplix_client.py — Teapplix API 的限速 / 重試用戶端：token bucket、Retry-After、指數退避 + 抖動、遇 429 自動縮小並行數
+import logging
+import random
+import threading
+import time
+from datetime import timezone
+from email.utils import parsedate_to_datetime
+
+import requests
+
+import metrics
+
+log = logging.getLogger("teapplix")
+
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+
+def parse_retry_after(value, now: float = None):
+    """Retry-After 標頭 → 秒數；可為秒數或 HTTP 日期，無法解析回傳 None。"""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    now = time.time() if now is None else now
+    return max(0.0, when.timestamp() - now)
+
+
+class TokenBucket:
+    """
+    每秒補 rate 個權杖、最多存 burst 個；每個請求取一個，沒有就等。rate <= 0 表示不限速。
+    pause(seconds) 讓所有請求都等到該時間之後（伺服器回 Retry-After 時整個用戶端一起停）。
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = float(rate or 0)
+        self.capacity = max(1, int(burst or 1))
+        self._tokens = float(self.capacity)
+        self._stamp = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def pause(self, seconds: float):
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                wait = self._blocked_until - now
+                if wait <= 0:
+                    if self.rate <= 0:
+                        return
+                    self._tokens = min(self.capacity, self._tokens + (now - self._stamp) * self.rate)
+                    self._stamp = now
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class AdaptiveLimiter:
+    """
+    同時在途請求數上限（AIMD）：被限流（429）時減半（cooldown 秒內只減一次，避免同一波 429 連砍），
+    連續成功 limit 次後加 1，最多回到 max_limit。
+    """
+
+    def __init__(self, max_limit: int, min_limit: int = 1, cooldown: float = 1.0):
+        self.max_limit = max(1, int(max_limit))
+        self.min_limit = max(1, min(int(min_limit), self.max_limit))
+        self.limit = self.max_limit
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self._ok_streak = 0
+        self._last_cut = 0.0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self.in_flight >= self.limit:
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self, throttled: bool = False):
+        with self._cond:
+            self.in_flight -= 1
+            if throttled:
+                self._ok_streak = 0
+                now = time.monotonic()
+                if self.limit > self.min_limit and now - self._last_cut >= self.cooldown:
+                    self.limit = max(self.min_limit, self.limit // 2)
+                    self._last_cut = now
+                    log.info("Teapplix 限流，並行數降為 %d", self.limit)
+            else:
+                self._ok_streak += 1
+                if self.limit < self.max_limit and self._ok_streak >= self.limit:
+                    self.limit += 1
+                    self._ok_streak = 0
+            self._cond.notify_all()
+
+
+class TeapplixClient:
+    """
+    包住共用的 requests.Session：每個 GET 先取權杖、再佔一個並行名額。
+    429 / 5xx 與連線錯誤最多重試 retries 次，間隔 backoff * 2**n（上限 max_backoff）並加抖動；
+    429 / 503 有 Retry-After 時以其為準，且整個用戶端一起暫停。執行緒安全，供分頁平行抓取共用。
+    """
+
+    def __init__(self, session: requests.Session, rate: float = 0, burst: int = 1, concurrency: int = 4,
+                 retries: int = 4, backoff: float = 0.5, max_backoff: float = 60.0):
+        self.session = session
+        self.bucket = TokenBucket(rate, burst)
+        self.limiter = AdaptiveLimiter(concurrency)
+        self.retries = max(0, int(retries))
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def _delay(self, attempt: int) -> float:
+        cap = min(self.max_backoff, self.backoff * (2 ** attempt))
+        return random.uniform(cap / 2, cap)
+
+    def get(self, url: str, params: dict = None, headers: dict = None, timeout: float = 45,
+            metric: str = "teapplix_request_seconds") -> requests.Response:
+        """
+        回傳最後一次的 Response（重試用完仍非 200 時由呼叫端處理狀態碼）；
+        連線錯誤重試用完則拋出最後的例外。每次嘗試的延遲都記到 metric（status 標籤）。
+        """
+        attempt = 0
+        while True:
+            self.bucket.acquire()
+            self.limiter.acquire()
+            throttled = False
+            t = time.perf_counter()
+            try:
+                r = self.session.get(url, params=params, headers=headers, timeout=timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                metrics.observe(metric, time.perf_counter() - t, status="error")
+                if attempt >= self.retries:
+                    raise
+                delay = self._delay(attempt)
+                log.info("Teapplix 連線錯誤（%s），%.1f 秒後重試 %d/%d", e, delay, attempt + 1, self.retries)
+                metrics.inc("teapplix_retries_total", reason="error")
+            else:
+                metrics.observe(metric, time.perf_counter() - t, status=str(r.status_code))
+                throttled = r.status_code == 429
+                if r.status_code not in RETRY_STATUS or attempt >= self.retries:
+                    return r
+                retry_after = parse_retry_after(r.headers.get("Retry-After")) if r.status_code in (429, 503) else None
+                delay = min(self.max_backoff, retry_after) if retry_after is not None else self._delay(attempt)
+                if throttled or retry_after is not None:
+                    self.bucket.pause(delay)   # 伺服器要求降速：其他執行緒的下一個請求也一起等
+                log.info("Teapplix HTTP %d，%.1f 秒後重試 %d/%d", r.status_code, delay, attempt + 1, self.retries)
+                metrics.inc("teapplix_retries_total", reason=str(r.status_code))
+                r.close()
+            finally:
+                self.limiter.release(throttled)
+            time.sleep(delay)
+            attempt += 1